@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import json
+import os
 import sagemaker
 
 import aws_cdk as cdk
@@ -16,6 +18,20 @@ env = {
 
 endpoint_name = 'mammography-classification-endpoint'
 
+# Dataset summary written by scripts/build_dataset.py --summary
+DATASET_MANIFEST = 'dataset_manifest.json'
+
+
+def load_dataset_manifest(path=DATASET_MANIFEST):
+    if not os.path.exists(path):
+        print(f"{path} not found, using the default training hyperparameters")
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+dataset_manifest = load_dataset_manifest()
+
 image_uri = sagemaker.image_uris.retrieve(
     region=Aws.REGION,
     framework="image-classification")
@@ -33,20 +49,118 @@ hyperparameters={
             "precision_dtype": "float32"
         }
 
+# Derive the data-dependent hyperparameters from the dataset that was built
+if dataset_manifest:
+    hyperparameters["num_training_samples"] = str(dataset_manifest["num_training_samples"])
+    hyperparameters["num_classes"] = str(dataset_manifest["num_classes"])
+    hyperparameters["image_shape"] = dataset_manifest["image_shape"]
+
+# Inference endpoint per environment (DEPLOY_ENV): serverless where traffic is
+# sparse and a cold start is acceptable, autoscaled instances otherwise
+endpoint_configs = {
+    "dev": {
+        "mode": "serverless",
+        "serverless": {"memory_size_mb": 3072, "max_concurrency": 5},
+    },
+    "prod": {
+        "mode": "instance",
+        "autoscaling": {"min_capacity": 1, "max_capacity": 4, "target_invocations_per_instance": 600,
+                        "scale_in_cooldown": 300, "scale_out_cooldown": 60},
+        # a retrain sends 25% of the capacity to the new model for 5 minutes first
+        "rollout": {"mode": "canary", "step_percent": 25, "wait_seconds": 300, "termination_wait_seconds": 300},
+    },
+}
+deploy_env = os.environ.get("DEPLOY_ENV", "prod")
+
+# Network profile (VPC_PROFILE), chosen separately from DEPLOY_ENV: "default"
+# is vpc_config.DEFAULT_VPC, one NAT gateway and no VPC endpoints. The others
+# are opt-in and cost more: the inference calls of the Lambda functions go
+# through VPC endpoints (interface endpoints are billed per AZ), and "prod"
+# adds a NAT gateway per AZ for the rest
+vpc_profile = os.environ.get("VPC_PROFILE", "default")
+vpc_configs = {
+    "default": {},
+    "endpoints": {"nat_gateways": 1, "vpc_endpoints": True},
+    "prod": {"nat_gateways": 2, "vpc_endpoints": True},
+}
+
+# the opencv, numpy and pydicom layers in lambda_layers/ are built for this runtime
+frontend_lambda_runtime = "python3.9"
+
 sagemaker_configs = {
     "hyperparameters": hyperparameters,
     "image_uri": image_uri,
     "endpoint_name": endpoint_name,
     "training_instance_type": "p3.2xlarge",
     "inference_instance_type": "m5.large",
+    "dataset_manifest": dataset_manifest,
+    # "File", "Pipe" (RecordIO) or "auto" to pick from the dataset size
+    "training_input_mode": "auto",
+    "endpoint": endpoint_configs[deploy_env],
+    # Train every combination with a tuning job and deploy the most accurate
+    # model; None trains the single configuration in hyperparameters
+    "hyperparameter_search": None,
+    # Managed spot training with checkpoints in s3://.../model/checkpoints/<run>;
+    # max_wait_hours includes the 2 h training max runtime. Set enabled to
+    # opt in: a run can then wait up to max_wait_hours for spot capacity
+    "spot_training": {"enabled": False, "max_wait_hours": 4},
+    # Bulk classification workflow (batch-classification-state-machine), set
+    # enabled and pandas_layer_arn to deploy it
+    "batch_transform": {
+        "enabled": False,
+        "instance_type": "m5.large",
+        "instance_count": 2,
+        "max_concurrent_transforms": 2,
+        "batch_strategy": "SingleRecord",
+        "chunk_size": 500,
+        "preprocess_concurrency": 10,
+        "lambda_runtime": frontend_lambda_runtime,
+        # ARN of the AWS SDK for pandas layer (pyarrow) matching the region and
+        # lambda_runtime, as listed in the AWS SDK for pandas documentation
+        "pandas_layer_arn": None,
+    },
+    # "hyperparameter_search": {
+    #     "grid": {"num_layers": ["18", "34"], "learning_rate": ["0.001", "0.01"], "mini_batch_size": ["60", "120"]},
+    #     "max_parallel_jobs": 4,
+    # },
+}
+
+frontend_configs = {
+    # SQS messages (jobs) per invocation of the async worker
+    "worker_batch_size": 5,
+    "model_bucket": "mammo-v2-ecs-model-files",
+    # run the endpoint on upload as well as the resize, so the prediction is
+    # cached before it is asked for; each upload then costs an invocation
+    "precompute_predictions": False,
+    "lambda_runtime": frontend_lambda_runtime,
+    # pre-initialized environments behind the API; SnapStart needs python3.12 or later
+    "provisioned_concurrency": 0,
+    "snap_start": False,
+    # resize in the Fargate task and send only the 150x300 image to the API;
+    # originals are archived to S3 only when persist_originals is set. Opt in:
+    # the tasks then need the CPU for the resizing
+    "web_preprocess": False,
+    "persist_originals": True,
+    # Streamlit service, see web_service_config.DEFAULT_WEB_SERVICE: one on-demand
+    # task plus Fargate Spot, scaled on ALB requests per task and CPU
+    "web_service": {
+        "capacity_provider_strategy": [
+            {"capacity_provider": "FARGATE", "base": 1, "weight": 1},
+            {"capacity_provider": "FARGATE_SPOT", "weight": 3},
+        ],
+        "max_capacity": 10,
+        "requests_per_target": 1000,
+        "ec2_spot_capacity": None,
+    },
 }
 
 
 app = cdk.App()
 
-vpc_network = MammoScanVpcStack(app, "MammoScanVpcStack")
+vpc_network = MammoScanVpcStack(app, "MammoScanVpcStack", vpc_configs=vpc_configs[vpc_profile])
 
-FrontEndWebStack(app, "FrontEndWebStack", vpc=vpc_network.get_vpc, sagemaker_configs=sagemaker_configs, env=env)
+FrontEndWebStack(app, "FrontEndWebStack", vpc=vpc_network.get_vpc, sagemaker_configs=sagemaker_configs,
+                 frontend_configs=frontend_configs, env=env)
 
 SageMakerStack(app, "SagemakerStack", sagemaker_configs=sagemaker_configs, env=env)
 
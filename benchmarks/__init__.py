@@ -0,0 +1,26 @@
+"""Offline benchmarks for the inference Lambdas.
+
+The Lambda code is deployed from asset folders rather than installed as a
+package, so the folders are put on ``sys.path`` here the same way the
+Lambda runtime sees them.
+"""
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT_DIR, "mammo_scan_ecs", "lambda")
+
+LAMBDA_CODE_PATHS = [
+    os.path.join(LAMBDA_DIR, "common", "python"),
+    os.path.join(LAMBDA_DIR, "classify"),
+    os.path.join(LAMBDA_DIR, "resize"),
+    os.path.join(LAMBDA_DIR, "batch"),
+]
+
+for path in LAMBDA_CODE_PATHS:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# The handlers create boto3 clients at import time
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("ENDPOINT_NAME", "mammography-classification-endpoint")
@@ -0,0 +1,74 @@
+"""Throughput of the async classification worker per SQS batch size.
+
+Jobs are queued through the API handler, then drained by the worker handler
+one batch at a time (a single worker instance), against stubbed clients.
+
+    python -m benchmarks.async_worker --jobs 100 --batch-sizes 1,5,10
+"""
+import argparse
+import json
+import time
+
+from benchmarks import images
+from benchmarks.stubs import StubS3, StubSageMaker, StubSageMakerRuntime
+
+import lambda_classify_worker
+import lambda_invoke_classifier
+from mammo_common import jobs, prediction_cache, preprocessing
+
+
+def install_stubs(filenames, original, args):
+    lambda_invoke_classifier.s3 = StubS3(
+        {(lambda_invoke_classifier.bucket, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, filename)): original
+         for filename in filenames},
+        latency=args.s3_latency)
+    lambda_invoke_classifier.sagemaker = StubSageMakerRuntime(latency=args.endpoint_latency)
+    lambda_invoke_classifier.sagemaker_control = StubSageMaker()
+    lambda_invoke_classifier.PREPROCESS_MODE = "inline"
+    # identical images would otherwise be served from the cache
+    lambda_invoke_classifier.predictions = prediction_cache.PredictionCache(max_entries=0)
+    lambda_invoke_classifier.job_store = jobs.InMemoryJobStore()
+    lambda_invoke_classifier.job_queue = jobs.InMemoryJobQueue()
+
+
+def run(batch_size, original, args):
+    filenames = ["job-{}.jpg".format(i) for i in range(args.jobs)]
+    install_stubs(filenames, original, args)
+    for filename in filenames:
+        lambda_invoke_classifier.lambda_handler(
+            {"httpMethod": "POST", "path": "/jobs", "body": json.dumps({"filename": filename})}, None)
+
+    queue = lambda_invoke_classifier.job_queue
+    start = time.perf_counter()
+    invocations = 0
+    while True:
+        event = queue.receive_event(batch_size)
+        if event is None:
+            break
+        lambda_classify_worker.lambda_handler(event, None)
+        invocations += 1
+    elapsed = time.perf_counter() - start
+
+    done = sum(job["status"] == jobs.SUCCEEDED for job in lambda_invoke_classifier.job_store.jobs.values())
+    return done, invocations, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=60)
+    parser.add_argument("--batch-sizes", default="1,5,10")
+    parser.add_argument("--s3-latency", type=float, default=0.03)
+    parser.add_argument("--endpoint-latency", type=float, default=0.08)
+    args = parser.parse_args()
+
+    original = images.encode(images.synthetic_mammogram(2000, 2666))
+    print("{} single-image jobs, PREPROCESS_WORKERS={} INVOKE_CONCURRENCY={}".format(
+        args.jobs, lambda_invoke_classifier.PREPROCESS_WORKERS, lambda_invoke_classifier.INVOKE_CONCURRENCY))
+    for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+        done, invocations, elapsed = run(batch_size, original, args)
+        print("batch size {:>3}: {:>3} jobs in {:>6.2f} s, {:>6.1f} jobs/s, {:>3} worker invocations".format(
+            batch_size, done, elapsed, done / elapsed, invocations))
+
+
+if __name__ == "__main__":
+    main()
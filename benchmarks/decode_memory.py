@@ -0,0 +1,98 @@
+"""Peak RSS and latency of full versus reduced-scale decoding.
+
+Every measurement runs in a fresh process. The RSS high-water mark is reset
+(Linux ``/proc/self/clear_refs``) once the interpreter, cv2 and the encoded
+image are loaded, so the reported peak is what the decode itself adds.
+
+    python -m benchmarks.decode_memory --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import images
+
+SIZES = [(1000, 1333), (2000, 2666), (3000, 4000), (4000, 5300)]
+
+
+def read_status_mib(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def reset_peak_rss():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def measure(path, mode, repeat):
+    from mammo_common import preprocessing
+
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+
+    peaks = []
+    latencies = []
+    for _ in range(repeat):
+        baseline = read_status_mib("VmRSS")
+        reset_peak_rss()
+        start = time.perf_counter()
+        if mode == "full":
+            # the original path: full decode, then resize
+            image = preprocessing.decode_image(image_bytes)
+            resized = preprocessing.to_uint8(preprocessing.resize_image(image))
+            preprocessing.encode_image(resized)
+        else:
+            preprocessing.preprocess_image(image_bytes)
+        latencies.append(time.perf_counter() - start)
+        peaks.append(read_status_mib("VmHWM") - baseline)
+
+    return {"peak_rss_mib": max(peaks), "latency_ms": statistics.median(latencies) * 1000}
+
+
+def run_child(path, mode, repeat):
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.decode_memory", "--child", path, mode, "--repeat", str(repeat)])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", nargs=2, metavar=("PATH", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child[0], args.child[1], args.repeat)))
+        return
+
+    print("{:>11} {:>6} {:>10} {:>14} {:>12}".format("size", "format", "mode", "peak RSS MiB", "latency ms"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in SIZES:
+            image = images.synthetic_mammogram(width, height)
+            cases = [
+                ("jpeg", images.encode(image, ".jpg")),
+                # 12-bit data in a 16-bit PNG, as exported by most PACS
+                ("png16", images.encode((image.astype("uint16") * 16), ".png")),
+            ]
+            for name, data in cases:
+                path = os.path.join(tmp, "{}x{}.{}".format(width, height, name))
+                with open(path, "wb") as f:
+                    f.write(data)
+                for mode in ("full", "reduced"):
+                    result = run_child(path, mode, args.repeat)
+                    print("{:>11} {:>6} {:>10} {:>14.1f} {:>12.1f}".format(
+                        "{}x{}".format(width, height), name, mode,
+                        result["peak_rss_mib"], result["latency_ms"]))
+
+
+if __name__ == "__main__":
+    main()
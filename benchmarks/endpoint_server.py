@@ -0,0 +1,179 @@
+"""Local stand-in for the SageMaker runtime InvokeEndpoint API.
+
+Serves ``POST /endpoints/<name>/invocations`` for ``application/x-image``
+like the image-classification endpoint: the response is a JSON list of 5
+class probabilities, derived from the image hash so the same image always
+gets the same answer. A boto3 ``sagemaker-runtime`` client pointed at it
+with ``endpoint_url`` works unchanged.
+
+The defaults mimic one ``ml.m5.large`` instance (2 vCPUs): 2 requests are
+served at a time, up to ``--queue-limit`` more wait for a slot and the rest
+are throttled with a 429, as the real endpoint does when it is saturated.
+
+    python -m benchmarks.endpoint_server --port 8080 --latency-ms 60 --jitter 0.3 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+NUM_CLASSES = 5
+INSTANCE_PROFILES = {
+    # vCPUs serve one request each; latencies of the built-in image-classification
+    # algorithm (ResNet-18, 3x300x150) on CPU
+    "ml.m5.large": {"concurrency": 2, "latency_ms": 60},
+    "ml.m5.xlarge": {"concurrency": 4, "latency_ms": 55},
+    "ml.c5.xlarge": {"concurrency": 4, "latency_ms": 40},
+}
+
+
+def probabilities(body):
+    """Deterministic 5-class softmax for an image."""
+    seed = int.from_bytes(hashlib.sha256(body).digest()[:8], "little")
+    logits = np.random.default_rng(seed).normal(0, 2, NUM_CLASSES)
+    exp = np.exp(logits - logits.max())
+    return (exp / exp.sum()).round(6).tolist()
+
+
+class EndpointModel:
+    """Latency, error and concurrency behaviour of the simulated endpoint.
+
+    :param latency_ms: median model latency
+    :param jitter: sigma of the log-normal latency distribution, 0 for a fixed latency
+    :param error_rate: share of requests answered with a ModelError
+    :param concurrency: requests processed at once (vCPUs of the instance)
+    :param queue_limit: requests allowed to wait for a slot before throttling
+    """
+
+    def __init__(self, latency_ms=60, jitter=0.25, error_rate=0.0, concurrency=2, queue_limit=8, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slots = threading.Semaphore(concurrency)
+        self.queue_limit = queue_limit
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+    def sample_latency(self):
+        with self._lock:
+            if not self.jitter:
+                return self.latency_ms / 1000
+            return self.random.lognormvariate(0, self.jitter) * self.latency_ms / 1000
+
+    def fails(self):
+        with self._lock:
+            return self.random.random() < self.error_rate
+
+    def invoke(self, body):
+        """:return: (status, error type or None, response body)"""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.waiting >= self.queue_limit:
+                self.stats["throttled"] += 1
+                return 429, "ThrottlingException", {"message": "Rate exceeded"}
+            self.waiting += 1
+
+        self.slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+        try:
+            time.sleep(self.sample_latency())
+            if self.fails():
+                with self._lock:
+                    self.stats["errors"] += 1
+                return 424, "ModelError", {"message": "Received server error (500) from primary"}
+            return 200, None, probabilities(body)
+        finally:
+            self.slots.release()
+
+
+def make_handler(model):
+
+    class InvokeEndpointHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "endpoints" or parts[2] != "invocations":
+                return self.reply(404, "UnknownOperationException", {"message": "Unknown path"})
+            if self.headers.get("Content-Type") != "application/x-image":
+                return self.reply(400, "ValidationError", {"message": "Content type must be application/x-image"})
+
+            status, error, payload = model.invoke(body)
+            self.reply(status, error, payload)
+
+        def reply(self, status, error, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if error:
+                # botocore reads the error code of rest-json services from this header
+                self.send_header("x-amzn-ErrorType", error)
+            else:
+                self.send_header("x-Amzn-Invoked-Production-Variant", "AllTraffic")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return InvokeEndpointHandler
+
+
+def start_server(model, host="127.0.0.1", port=0):
+    """Serve in a background thread.
+
+    :return: (server, endpoint_url); stop with ``server.shutdown()``
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(model))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}".format(*server.server_address)
+
+
+def add_model_arguments(parser):
+    parser.add_argument("--instance-type", choices=sorted(INSTANCE_PROFILES), default="ml.m5.large")
+    parser.add_argument("--instance-count", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, help="median latency, defaults to the instance profile")
+    parser.add_argument("--jitter", type=float, default=0.25, help="sigma of the log-normal latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--queue-limit", type=int, default=8, help="waiting requests per instance before throttling")
+
+
+def model_from_args(args):
+    profile = INSTANCE_PROFILES[args.instance_type]
+    return EndpointModel(
+        latency_ms=args.latency_ms or profile["latency_ms"],
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        concurrency=profile["concurrency"] * args.instance_count,
+        queue_limit=args.queue_limit * args.instance_count,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_model_arguments(parser)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(model_from_args(args)))
+    print("InvokeEndpoint stand-in on http://{}:{}".format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Synthetic mammogram-like test images."""
+import cv2
+import numpy as np
+
+
+def synthetic_mammogram(width=3000, height=4000, seed=0):
+    """Bright, noisy half-ellipse on a black background, as a uint8 array."""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width), np.uint8)
+    center = (0, height // 2)
+    axes = (int(width * 0.7), int(height * 0.45))
+    cv2.ellipse(image, center, axes, 0, -90, 90, 170, -1)
+    noise = rng.integers(0, 60, size=(height, width), dtype=np.uint8)
+    return np.where(image > 0, cv2.add(image, noise), 0).astype(np.uint8)
+
+
+def encode(image, ext=".jpg"):
+    ok, buffer = cv2.imencode(ext, image)
+    assert ok
+    return buffer.tobytes()
+
+
+def encode_dicom(frames, bits_stored=12, photometric="MONOCHROME2", window=None, jpeg=False):
+    """DICOM Part 10 file holding the given frames.
+
+    :param frames: 2-D array, or list of 2-D arrays for a multi-frame file
+    :param window: (center, width) written as the VOI window, or None
+    :param jpeg: encapsulate the frames as JPEG baseline (8-bit frames only)
+    :return: bytes
+    """
+    import io
+
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.encaps import encapsulate
+    from pydicom.uid import (DigitalMammographyXRayImageStorageForPresentation, ExplicitVRLittleEndian,
+                             JPEGBaseline8Bit, generate_uid)
+
+    frames = [frames] if np.ndim(frames) == 2 else list(frames)
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = DigitalMammographyXRayImageStorageForPresentation
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = JPEGBaseline8Bit if jpeg else ExplicitVRLittleEndian
+
+    dataset = Dataset()
+    dataset.file_meta = meta
+    dataset.SOPClassUID = meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dataset.Rows, dataset.Columns = frames[0].shape
+    dataset.NumberOfFrames = len(frames)
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = photometric
+    dataset.BitsAllocated = 8 if jpeg else 16
+    dataset.BitsStored = 8 if jpeg else bits_stored
+    dataset.HighBit = dataset.BitsStored - 1
+    dataset.PixelRepresentation = 0
+    if window is not None:
+        dataset.WindowCenter, dataset.WindowWidth = window
+    if jpeg:
+        dataset.PixelData = encapsulate([encode(frame) for frame in frames])
+        dataset["PixelData"].VR = "OB"
+    else:
+        dataset.PixelData = np.stack(frames).astype(np.uint16).tobytes()
+
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
@@ -0,0 +1,208 @@
+"""Open-loop load test of the classify handler, stepping up the request rate.
+
+Requests are started on a fixed schedule (target RPS), whether or not the
+previous ones are done, so queueing shows up as latency. Each step reports
+the achieved throughput, latency percentiles, errors and throttles, and the
+first step that misses the target, the latency SLA or the error budget is
+reported as the saturation point.
+
+By default the classify handler runs in-process, as ``--lambda-concurrency``
+concurrent Lambda containers, with inline images and the prediction cache
+disabled. Its SageMaker client is a real boto3 client pointed at the local
+InvokeEndpoint stand-in (``benchmarks.endpoint_server``), started here
+unless ``--endpoint-url`` is given. ``--url`` sends the requests to a
+deployed API instead.
+
+    python -m benchmarks.load_generator --rps 5,10,20,40 --duration 10 --lambda-concurrency 20
+    python -m benchmarks.load_generator --instance-type ml.m5.large --instance-count 2
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import endpoint_server, images
+from benchmarks.stats import percentile
+
+# Saturated when below this share of the target rate, or above this error/throttle rate
+MIN_ACHIEVED_SHARE = 0.9
+MAX_FAILURE_RATE = 0.01
+
+
+def in_process_target(endpoint_url, lambda_concurrency):
+    """:return: a callable sending one inline image through the classify handler"""
+    # the stand-in does not check signatures, but botocore needs credentials to sign
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+
+    import boto3
+    from botocore.config import Config
+
+    import lambda_invoke_classifier
+    from benchmarks.stubs import StubSageMaker
+    from mammo_common import prediction_cache
+
+    lambda_invoke_classifier.sagemaker = boto3.client(
+        "sagemaker-runtime", endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=lambda_concurrency, retries={"mode": "standard"}))
+    lambda_invoke_classifier.sagemaker_control = StubSageMaker()
+    lambda_invoke_classifier.model_version = {"value": None, "expires_at": 0}
+    lambda_invoke_classifier.predictions = prediction_cache.PredictionCache(max_entries=0)
+    # one slot per simulated container, the real limit is per container
+    lambda_invoke_classifier.invoke_slots = threading.BoundedSemaphore(lambda_concurrency)
+
+    original = images.encode(images.synthetic_mammogram(2000, 2666))
+    event = {"body": json.dumps({"image": base64.b64encode(original).decode()})}
+
+    def send():
+        response = lambda_invoke_classifier.lambda_handler(event, None)
+        return response["statusCode"]
+
+    return send
+
+
+def http_target(url):
+    import requests
+
+    session = requests.Session()
+    original = images.encode(images.synthetic_mammogram(2000, 2666))
+
+    def send():
+        return session.post(url, data=original, timeout=30,
+                            headers={"Content-Type": "image/jpeg", "Accept": "application/json"}).status_code
+
+    return send
+
+
+async def run_step(send, rps, duration, executor, concurrency):
+    """:return: step summary dict"""
+    loop = asyncio.get_running_loop()
+    in_flight = [0]
+    outcomes = []
+
+    def timed():
+        start = time.perf_counter()
+        try:
+            status = send()
+        except Exception as e:
+            status = type(e).__name__
+        return status, (time.perf_counter() - start) * 1000
+
+    async def one():
+        if in_flight[0] >= concurrency:
+            # Lambda rejects invocations above the concurrency limit
+            outcomes.append(("throttled", 0.0))
+            return
+        in_flight[0] += 1
+        try:
+            outcomes.append(await loop.run_in_executor(executor, timed))
+        finally:
+            in_flight[0] -= 1
+
+    total = max(1, int(rps * duration))
+    started = time.perf_counter()
+    tasks = []
+    for index in range(total):
+        delay = started + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for status, latency in outcomes if status == 200]
+    throttled = sum(status == "throttled" for status, _ in outcomes)
+    errors = len(outcomes) - len(latencies) - throttled
+    return {
+        "target_rps": rps,
+        "achieved_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) if latencies else None,
+        "p95_ms": percentile(latencies, 95) if latencies else None,
+        "p99_ms": percentile(latencies, 99) if latencies else None,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "errors": errors,
+        "throttled": throttled,
+        "requests": len(outcomes),
+    }
+
+
+def saturated(step, sla_ms):
+    failures = (step["errors"] + step["throttled"]) / step["requests"]
+    return (step["achieved_rps"] < MIN_ACHIEVED_SHARE * step["target_rps"]
+            or step["p95_ms"] is None or step["p95_ms"] > sla_ms
+            or failures > MAX_FAILURE_RATE)
+
+
+async def run(send, rates, duration, concurrency, sla_ms, out):
+    steps = []
+    print("{:>7} {:>9} {:>8} {:>8} {:>8} {:>7} {:>9}".format(
+        "target", "achieved", "p50 ms", "p95 ms", "p99 ms", "errors", "throttled"), file=out)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for rps in rates:
+            step = await run_step(send, rps, duration, executor, concurrency)
+            steps.append(step)
+            print("{:>7.1f} {:>9.1f} {:>8} {:>8} {:>8} {:>7} {:>9}".format(
+                rps, step["achieved_rps"],
+                *("{:.0f}".format(step[key]) if step[key] is not None else "-" for key in ("p50_ms", "p95_ms", "p99_ms")),
+                step["errors"], step["throttled"]), file=out, flush=True)
+            if saturated(step, sla_ms):
+                break
+    return steps
+
+
+def report(steps, sla_ms, out):
+    healthy = [step for step in steps if not saturated(step, sla_ms)]
+    if len(healthy) == len(steps):
+        print("not saturated up to {} rps".format(steps[-1]["target_rps"]), file=out)
+    else:
+        print("saturated at {} rps".format(steps[len(healthy)]["target_rps"]), file=out)
+    if healthy:
+        best = healthy[-1]
+        # Little's law: requests in flight = arrival rate x time in the system
+        print("highest healthy rate {:.1f} rps: ~{:.1f} concurrent Lambda executions at p50 {:.0f} ms".format(
+            best["achieved_rps"], best["achieved_rps"] * best["mean_ms"] / 1000, best["p50_ms"]), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rps", default="2,5,10,20,40", help="request rates to step through")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per step")
+    parser.add_argument("--lambda-concurrency", type=int, default=10)
+    parser.add_argument("--sla-ms", type=float, default=2000, help="p95 latency budget")
+    parser.add_argument("--url", help="send requests to this API instead of the in-process handler")
+    parser.add_argument("--endpoint-url", help="running InvokeEndpoint stand-in, one is started otherwise")
+    endpoint_server.add_model_arguments(parser)
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+    server = None
+    if args.url:
+        send = http_target(args.url)
+    else:
+        endpoint_url = args.endpoint_url
+        if endpoint_url is None:
+            model = endpoint_server.model_from_args(args)
+            server, endpoint_url = endpoint_server.start_server(model)
+            print("endpoint stand-in: {} x {} at {}".format(args.instance_count, args.instance_type, endpoint_url))
+        send = in_process_target(endpoint_url, args.lambda_concurrency)
+
+    rates = [float(rate) for rate in args.rps.split(",")]
+    try:
+        # the handlers print a log line per request
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            steps = asyncio.run(run(send, rates, args.duration, args.lambda_concurrency, args.sla_ms, out))
+    finally:
+        if server is not None:
+            server.shutdown()
+    report(steps, args.sla_ms, out)
+    return steps
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compare the per-request latency of the classify Lambda preprocessing modes.
+
+"lambda" is the original chain (SSM lookup, nested resize Lambda, S3 GET of
+the original, S3 PUT and GET of the resized copy); "inline" resizes in
+memory inside the classify Lambda.
+
+    python -m benchmarks.preprocess_mode --requests 20 --s3-latency 0.03
+"""
+import argparse
+import json
+import statistics
+import time
+from collections import Counter
+
+from benchmarks import images
+from benchmarks.stubs import StubLambda, StubS3, StubSageMaker, StubSageMakerRuntime, StubSSM
+
+import lambda_invoke_classifier
+import lambda_resize_image
+from mammo_common import parameters, prediction_cache, preprocessing
+
+FILENAME = "benchmark.jpg"
+RESIZE_FUNCTION = "resize-function"
+
+
+def install_stubs(original, args):
+    s3 = StubS3(
+        {(lambda_invoke_classifier.bucket, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, FILENAME)): original},
+        latency=args.s3_latency)
+    ssm = StubSSM({"resize-lambda": RESIZE_FUNCTION}, latency=args.ssm_latency)
+    lambda_client = StubLambda({RESIZE_FUNCTION: lambda_resize_image.lambda_handler},
+                               latency=args.invoke_latency)
+    sagemaker = StubSageMakerRuntime(latency=args.endpoint_latency)
+
+    lambda_resize_image.s3 = s3
+    lambda_invoke_classifier.s3 = s3
+    lambda_invoke_classifier.ssm_client = ssm
+    lambda_invoke_classifier.ssm_parameters = parameters.ParameterCache(ssm)
+    lambda_invoke_classifier.lambda_client = lambda_client
+    lambda_invoke_classifier.sagemaker = sagemaker
+    lambda_invoke_classifier.sagemaker_control = StubSageMaker()
+    # every request must pay for preprocessing, so nothing may be cached
+    lambda_invoke_classifier.predictions = prediction_cache.PredictionCache(max_entries=0)
+    return [s3, ssm, lambda_client, sagemaker]
+
+
+def run_mode(mode, original, args):
+    lambda_invoke_classifier.PREPROCESS_MODE = mode
+    clients = install_stubs(original, args)
+    event = {"body": json.dumps({"filename": FILENAME})}
+
+    latencies = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        lambda_invoke_classifier.lambda_handler(event, None)
+        latencies.append(time.perf_counter() - start)
+
+    calls = Counter()
+    for client in clients:
+        calls.update(client.calls)
+    return latencies, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--s3-latency", type=float, default=0.03)
+    parser.add_argument("--ssm-latency", type=float, default=0.02)
+    parser.add_argument("--invoke-latency", type=float, default=0.05,
+                        help="overhead of a warm nested Lambda invoke")
+    parser.add_argument("--endpoint-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    original = images.encode(images.synthetic_mammogram(args.width, args.height))
+    print("original: {}x{} ({} bytes), {} requests per mode".format(
+        args.width, args.height, len(original), args.requests))
+
+    for mode in ("lambda", "inline"):
+        latencies, calls = run_mode(mode, original, args)
+        per_request = {name: count // args.requests for name, count in sorted(calls.items())}
+        print("{:>6}: mean {:7.1f} ms  p50 {:7.1f} ms  max {:7.1f} ms  calls/request {}".format(
+            mode,
+            statistics.mean(latencies) * 1000,
+            statistics.median(latencies) * 1000,
+            max(latencies) * 1000,
+            per_request))
+
+
+if __name__ == "__main__":
+    main()
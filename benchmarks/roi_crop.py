@@ -0,0 +1,75 @@
+"""Per-stage latency and tissue share of the model input, with and without ROI cropping.
+
+The resized image is always TARGET_SIZE, so the crop does not change the
+payload size much; what it changes is the share of the model input that is
+breast tissue rather than background, and the pixels the resize has to read.
+
+    python -m benchmarks.roi_crop --repeat 5 --padding 0.02
+"""
+import argparse
+import contextlib
+import os
+import statistics
+
+import numpy as np
+
+from benchmarks import images
+from mammo_common import preprocessing, tracing
+
+SIZES = [(2000, 2666), (3000, 4000)]
+STAGES = ("decode", "roi", "resize", "encode")
+
+
+def tissue_share(encoded):
+    """:return: share of the pixels of the model input above the background"""
+    image = preprocessing.decode_image(encoded)
+    return float(np.count_nonzero(image > 20)) / image.size
+
+
+def measure(image_bytes, padding, repeat):
+    stages = {stage: [] for stage in STAGES}
+    saved = []
+    for _ in range(repeat):
+        trace = tracing.start("benchmark")
+        output = preprocessing.preprocess_image(image_bytes, roi_padding=padding)
+        # finish() prints the EMF line of the trace
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            tracing.finish()
+        for stage in STAGES:
+            stages[stage].extend(trace.spans.get(stage, [0.0]))
+        saved.extend(trace.measurements.get("RoiBytesSaved", (None, [0]))[1])
+    return {
+        "stages_ms": {stage: statistics.median(values) for stage, values in stages.items()},
+        "output_bytes": len(output),
+        "tissue_share": tissue_share(output),
+        "bytes_saved": statistics.median(saved),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--padding", type=float, default=preprocessing.DEFAULT_ROI_PADDING)
+    args = parser.parse_args()
+
+    print("{:>11} {:>6} {:>5} {:>9} {:>7} {:>9} {:>9} {:>10} {:>7} {:>12}".format(
+        "size", "format", "crop", "decode ms", "roi ms", "resize ms", "encode ms", "out bytes", "tissue",
+        "MiB skipped"))
+    for width, height in SIZES:
+        image = images.synthetic_mammogram(width, height)
+        cases = [
+            ("jpeg", images.encode(image, ".jpg")),
+            # 12-bit data in a 16-bit PNG, as exported by most PACS
+            ("png16", images.encode((image.astype("uint16") * 16), ".png")),
+        ]
+        for name, data in cases:
+            for padding in (None, args.padding):
+                result = measure(data, padding, args.repeat)
+                print("{:>11} {:>6} {:>5} {:>9.1f} {:>7.1f} {:>9.1f} {:>9.1f} {:>10} {:>6.0%} {:>12.1f}".format(
+                    "{}x{}".format(width, height), name, "no" if padding is None else "yes",
+                    *(result["stages_ms"][stage] for stage in STAGES),
+                    result["output_bytes"], result["tissue_share"], result["bytes_saved"] / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
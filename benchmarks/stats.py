@@ -0,0 +1,12 @@
+"""Summary statistics shared by the benchmarks."""
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile.
+
+    :param values: non-empty sequence of numbers
+    :param percent: 0 to 100
+    """
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
@@ -0,0 +1,200 @@
+"""In-memory stand-ins for the boto3 clients used by the Lambda handlers.
+
+Each stub sleeps ``latency`` seconds per call to mimic the network round
+trip, counts calls per operation in ``calls`` and records the highest number
+of concurrent calls in ``max_in_flight``.
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+def client_error(code, operation_name):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation_name)
+
+
+class StubClient:
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _call(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class StubS3(StubClient):
+
+    def __init__(self, objects=None, latency=0.0):
+        super().__init__(latency)
+        # {(bucket, key): bytes}
+        self.objects = dict(objects or {})
+        # keys per ListObjectsV2 page returned by the paginator
+        self.page_size = 1000
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("GetObject")
+        if (Bucket, Key) not in self.objects:
+            raise client_error("NoSuchKey", "GetObject")
+        body = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call("PutObject")
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = bytes(Body)
+        return {}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("HeadObject")
+        if (Bucket, Key) not in self.objects:
+            raise client_error("404", "HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)]), "ETag": self._etag(Bucket, Key)}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._call("DeleteObjects")
+        assert len(Delete["Objects"]) <= 1000
+        for item in Delete["Objects"]:
+            self.objects.pop((Bucket, item["Key"]), None)
+        return {"Deleted": [{"Key": item["Key"]} for item in Delete["Objects"]]}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._call("ListObjectsV2")
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {"Contents": [{"Key": key, "ETag": self._etag(Bucket, key), "Size": len(self.objects[(Bucket, key)])}
+                                 for key in page],
+                    "IsTruncated": start + MaxKeys < len(keys)}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        return StubListObjectsPaginator(self, self.page_size)
+
+    def _etag(self, Bucket, Key):
+        return '"{}"'.format(hashlib.md5(self.objects[(Bucket, Key)]).hexdigest())
+
+
+class StubListObjectsPaginator:
+
+    def __init__(self, s3, page_size=1000):
+        self.s3 = s3
+        self.page_size = page_size
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.s3.list_objects_v2(ContinuationToken=token, MaxKeys=self.page_size, **kwargs)
+            yield page
+            if not page["IsTruncated"]:
+                return
+            token = page["NextContinuationToken"]
+
+
+class StubDynamoDB(StubClient):
+    """Low-level DynamoDB client holding items as {table: {hash key value: item}}."""
+
+    def __init__(self, key_name="cache_key", latency=0.0):
+        super().__init__(latency)
+        self.key_name = key_name
+        self.tables = {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        self._call("GetItem")
+        item = self.tables.get(TableName, {}).get(Key[self.key_name]["S"])
+        return {"Item": item} if item is not None else {}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._call("PutItem")
+        self.tables.setdefault(TableName, {})[Item[self.key_name]["S"]] = Item
+        return {}
+
+
+class StubSSM(StubClient):
+    """Set ``error_code`` (e.g. "ThrottlingException") to make every call fail."""
+
+    def __init__(self, parameters=None, latency=0.0):
+        super().__init__(latency)
+        self.parameters = dict(parameters or {})
+        self.error_code = None
+
+    def get_parameter(self, Name, **kwargs):
+        self._call("GetParameter")
+        if self.error_code:
+            raise client_error(self.error_code, "GetParameter")
+        if Name not in self.parameters:
+            raise client_error("ParameterNotFound", "GetParameter")
+        return {"Parameter": {"Name": Name, "Value": self.parameters[Name]}}
+
+    def get_parameters(self, Names, **kwargs):
+        self._call("GetParameters")
+        if self.error_code:
+            raise client_error(self.error_code, "GetParameters")
+        return {
+            "Parameters": [{"Name": name, "Value": self.parameters[name]}
+                           for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names if name not in self.parameters],
+        }
+
+
+class StubLambda(StubClient):
+    """Runs the handler registered for ``FunctionName`` in-process."""
+
+    def __init__(self, handlers=None, latency=0.0):
+        super().__init__(latency)
+        self.handlers = dict(handlers or {})
+
+    def invoke(self, FunctionName, Payload, InvocationType="RequestResponse", **kwargs):
+        self._call("Invoke")
+        result = self.handlers[FunctionName](json.loads(Payload), None)
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode())}
+
+
+class StubSageMakerRuntime(StubClient):
+    """Returns a fixed 5-class probability vector."""
+
+    def __init__(self, prediction=None, latency=0.0):
+        super().__init__(latency)
+        self.prediction = prediction or [0.05, 0.8, 0.05, 0.05, 0.05]
+        self.bodies = []
+
+    def invoke_endpoint(self, EndpointName, Body, ContentType=None, **kwargs):
+        self._call("InvokeEndpoint")
+        self.bodies.append(Body)
+        return {"Body": io.BytesIO(json.dumps(self.prediction).encode()),
+                "ContentType": "application/json"}
+
+
+class StubSageMaker(StubClient):
+    """SageMaker control plane, only what the handlers look up."""
+
+    def __init__(self, endpoint_config_name="model-v1", latency=0.0):
+        super().__init__(latency)
+        self.endpoint_config_name = endpoint_config_name
+
+    def describe_endpoint(self, EndpointName, **kwargs):
+        self._call("DescribeEndpoint")
+        return {"EndpointName": EndpointName,
+                "EndpointConfigName": self.endpoint_config_name,
+                "EndpointStatus": "InService"}
@@ -0,0 +1,328 @@
+"""Benchmark suite for the resize and classify handlers, with a regression check.
+
+Every scenario drives a handler end to end against the stub clients, on
+synthetic mammograms of realistic sizes and bit depths, and reports:
+
+- throughput and p50/p95/p99 latency per request
+- p50/p95 latency per stage, from the spans of ``mammo_common.tracing``
+- peak traced memory (``tracemalloc``) per request and per stage, measured
+  in a separate pass so the tracing overhead does not skew the latencies
+
+Latencies depend on the machine: record the baseline on the machine that runs
+the check (e.g. the CI runner) and compare p50s with a tolerance.
+
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --check benchmarks/baseline.json --tolerance 0.25
+"""
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from benchmarks import images
+from benchmarks.stats import percentile
+from benchmarks.stubs import StubLambda, StubS3, StubSageMaker, StubSageMakerRuntime, StubSSM
+
+import lambda_invoke_classifier
+import lambda_resize_image
+from mammo_common import parameters, prediction_cache, preprocessing, tracing
+
+FILENAME = "benchmark.jpg"
+RESIZE_FUNCTION = "resize-function"
+
+# (name, width, height, encoding): full-field digital mammograms are exported
+# as 8-bit JPEG by the web app, and as 12-bit data in 16-bit PNG by most PACS
+IMAGE_CASES = [
+    ("jpeg-2000x2666", 2000, 2666, "jpeg"),
+    ("jpeg-3328x4096", 3328, 4096, "jpeg"),
+    ("png16-3328x4096", 3328, 4096, "png16"),
+]
+SCENARIOS = ["resize-handler", "classify-inline", "classify-lambda"]
+
+# Metrics compared by --check; the others are informative
+CHECKED_METRICS = ("p50_ms",)
+
+# Module globals replaced by install_stubs and scenario_request
+STUBBED_GLOBALS = [
+    (lambda_resize_image, ("s3",)),
+    (lambda_invoke_classifier, ("s3", "ssm_client", "ssm_parameters", "lambda_client", "sagemaker",
+                                "sagemaker_control", "model_version", "predictions", "RESIZED_ARTIFACTS",
+                                "PREPROCESS_MODE")),
+]
+
+
+def encode_case(width, height, encoding):
+    image = images.synthetic_mammogram(width, height)
+    if encoding == "png16":
+        return images.encode(image.astype("uint16") * 16, ".png")
+    return images.encode(image, ".jpg")
+
+
+class MemoryTrace(tracing.Trace):
+    """Trace that also records the peak traced memory of every span.
+
+    Spans nest (decode inside resize_lambda), so the peak of an inner span is
+    folded into the spans still open around it.
+    """
+
+    open_spans = []
+    # absolute high-water mark, the spans reset the tracemalloc peak
+    highest = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memory = {}
+
+    @contextmanager
+    def span(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        MemoryTrace.highest = max(MemoryTrace.highest, peak)
+        for entry in self.open_spans:
+            entry[1] = max(entry[1], peak)
+        tracemalloc.reset_peak()
+        entry = [current, current]
+        self.open_spans.append(entry)
+        try:
+            with super().span(name):
+                yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            MemoryTrace.highest = max(MemoryTrace.highest, peak)
+            self.open_spans.pop()
+            entry[1] = max(entry[1], peak)
+            for outer in self.open_spans:
+                outer[1] = max(outer[1], entry[1])
+            tracemalloc.reset_peak()
+            self.memory[name] = max(self.memory.get(name, 0), entry[1] - entry[0])
+
+
+class Recorder:
+    """Collects the traces started by the handlers."""
+
+    def __init__(self, trace_class=tracing.Trace):
+        self.trace_class = trace_class
+        self.traces = []
+
+    @contextmanager
+    def install(self):
+        original = tracing.Trace
+        recorder = self
+
+        class RecordedTrace(self.trace_class):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                recorder.traces.append(self)
+
+        tracing.Trace = RecordedTrace
+        try:
+            # the handlers print an EMF line per request
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+        finally:
+            tracing.Trace = original
+
+
+def install_stubs(original, latency):
+    s3 = StubS3(
+        {(lambda_invoke_classifier.bucket, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, FILENAME)): original},
+        latency=latency["s3"])
+    ssm = StubSSM({"resize-lambda": RESIZE_FUNCTION}, latency=latency["ssm"])
+
+    lambda_resize_image.s3 = s3
+    lambda_invoke_classifier.s3 = s3
+    lambda_invoke_classifier.ssm_client = ssm
+    lambda_invoke_classifier.ssm_parameters = parameters.ParameterCache(ssm)
+    lambda_invoke_classifier.lambda_client = StubLambda({RESIZE_FUNCTION: lambda_resize_image.lambda_handler},
+                                                        latency=latency["invoke"])
+    lambda_invoke_classifier.sagemaker = StubSageMakerRuntime(latency=latency["endpoint"])
+    lambda_invoke_classifier.sagemaker_control = StubSageMaker()
+    lambda_invoke_classifier.model_version = {"value": None, "expires_at": 0}
+    # every request must pay for preprocessing, so nothing may be cached
+    lambda_invoke_classifier.predictions = prediction_cache.PredictionCache(max_entries=0)
+    lambda_invoke_classifier.RESIZED_ARTIFACTS = False
+
+
+@contextmanager
+def restored_handlers():
+    """Put the handler globals replaced by the scenarios back afterwards."""
+    saved = [(module, {name: getattr(module, name) for name in names}) for module, names in STUBBED_GLOBALS]
+    try:
+        yield
+    finally:
+        for module, values in saved:
+            for name, value in values.items():
+                setattr(module, name, value)
+
+
+def scenario_request(scenario):
+    """:return: a callable running one request of the scenario"""
+    if scenario == "resize-handler":
+        event = {"bucket": lambda_invoke_classifier.bucket, "filename": FILENAME}
+        return lambda: lambda_resize_image.lambda_handler(event, None)
+
+    lambda_invoke_classifier.PREPROCESS_MODE = "lambda" if scenario == "classify-lambda" else "inline"
+    event = {"body": json.dumps({"filename": FILENAME})}
+    return lambda: lambda_invoke_classifier.lambda_handler(event, None)
+
+
+def stage_summary(traces, function):
+    """:return: {stage: [milliseconds, ...]} over the traces of one function"""
+    stages = {}
+    for trace in traces:
+        if trace.function_name != function:
+            continue
+        for name, values in trace.spans.items():
+            stages.setdefault(name, []).extend(values)
+    return stages
+
+
+def run_scenario(scenario, original, requests, latency, warmup=1):
+    install_stubs(original, latency)
+    request = scenario_request(scenario)
+    function = "resize" if scenario == "resize-handler" else "classify"
+
+    for _ in range(warmup):
+        with Recorder().install():
+            request()
+
+    recorder = Recorder()
+    latencies = []
+    with recorder.install():
+        started = time.perf_counter()
+        for _ in range(requests):
+            start = time.perf_counter()
+            request()
+            latencies.append((time.perf_counter() - start) * 1000)
+        elapsed = time.perf_counter() - started
+
+    # traced memory, in a separate pass
+    memory_recorder = Recorder(MemoryTrace)
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        MemoryTrace.highest = baseline
+        with memory_recorder.install():
+            request()
+        peak_mib = (max(MemoryTrace.highest, tracemalloc.get_traced_memory()[1]) - baseline) / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+    stage_memory = {}
+    for trace in memory_recorder.traces:
+        for name, peak in trace.memory.items():
+            stage_memory[name] = max(stage_memory.get(name, 0), peak / 2 ** 20)
+
+    stages = {}
+    # stages of the nested resize function are reported as well
+    for source in sorted({function, "resize"}):
+        for name, values in stage_summary(recorder.traces, source).items():
+            key = name if source == function else "{}.{}".format(source, name)
+            if key in stages or name == "total":
+                continue
+            stages[key] = {"p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95),
+                           "peak_mib": round(stage_memory.get(name, 0.0), 2)}
+
+    return {
+        "requests": requests,
+        "throughput_rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.mean(latencies),
+        "peak_mib": round(peak_mib, 2),
+        "stages": stages,
+    }
+
+
+def run_suite(requests, latency, cases=IMAGE_CASES, scenarios=SCENARIOS):
+    """:return: {"<case>/<scenario>": result}"""
+    results = {}
+    with restored_handlers():
+        for name, width, height, encoding in cases:
+            original = encode_case(width, height, encoding)
+            for scenario in scenarios:
+                results["{}/{}".format(name, scenario)] = run_scenario(scenario, original, requests, latency)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Find the metrics that got slower than the baseline allows.
+
+    Only checked metrics (request and stage p50s) are compared, and only
+    where both runs have them.
+
+    :return: list of (name, metric, baseline value, new value)
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        pairs = [(name, result, reference)]
+        pairs += [("{}:{}".format(name, stage), summary, reference.get("stages", {}).get(stage))
+                  for stage, summary in result["stages"].items()]
+        for label, new, old in pairs:
+            if old is None:
+                continue
+            for metric in CHECKED_METRICS:
+                # sub-millisecond stages are noise
+                if metric in old and new[metric] > max(old[metric] * (1 + tolerance), old[metric] + 1.0):
+                    regressions.append((label, metric, old[metric], new[metric]))
+    return regressions
+
+
+def print_results(results):
+    print("{:<34} {:>8} {:>9} {:>9} {:>9} {:>9}".format("case/scenario", "req/s", "p50 ms", "p95 ms", "p99 ms",
+                                                       "peak MiB"))
+    for name, result in results.items():
+        print("{:<34} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            name, result["throughput_rps"], result["p50_ms"], result["p95_ms"], result["p99_ms"],
+            result["peak_mib"]))
+        for stage, summary in sorted(result["stages"].items(), key=lambda item: -item[1]["p50_ms"]):
+            print("  {:<32} {:>8} {:>9.1f} {:>9.1f} {:>9} {:>9.1f}".format(
+                stage, "", summary["p50_ms"], summary["p95_ms"], "", summary["peak_mib"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--s3-latency", type=float, default=0.0)
+    parser.add_argument("--ssm-latency", type=float, default=0.0)
+    parser.add_argument("--invoke-latency", type=float, default=0.0)
+    parser.add_argument("--endpoint-latency", type=float, default=0.0)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--check", metavar="PATH", help="baseline to compare against, exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown of a p50, 0.25 is 25%%")
+    args = parser.parse_args(argv)
+
+    latency = {"s3": args.s3_latency, "ssm": args.ssm_latency,
+               "invoke": args.invoke_latency, "endpoint": args.endpoint_latency}
+    results = run_suite(args.requests, latency)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"latency": latency, "requests": args.requests, "results": results}, f, indent=1)
+        print("baseline saved to {}".format(args.save_baseline))
+
+    if args.check:
+        with open(args.check) as f:
+            baseline = json.load(f)
+        if baseline.get("latency") != latency:
+            print("warning: the baseline was recorded with stub latencies {}".format(baseline.get("latency")))
+        regressions = compare(results, baseline, args.tolerance)
+        for label, metric, old, new in regressions:
+            print("REGRESSION {} {}: {:.1f} -> {:.1f}".format(label, metric, old, new))
+        if regressions:
+            return 1
+        print("no regression above {:.0%}".format(args.tolerance))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Upload bytes and end-to-end latency of server-side versus web-tier preprocessing.
+
+"server" is the page sending the original to the API, which resizes it in
+the classify Lambda; "web" is the page resizing it on its own CPU
+(WEB_PREPROCESS) and sending the 150x300 image, which the Lambda passes to
+the endpoint as it is. The classify handler runs in-process against a stub
+endpoint; the transfer from the Fargate task to the API is modelled from
+``--bandwidth-mbps`` and ``--rtt``. The archive copy of the original (when
+PERSIST_ORIGINALS is set) is uploaded in the background in both modes and is
+not on the request path.
+
+    python -m benchmarks.web_preprocess --requests 10 --bandwidth-mbps 100
+"""
+import argparse
+import base64
+import contextlib
+import os
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks import images
+from benchmarks.stubs import StubSageMaker, StubSageMakerRuntime
+
+import lambda_invoke_classifier
+from mammo_common import prediction_cache, preprocessing
+
+CASES = [
+    ("jpeg-3000x4000", lambda image: images.encode(image, ".jpg")),
+    # 12-bit data in a 16-bit PNG, as exported by most PACS
+    ("png16-3000x4000", lambda image: images.encode(image.astype(np.uint16) * 16, ".png")),
+    ("dicom-3000x4000", lambda image: images.encode_dicom(image.astype(np.uint16) * 16)),
+]
+
+
+def install_stubs(args):
+    lambda_invoke_classifier.sagemaker = StubSageMakerRuntime(latency=args.endpoint_latency)
+    lambda_invoke_classifier.sagemaker_control = StubSageMaker()
+    lambda_invoke_classifier.model_version = {"value": None, "expires_at": 0}
+    # every request must pay for preprocessing, so nothing may be cached
+    lambda_invoke_classifier.predictions = prediction_cache.PredictionCache(max_entries=0)
+    # the page stages originals above 4 MB in S3 and polls a job instead, which
+    # only adds to the "server" numbers; they are sent inline here
+    lambda_invoke_classifier.MAX_INLINE_BYTES = 1 << 30
+
+
+def transfer_seconds(size, args):
+    # API Gateway receives binary bodies as they are, base64 is added behind it
+    return args.rtt + size * 8 / (args.bandwidth_mbps * 1e6)
+
+
+def request(original, mode, args):
+    """:return: (bytes sent to the API, seconds on the page, seconds in the Lambda)"""
+    start = time.perf_counter()
+    body = preprocessing.preprocess_image(original) if mode == "web" else original
+    page_seconds = time.perf_counter() - start
+
+    event = {"body": base64.b64encode(body).decode(), "isBase64Encoded": True,
+             "headers": {"Content-Type": "application/octet-stream"}}
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        response = lambda_invoke_classifier.lambda_handler(event, None)
+    assert response["statusCode"] == 200, response
+    return len(body), page_seconds, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--bandwidth-mbps", type=float, default=100,
+                        help="throughput of one request from the Fargate task to the API")
+    parser.add_argument("--rtt", type=float, default=0.02, help="seconds")
+    parser.add_argument("--endpoint-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    install_stubs(args)
+    image = images.synthetic_mammogram(3000, 4000)
+    print("{:>16} {:>7} {:>12} {:>8} {:>11} {:>9} {:>11}".format(
+        "image", "mode", "upload bytes", "page ms", "network ms", "lambda ms", "total ms"))
+    for name, encode in CASES:
+        original = encode(image)
+        for mode in ("server", "web"):
+            runs = [request(original, mode, args) for _ in range(args.requests)]
+            size = runs[0][0]
+            page = statistics.median(run[1] for run in runs)
+            handler = statistics.median(run[2] for run in runs)
+            network = transfer_seconds(size, args)
+            print("{:>16} {:>7} {:>12} {:>8.1f} {:>11.1f} {:>9.1f} {:>11.1f}".format(
+                name, mode, size, page * 1000, network * 1000, handler * 1000,
+                (page + network + handler) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Bulk classification of an S3 prefix with a batch transform job.
+# One m5.large serves 2 requests at a time, so 2 concurrent transforms per
+# instance keep it busy; SingleRecord sends one image per request, which is
+# what the image-classification container expects for application/x-image.
+DEFAULT_BATCH_TRANSFORM = {
+    "enabled": False,
+    "instance_type": "m5.large",
+    "instance_count": 1,
+    "max_concurrent_transforms": 2,
+    "batch_strategy": "SingleRecord",
+    # images per preprocessing Lambda invocation, and invocations at once
+    "chunk_size": 500,
+    "preprocess_concurrency": 10,
+    # runtime the opencv, numpy and pydicom layers are built for
+    "lambda_runtime": "python3.9",
+    # AWS SDK for pandas layer, for pyarrow in the results Lambda; required when
+    # enabled, its ARN depends on the region and the runtime
+    "pandas_layer_arn": None,
+}
+
+BATCH_STRATEGIES = ("SingleRecord", "MultiRecord")
+
+
+def batch_transform_settings(batch_configs):
+    """Normalize the "batch_transform" entry of sagemaker_configs.
+
+    :param batch_configs: overrides of DEFAULT_BATCH_TRANSFORM, or None
+    :return: None when the workflow is disabled, else the settings
+    """
+    settings = {**DEFAULT_BATCH_TRANSFORM, **(batch_configs or {})}
+    if not settings["enabled"]:
+        return None
+
+    if settings["batch_strategy"] not in BATCH_STRATEGIES:
+        raise ValueError("batch_strategy must be one of {}".format(BATCH_STRATEGIES))
+    if settings["instance_count"] < 1 or settings["max_concurrent_transforms"] < 1:
+        raise ValueError("instance_count and max_concurrent_transforms must be at least 1")
+    if not settings["pandas_layer_arn"]:
+        raise ValueError("batch_transform is enabled but pandas_layer_arn is not set: the results Lambda "
+                         "needs the AWS SDK for pandas layer of the region and runtime for pyarrow")
+    return settings
@@ -0,0 +1,97 @@
+VARIANT_NAME = "AllTraffic"
+
+# Target tracking on SageMakerVariantInvocationsPerInstance (invocations per
+# instance per minute). An ml.m5.large serves ~2 requests at a time at ~100 ms,
+# so 600/min keeps it around half of its capacity.
+DEFAULT_AUTOSCALING = {
+    "min_capacity": 1,
+    "max_capacity": 4,
+    "target_invocations_per_instance": 600,
+    "scale_in_cooldown": 300,
+    "scale_out_cooldown": 60,
+}
+
+# Serverless inference: memory in MB (1024-6144, by 1024), concurrent
+# invocations, and pre-warmed capacity (0 disables it)
+DEFAULT_SERVERLESS = {
+    "memory_size_mb": 3072,
+    "max_concurrency": 10,
+    "provisioned_concurrency": 0,
+}
+
+SERVERLESS_MEMORY_SIZES = (1024, 2048, 3072, 4096, 5120, 6144)
+
+# Rollout of a new model to an existing endpoint (blue/green UpdateEndpoint).
+# "all_at_once" moves the traffic once the new fleet is InService; "canary"
+# sends step_percent of the capacity first and the rest after wait_seconds;
+# "linear" moves step_percent every wait_seconds. The old fleet is kept for
+# termination_wait_seconds so an alarm can still roll back.
+DEFAULT_ROLLOUT = {
+    "mode": "all_at_once",
+    "step_percent": 25,
+    "wait_seconds": 300,
+    "termination_wait_seconds": 300,
+}
+
+ROLLOUT_TYPES = {"all_at_once": "ALL_AT_ONCE", "canary": "CANARY", "linear": "LINEAR"}
+
+
+def endpoint_settings(endpoint_configs=None):
+    """Normalize the "endpoint" entry of sagemaker_configs.
+
+    :param endpoint_configs: {"mode": "instance" | "serverless",
+        "autoscaling": dict or None, "serverless": dict, "rollout": dict}
+    :return: {"mode", "autoscaling" (None when disabled), "serverless", "rollout"}
+    """
+    endpoint_configs = endpoint_configs or {}
+    mode = endpoint_configs.get("mode", "instance")
+    if mode not in ("instance", "serverless"):
+        raise ValueError("Unknown endpoint mode {}".format(mode))
+
+    autoscaling = None
+    if mode == "instance" and endpoint_configs.get("autoscaling", {}) is not None:
+        autoscaling = {**DEFAULT_AUTOSCALING, **endpoint_configs.get("autoscaling", {})}
+        if not 1 <= autoscaling["min_capacity"] <= autoscaling["max_capacity"]:
+            raise ValueError("Autoscaling needs 1 <= min_capacity <= max_capacity")
+
+    serverless = {**DEFAULT_SERVERLESS, **endpoint_configs.get("serverless", {})}
+    if mode == "serverless":
+        if serverless["memory_size_mb"] not in SERVERLESS_MEMORY_SIZES:
+            raise ValueError("Serverless memory_size_mb must be one of {}".format(SERVERLESS_MEMORY_SIZES))
+        if serverless["provisioned_concurrency"] > serverless["max_concurrency"]:
+            raise ValueError("provisioned_concurrency cannot exceed max_concurrency")
+
+    rollout = {**DEFAULT_ROLLOUT, **endpoint_configs.get("rollout", {})}
+    if rollout["mode"] not in ROLLOUT_TYPES:
+        raise ValueError("Unknown rollout mode {}".format(rollout["mode"]))
+    if not 0 < rollout["step_percent"] <= 100:
+        raise ValueError("Rollout step_percent must be in (0, 100]")
+    if mode == "serverless" and rollout["mode"] != "all_at_once":
+        # blue/green traffic shifting is only available for instance endpoints
+        raise ValueError("Serverless endpoints only support the all_at_once rollout")
+
+    return {"mode": mode, "autoscaling": autoscaling, "serverless": serverless, "rollout": rollout}
+
+
+def deployment_config(rollout):
+    """DeploymentConfig of UpdateEndpoint for a rollout, None for a plain update."""
+    if rollout["mode"] == "all_at_once":
+        return None
+
+    routing = {"Type": ROLLOUT_TYPES[rollout["mode"]], "WaitIntervalInSeconds": rollout["wait_seconds"]}
+    step = {"Type": "CAPACITY_PERCENT", "Value": rollout["step_percent"]}
+    routing["CanarySize" if rollout["mode"] == "canary" else "LinearStepSize"] = step
+    return {
+        "BlueGreenUpdatePolicy": {
+            "TrafficRoutingConfiguration": routing,
+            "TerminationWaitInSeconds": rollout["termination_wait_seconds"],
+        }
+    }
+
+
+def rollout_seconds(rollout):
+    """Upper bound of the time spent shifting traffic, on top of provisioning."""
+    if rollout["mode"] == "all_at_once":
+        return 0
+    steps = 1 if rollout["mode"] == "canary" else -(-100 // rollout["step_percent"])
+    return steps * rollout["wait_seconds"] + rollout["termination_wait_seconds"]
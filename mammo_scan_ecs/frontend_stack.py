@@ -1,5 +1,7 @@
 from aws_cdk import (
     Duration,
+    IgnoreMode,
+    RemovalPolicy,
     Stack,
     aws_lambda as _lambda,
     aws_apigateway as apigw,
@@ -8,15 +10,51 @@ from aws_cdk import (
     aws_ssm as ssm,
     aws_ecs as ecs,
     aws_ecs_patterns as ecs_patterns,
+    aws_dynamodb as dynamodb,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
+    aws_s3 as s3,
+    aws_s3_notifications as s3n,
 )
 from constructs import Construct
 
+from mammo_scan_ecs.layers import preprocessing_layers
+from mammo_scan_ecs.training_config import preprocessing_environment
+from mammo_scan_ecs.web_service_config import web_service_settings
+
 class FrontEndWebStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, vpc: ec2.IVpc, sagemaker_configs, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, vpc: ec2.IVpc, sagemaker_configs, frontend_configs=None, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         endpoint_name = sagemaker_configs["endpoint_name"]
+        frontend_configs = frontend_configs or {}
+        # SQS messages (jobs) handed to one invocation of the async worker
+        WORKER_BATCH_SIZE = frontend_configs.get("worker_batch_size", 5)
+        # Bucket the web app uploads originals to
+        MODEL_BUCKET = frontend_configs.get("model_bucket", "mammo-v2-ecs-model-files")
+        # Also run the endpoint on upload, not only the resize; every upload
+        # then pays for an endpoint invocation, even when it is never classified
+        PRECOMPUTE_PREDICTIONS = frontend_configs.get("precompute_predictions", False)
+        # Runtime of the Python functions; the opencv, numpy and pydicom layers must be built for it
+        LAMBDA_RUNTIME = frontend_configs.get("lambda_runtime", "python3.9")
+        # Pre-initialized environments behind the API, 0 disables provisioned concurrency
+        PROVISIONED_CONCURRENCY = frontend_configs.get("provisioned_concurrency", 0)
+        # Restore the API function from a snapshot of its initialized state (python3.12+)
+        SNAP_START = frontend_configs.get("snap_start", False)
+        # Resize in the web app and send only the model-ready image to the API
+        WEB_PREPROCESS = frontend_configs.get("web_preprocess", False)
+        # Keep a copy of the originals sent inline (or resized by the web app)
+        PERSIST_ORIGINALS = frontend_configs.get("persist_originals", True)
+        # Capacity, autoscaling and stickiness of the Streamlit service
+        WEB_SERVICE = web_service_settings(frontend_configs.get("web_service"))
+        runtime_version = tuple(int(part) for part in LAMBDA_RUNTIME[len("python"):].split("."))
+        if SNAP_START and runtime_version < (3, 12):
+            raise ValueError("SnapStart for Python needs python3.12 or later, got {}".format(LAMBDA_RUNTIME))
+        if SNAP_START and PROVISIONED_CONCURRENCY:
+            raise ValueError("SnapStart and provisioned concurrency cannot be combined")
+
+        runtime = _lambda.Runtime(LAMBDA_RUNTIME, _lambda.RuntimeFamily.PYTHON)
 
         # Defines role for the AWS Lambda functions
         role = iam.Role(self, "Mammography-Lambda-Policy", assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"))
@@ -30,7 +68,12 @@ class FrontEndWebStack(Stack):
             ),
             iam.PolicyStatement(
                 effect=iam.Effect.ALLOW,
-                actions=["ssm:GetParameter"],
+                actions=["sagemaker:DescribeEndpoint"],
+                resources=["*"]
+            ),
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["ssm:GetParameter", "ssm:GetParameters"],
                 resources=["*"]
             ),
             iam.PolicyStatement(
@@ -45,82 +88,202 @@ class FrontEndWebStack(Stack):
             )]
         ))
 
-        cv2_layer = _lambda.LayerVersion(    
-            self, "opencv-layer",
-            code=_lambda.Code.from_asset("./lambda_layers/opencv.zip"),
-            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+        # Predictions keyed by model version and image hash, expired by DynamoDB TTL
+        prediction_cache_table = dynamodb.Table(
+            self, "PredictionCache",
+            partition_key=dynamodb.Attribute(name="cache_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
         )
+        prediction_cache_table.grant_read_write_data(role)
 
-        numpy_layer = _lambda.LayerVersion(
-            self, "numpy-layer",
-            code=_lambda.Code.from_asset("./lambda_layers/numpy.zip"),
-            compatible_runtimes=[_lambda.Runtime.PYTHON_3_9],
+        # Asynchronous jobs: queued by the API, processed by the worker Lambda,
+        # results kept for a day
+        jobs_table = dynamodb.Table(
+            self, "ClassificationJobs",
+            partition_key=dynamodb.Attribute(name="job_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
         )
+        jobs_table.grant_read_write_data(role)
+
+        worker_timeout = Duration.seconds(120)
+        jobs_queue = sqs.Queue(
+            self, "ClassificationJobsQueue",
+            # AWS recommends 6 times the function timeout for SQS event sources
+            visibility_timeout=Duration.seconds(6 * worker_timeout.to_seconds()),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=sqs.Queue(self, "ClassificationJobsDLQ", retention_period=Duration.days(14)),
+            ),
+        )
+        jobs_queue.grant_send_messages(role)
+
+        cv2_layer, numpy_layer, pydicom_layer, common_layer = preprocessing_layers(self, runtime)
+
+        classifier_environment = {
+            "ENDPOINT_NAME": endpoint_name,
+            "PREPROCESS_MODE": "inline",
+            "PREPROCESS_WORKERS": "4",
+            "INVOKE_CONCURRENCY": "4",
+            "PREDICTION_CACHE_TABLE": prediction_cache_table.table_name,
+            "PREDICTION_CACHE_TTL": str(Duration.days(7).to_seconds()),
+            "JOBS_TABLE": jobs_table.table_name,
+            "JOBS_QUEUE_URL": jobs_queue.queue_url,
+            "RESIZED_ARTIFACTS": "true",
+            "PRECOMPUTE_PREDICTIONS": "true" if PRECOMPUTE_PREDICTIONS else "false",
+            **preprocessing_environment(sagemaker_configs.get("dataset_manifest")),
+        }
 
         classification_lambda = _lambda.Function(self, "classification-lambda",
-            runtime=_lambda.Runtime.PYTHON_3_9,
+            runtime=runtime,
             handler="lambda_invoke_classifier.lambda_handler",
             code=_lambda.Code.from_asset("./mammo_scan_ecs/lambda/classify"),
             role=role,
-            layers=[cv2_layer, numpy_layer],
+            layers=[cv2_layer, numpy_layer, pydicom_layer, common_layer],
             vpc=vpc,
             vpc_subnets=ec2.SubnetSelection(
                 subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
             ),
             timeout=Duration.seconds(30),
-            memory_size=128,
-            environment={
-                "ENDPOINT_NAME": endpoint_name
-            }
+            # inline preprocessing decodes the original images in this function,
+            # up to PREPROCESS_WORKERS at a time for batch requests
+            memory_size=2048,
+            environment=classifier_environment,
+        )
+
+        # Consumes the jobs queue with the same code as the classification Lambda
+        classification_worker_lambda = _lambda.Function(self, "classification-worker-lambda",
+            runtime=runtime,
+            handler="lambda_classify_worker.lambda_handler",
+            code=_lambda.Code.from_asset("./mammo_scan_ecs/lambda/classify"),
+            role=role,
+            layers=[cv2_layer, numpy_layer, pydicom_layer, common_layer],
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(
+                subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+            ),
+            timeout=worker_timeout,
+            memory_size=2048,
+            environment=classifier_environment,
+        )
+        classification_worker_lambda.add_event_source(lambda_event_sources.SqsEventSource(
+            jobs_queue,
+            batch_size=WORKER_BATCH_SIZE,
+            max_batching_window=Duration.seconds(1),
+            report_batch_item_failures=True,
+        ))
+
+        # Preprocesses originals on upload, with the same code as the classification Lambda
+        upload_preprocess_lambda = _lambda.Function(self, "upload-preprocess-lambda",
+            runtime=runtime,
+            handler="lambda_preprocess_upload.lambda_handler",
+            code=_lambda.Code.from_asset("./mammo_scan_ecs/lambda/classify"),
+            role=role,
+            layers=[cv2_layer, numpy_layer, pydicom_layer, common_layer],
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(
+                subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+            ),
+            timeout=Duration.seconds(60),
+            memory_size=2048,
+            environment=classifier_environment,
+        )
+        model_bucket = s3.Bucket.from_bucket_name(self, "ModelBucket", MODEL_BUCKET)
+        model_bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3n.LambdaDestination(upload_preprocess_lambda),
+            s3.NotificationKeyFilter(prefix="downloaded/original/"),
         )
 
         resize_img_lambda = _lambda.Function(
             self, "ResizeImgLambda",
-            runtime=_lambda.Runtime.PYTHON_3_9,
+            runtime=runtime,
             code=_lambda.Code.from_asset("./mammo_scan_ecs/lambda/resize"),
             handler="lambda_resize_image.lambda_handler",
             role=role,
-            layers=[cv2_layer, numpy_layer],
+            layers=[cv2_layer, numpy_layer, pydicom_layer, common_layer],
             vpc=vpc,
             vpc_subnets=ec2.SubnetSelection(
                 subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
             ),
             timeout=Duration.seconds(120),
+            environment=preprocessing_environment(sagemaker_configs.get("dataset_manifest")),
         )
 
+        # The API calls a published version through an alias when it is pre-initialized
+        api_handler = classification_lambda
+        if SNAP_START:
+            # not exposed by this CDK version, set on the CloudFormation resource
+            classification_lambda.node.default_child.add_property_override(
+                "SnapStart", {"ApplyOn": "PublishedVersions"})
+        if SNAP_START or PROVISIONED_CONCURRENCY:
+            api_handler = _lambda.Alias(self, "classification-lambda-live",
+                alias_name="live",
+                version=classification_lambda.current_version,
+                provisioned_concurrent_executions=PROVISIONED_CONCURRENCY or None,
+            )
+
         api = apigw.LambdaRestApi(
             self, 'Endpoint',
-            handler=classification_lambda,
-            rest_api_name='Mammography Classification'
+            handler=api_handler,
+            rest_api_name='Mammography Classification',
+            # lets the web app POST small images as raw bytes instead of staging them in S3
+            binary_media_types=["image/jpeg", "image/png", "application/dicom"],
         )
 
 
-        # Create ECS cluster
-        cluster = ecs.Cluster(self, "MammographyClassification", vpc=vpc)
+        # Create ECS cluster, the service runs on FARGATE and FARGATE_SPOT
+        cluster = ecs.Cluster(self, "MammographyClassification", vpc=vpc,
+                              enable_fargate_capacity_providers=True)
 
-        # Add an AutoScalingGroup with spot instances to the existing cluster
-        cluster.add_capacity("AsgSpot",
-            max_capacity=2,
-            min_capacity=1,
-            desired_capacity=2,
-            instance_type=ec2.InstanceType("c5.xlarge"),
-            spot_price="0.0735",
-            # Enable the Automated Spot Draining support for Amazon ECS
-            spot_instance_draining=True
-        )
+        # The Fargate service does not use EC2 capacity, only add it on request
+        ec2_spot_capacity = WEB_SERVICE["ec2_spot_capacity"]
+        if ec2_spot_capacity:
+            # Add an AutoScalingGroup with spot instances to the existing cluster
+            cluster.add_capacity("AsgSpot",
+                max_capacity=ec2_spot_capacity.get("max_capacity", 2),
+                min_capacity=ec2_spot_capacity.get("min_capacity", 1),
+                instance_type=ec2.InstanceType(ec2_spot_capacity.get("instance_type", "c5.xlarge")),
+                spot_price=ec2_spot_capacity.get("spot_price", "0.0735"),
+                # Enable the Automated Spot Draining support for Amazon ECS
+                spot_instance_draining=True
+            )
 
-        # Build Dockerfile from local folder and push to ECR
-        image = ecs.ContainerImage.from_asset("web-app")
+        # Build Dockerfile from local folder and push to ECR. The build context is
+        # the repository root so the image can include the shared Lambda code.
+        image = ecs.ContainerImage.from_asset(".",
+            file="web-app/Dockerfile",
+            exclude=[
+                "*", "!web-app",
+                "!mammo_scan_ecs", "mammo_scan_ecs/*",
+                "!mammo_scan_ecs/lambda", "mammo_scan_ecs/lambda/*",
+                "!mammo_scan_ecs/lambda/common",
+                "**/__pycache__",
+            ],
+            ignore_mode=IgnoreMode.DOCKER,
+        )
 
         # Create Fargate service
         fargate_service = ecs_patterns.ApplicationLoadBalancedFargateService(
             self, "MammographyApplication",
             cluster=cluster,            # Required
             cpu=2048,                   # Default is 256 (512 is 0.5 vCPU, 2048 is 2 vCPU)
-            desired_count=1,            # Default is 1
+            desired_count=WEB_SERVICE["min_capacity"],
+            capacity_provider_strategies=[
+                ecs.CapacityProviderStrategy(**entry) for entry in WEB_SERVICE["capacity_provider_strategy"]
+            ],
             task_image_options=ecs_patterns.ApplicationLoadBalancedTaskImageOptions(
                 image=image, 
                 container_port=8501,
+                environment={
+                    "WEB_PREPROCESS": "true" if WEB_PREPROCESS else "false",
+                    "PERSIST_ORIGINALS": "true" if PERSIST_ORIGINALS else "false",
+                    # the web app resizes like the Lambda functions
+                    **preprocessing_environment(sagemaker_configs.get("dataset_manifest")),
+                },
                 ),
             #load_balancer_name="gen-ai-demo",
             memory_limit_mib=4096,      # Default is 512
@@ -128,7 +291,7 @@ class FrontEndWebStack(Stack):
 
         fargate_service.task_definition.add_to_task_role_policy(iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
-            actions = ["ssm:GetParameter"],
+            actions = ["ssm:GetParameter", "ssm:GetParameters"],
             resources = ["arn:aws:ssm:*"],
             )
         )
@@ -143,16 +306,28 @@ class FrontEndWebStack(Stack):
             )
         )
 
-        # Setup task auto-scaling
+        # Streamlit sessions live in the task that served them, uploads included
+        fargate_service.target_group.enable_cookie_stickiness(Duration.hours(WEB_SERVICE["stickiness_hours"]))
+
+        # Setup task auto-scaling: on requests per task (sessions), and on CPU
+        # for the images resized in the task; the larger target count wins
         scaling = fargate_service.service.auto_scale_task_count(
-            max_capacity=10
+            min_capacity=WEB_SERVICE["min_capacity"],
+            max_capacity=WEB_SERVICE["max_capacity"],
+        )
+        scaling.scale_on_request_count(
+            "RequestScaling",
+            requests_per_target=WEB_SERVICE["requests_per_target"],
+            target_group=fargate_service.target_group,
+            scale_in_cooldown=Duration.seconds(WEB_SERVICE["scale_in_cooldown"]),
+            scale_out_cooldown=Duration.seconds(WEB_SERVICE["scale_out_cooldown"]),
         )
         scaling.scale_on_cpu_utilization(
             "CpuScaling",
-            target_utilization_percent=50,
-            scale_in_cooldown=Duration.seconds(60),
-            scale_out_cooldown=Duration.seconds(60),
-        )  
+            target_utilization_percent=WEB_SERVICE["cpu_target_percent"],
+            scale_in_cooldown=Duration.seconds(WEB_SERVICE["scale_in_cooldown"]),
+            scale_out_cooldown=Duration.seconds(WEB_SERVICE["scale_out_cooldown"]),
+        )
 
 
             
@@ -0,0 +1,77 @@
+import json
+import os
+import re
+
+from mammo_common.clients import LazyClient
+
+s3 = LazyClient('s3')
+
+# Working files of the batch runs: chunk manifests, transform input and output, results
+BATCH_BUCKET = os.environ.get('BATCH_BUCKET', 'mammo-v2-ecs-model-files')
+BATCH_PREFIX = 'batch'
+# Images per preprocessing invocation (one Map iteration)
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '500'))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.dcm')
+
+
+def parse_s3_uri(uri):
+    """:return: (bucket, key prefix) of s3://bucket/prefix"""
+    if not uri.startswith('s3://'):
+        raise ValueError("Expected an s3:// URI, got {}".format(uri))
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix
+
+
+def list_images(bucket, prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(item['Key'] for item in page.get('Contents', [])
+                    if item['Key'].lower().endswith(IMAGE_EXTENSIONS))
+    return keys
+
+
+def chunked(keys, size):
+    return [keys[start:start + size] for start in range(0, len(keys), size)]
+
+
+def lambda_handler(event, context):
+    """List the images under the source prefix and write one manifest per chunk.
+
+    The key list of a large archive does not fit in the state machine
+    payload (256 KB), so the Map iterates over the manifest keys instead.
+
+    :param event: {"source": "s3://bucket/prefix/", "run_name": execution name}
+    :return: locations of the run, read by the later states
+    """
+    source_bucket, source_prefix = parse_s3_uri(event['source'])
+    # a folder: the input and output keys are the paths below it
+    if source_prefix and not source_prefix.endswith('/'):
+        source_prefix += '/'
+    keys = list_images(source_bucket, source_prefix)
+    if not keys:
+        raise ValueError("No images under {}".format(event['source']))
+
+    # transform job names: 63 characters, letters, digits and hyphens
+    run_name = re.sub(r'[^a-zA-Z0-9-]', '-', event['run_name'])[:50].strip('-')
+    run_prefix = '{}/{}'.format(BATCH_PREFIX, run_name)
+    manifests = []
+    for index, chunk in enumerate(chunked(keys, CHUNK_SIZE)):
+        manifest = '{}/chunks/{:05d}.json'.format(run_prefix, index)
+        s3.put_object(Bucket=BATCH_BUCKET, Key=manifest, Body=json.dumps(chunk).encode())
+        manifests.append(manifest)
+
+    print(json.dumps({"source": event['source'], "images": len(keys), "chunks": len(manifests)}))
+    return {
+        "images": len(keys),
+        "chunks": manifests,
+        "source_bucket": source_bucket,
+        "source_prefix": source_prefix,
+        "bucket": BATCH_BUCKET,
+        "job_name": "batch-" + run_name,
+        "input_prefix": run_prefix + '/input',
+        "input_uri": 's3://{}/{}/input/'.format(BATCH_BUCKET, run_prefix),
+        "output_prefix": run_prefix + '/output',
+        "output_uri": 's3://{}/{}/output/'.format(BATCH_BUCKET, run_prefix),
+        "results_key": run_prefix + '/results.parquet',
+    }
@@ -0,0 +1,48 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from mammo_common import preprocessing
+from mammo_common.clients import LazyClient
+
+s3 = LazyClient('s3')
+
+ENCODE_OPTIONS = preprocessing.encode_options_from_env()
+# crop to the breast region, as the training dataset was (None: whole frame)
+ROI_PADDING = preprocessing.roi_padding_from_env()
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', '8'))
+# Failed keys returned to the state machine, the full list is in the log
+MAX_REPORTED_FAILURES = 10
+
+
+def preprocess_key(event, key):
+    """Resize one original into the transform input, under the same relative path."""
+    original = s3.get_object(Bucket=event['source_bucket'], Key=key)['Body'].read()
+    resized = preprocessing.preprocess_image(original, roi_padding=ROI_PADDING, **ENCODE_OPTIONS)
+    relative_key = key[len(event['source_prefix']):]
+    s3.put_object(Bucket=event['bucket'], Key='{}/{}'.format(event['input_prefix'], relative_key), Body=resized)
+
+
+def lambda_handler(event, context):
+    """Preprocess the images of one chunk manifest written by lambda_batch_prepare.
+
+    :param event: {"manifest", "bucket", "source_bucket", "source_prefix", "input_prefix"}
+    :return: {"processed": int, "failed": int, "failures": first failed keys}
+    """
+    keys = json.loads(s3.get_object(Bucket=event['bucket'], Key=event['manifest'])['Body'].read())
+
+    with ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS) as executor:
+        futures = [executor.submit(preprocess_key, event, key) for key in keys]
+
+    failures = []
+    for key, future in zip(keys, futures):
+        error = future.exception()
+        if error is not None:
+            # a damaged image is left out of the results instead of failing the run
+            print(json.dumps({"key": key, "error": str(error)}))
+            failures.append(key)
+
+    print(json.dumps({"manifest": event['manifest'], "processed": len(keys) - len(failures),
+                      "failed": len(failures)}))
+    return {"processed": len(keys) - len(failures), "failed": len(failures),
+            "failures": failures[:MAX_REPORTED_FAILURES]}
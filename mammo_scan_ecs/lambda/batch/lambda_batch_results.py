@@ -0,0 +1,82 @@
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from mammo_common.clients import LazyClient
+from mammo_common.labels import CLASS_NAMES, get_best_prediction_position, get_description
+
+s3 = LazyClient('s3')
+
+READ_WORKERS = int(os.environ.get('READ_WORKERS', '16'))
+# Batch transform writes the response for <input key> to <output prefix>/<input key>.out
+OUTPUT_SUFFIX = '.out'
+
+
+def list_outputs(bucket, prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix + '/'):
+        keys.extend(item['Key'] for item in page.get('Contents', []) if item['Key'].endswith(OUTPUT_SUFFIX))
+    return keys
+
+
+def result_row(image, prediction):
+    """One row of the results: the label decoded like the classify API, and every probability."""
+    position = get_best_prediction_position(prediction)
+    row = {
+        "image": image,
+        "label": CLASS_NAMES[position],
+        "probability": prediction[position],
+        "description": get_description(position, prediction),
+    }
+    for name, probability in zip(CLASS_NAMES, prediction):
+        row["p_" + name] = probability
+    return row
+
+
+def to_columns(rows):
+    names = ["image", "label", "probability", "description"] + ["p_" + name for name in CLASS_NAMES]
+    columns = {name: [] for name in names}
+    for row in rows:
+        for name, values in columns.items():
+            values.append(row[name])
+    return columns
+
+
+def write_parquet(columns):
+    # pyarrow comes with the AWS SDK for pandas layer
+    import pyarrow
+    import pyarrow.parquet
+
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(pyarrow.table(columns), buffer, compression='snappy')
+    return buffer.getvalue()
+
+
+def lambda_handler(event, context):
+    """Aggregate the per-image transform outputs into one Parquet file.
+
+    :param event: {"bucket", "output_prefix", "source_bucket", "source_prefix", "results_key"}
+    :return: {"results": s3 URI, "images": int}
+    """
+    bucket, output_prefix = event['bucket'], event['output_prefix']
+    keys = list_outputs(bucket, output_prefix)
+
+    def read(key):
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        predictions = list(executor.map(read, keys))
+
+    rows = []
+    for key, prediction in zip(keys, predictions):
+        relative_key = key[len(output_prefix) + 1:-len(OUTPUT_SUFFIX)]
+        image = 's3://{}/{}{}'.format(event['source_bucket'], event['source_prefix'], relative_key)
+        rows.append(result_row(image, prediction))
+    rows.sort(key=lambda row: row["image"])
+
+    s3.put_object(Bucket=bucket, Key=event['results_key'], Body=write_parquet(to_columns(rows)))
+    results = 's3://{}/{}'.format(bucket, event['results_key'])
+    print(json.dumps({"results": results, "images": len(rows)}))
+    return {"results": results, "images": len(rows)}
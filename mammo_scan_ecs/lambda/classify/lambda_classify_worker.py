@@ -0,0 +1,64 @@
+import json
+
+import lambda_invoke_classifier as classifier
+from mammo_common import jobs, tracing
+
+
+def lambda_handler(event, context):
+    """Classify the jobs of an SQS batch and store their results.
+
+    The images of every job in the batch are classified together, so a batch
+    of small jobs still fans out to the endpoint concurrently. Failed messages
+    are reported individually and go back to the queue.
+    """
+    batch = []
+    failures = []
+    for record in event['Records']:
+        try:
+            batch.append((record['messageId'], parse_job(record['body'])))
+        except ValueError as e:
+            print("Invalid job message {}: {}".format(record['messageId'], e))
+            failures.append({"itemIdentifier": record['messageId']})
+
+    # a batch of one job keeps the trace id of the request that queued it
+    trace_id = batch[0][1].get('trace_id') if len(batch) == 1 else None
+    tracing.start("classify-worker", trace_id)
+    try:
+        return classify_batch(batch, failures)
+    finally:
+        tracing.finish()
+
+
+def parse_job(body):
+    """Validate a job message before its images join the batch.
+
+    :return: the job dict
+    :raises ValueError: the message is not a job
+    """
+    job = json.loads(body)
+    if not isinstance(job, dict) or not isinstance(job.get('job_id'), str):
+        raise ValueError("missing job_id")
+    filenames = job.get('filenames')
+    if not isinstance(filenames, list) or not filenames or not all(isinstance(name, str) for name in filenames):
+        raise ValueError("filenames must be a non-empty list of strings")
+    return job
+
+
+def classify_batch(batch, failures):
+    if not batch:
+        return {"batchItemFailures": failures}
+
+    filenames = [filename for _, job in batch for filename in job['filenames']]
+    results = iter(classifier.classify_images(filenames))
+    print(json.dumps({"prediction_cache": classifier.predictions.stats()}))
+
+    for message_id, job in batch:
+        job_results = [next(results) for _ in job['filenames']]
+        try:
+            status = jobs.FAILED if all('error' in result for result in job_results) else jobs.SUCCEEDED
+            classifier.job_store.put(job['job_id'], status, {"results": job_results})
+        except Exception as e:
+            tracing.log_error(e, stage="store job {}".format(job['job_id']))
+            failures.append({"itemIdentifier": message_id})
+
+    return {"batchItemFailures": failures}
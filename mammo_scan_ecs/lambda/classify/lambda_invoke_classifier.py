@@ -1,43 +1,90 @@
+import base64
+import binascii
 import json
-import boto3
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from botocore.exceptions import ClientError
 
-
-s3 = boto3.client('s3')
-ssm_client = boto3.client('ssm')
-sagemaker = boto3.client('runtime.sagemaker')
-lambda_client = boto3.client('lambda')
-
-NAO = 0
-CCD = 1
-CCE = 2
-MLOD = 3
-MLOE = 4
+from mammo_common import jobs, parameters, prediction_cache, preprocessing, tracing
+from mammo_common.clients import LazyClient
+from mammo_common.labels import get_best_prediction_position, get_description
+
+
+# created on first use, a cache hit never pays for the S3 or Lambda clients
+s3 = LazyClient('s3')
+ssm_client = LazyClient('ssm')
+sagemaker = LazyClient('sagemaker-runtime')
+sagemaker_control = LazyClient('sagemaker')
+lambda_client = LazyClient('lambda')
+dynamodb = LazyClient('dynamodb')
+sqs = LazyClient('sqs')
+
+bucket = 'mammo-v2-ecs-model-files'
+
+# "inline" preprocesses in this function, "lambda" delegates to the resize Lambda
+PREPROCESS_MODE = os.environ.get('PREPROCESS_MODE', 'inline')
+ENCODE_OPTIONS = preprocessing.encode_options_from_env()
+# crop to the breast region, as the training dataset was (None: whole frame)
+ROI_PADDING = preprocessing.roi_padding_from_env()
+
+# Batch requests: images fetched/preprocessed at once, and in-flight endpoint calls
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', '4'))
+INVOKE_CONCURRENCY = int(os.environ.get('INVOKE_CONCURRENCY', '4'))
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '16'))
+# Images sent in the request body; a synchronous Lambda payload is capped at 6 MB,
+# and base64 adds a third
+MAX_INLINE_BYTES = int(os.environ.get('MAX_INLINE_BYTES', str(4 * 1024 * 1024)))
+
+invoke_slots = threading.BoundedSemaphore(INVOKE_CONCURRENCY)
+
+# Set when S3 upload notifications preprocess the originals ahead of the classify call:
+# an existing resized copy is reused, and the upload handler may also cache the prediction
+RESIZED_ARTIFACTS = os.environ.get('RESIZED_ARTIFACTS', 'false') == 'true'
+PRECOMPUTE_PREDICTIONS = os.environ.get('PRECOMPUTE_PREDICTIONS', 'false') == 'true'
+
+# Predictions are cached per (model version, image hash). The in-memory tier
+# survives in warm containers, the table is shared by all of them.
+PREDICTION_CACHE_TABLE = os.environ.get('PREDICTION_CACHE_TABLE')
+PREDICTION_CACHE_TTL = int(os.environ.get('PREDICTION_CACHE_TTL', '86400'))
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '256'))
+# How long the endpoint config name is trusted before describing the endpoint again.
+# After a retrain, a warm container keeps serving predictions cached for the
+# previous model for up to this long.
+MODEL_VERSION_TTL = int(os.environ.get('MODEL_VERSION_TTL', '300'))
+# Wait before describing the endpoint again after a failed DescribeEndpoint
+MODEL_VERSION_RETRY = int(os.environ.get('MODEL_VERSION_RETRY', '30'))
+
+prediction_table = None
+if PREDICTION_CACHE_TABLE:
+    prediction_table = prediction_cache.DynamoDBPredictionTable(
+        PREDICTION_CACHE_TABLE, dynamodb, PREDICTION_CACHE_TTL)
+predictions = prediction_cache.PredictionCache(prediction_table, PREDICTION_CACHE_SIZE)
+model_version = {"value": None, "expires_at": 0}
+
+# Asynchronous jobs: POST /jobs queues the request, GET /jobs/{id} reads the outcome
+JOBS_TABLE = os.environ.get('JOBS_TABLE')
+JOBS_QUEUE_URL = os.environ.get('JOBS_QUEUE_URL')
+
+job_store = jobs.DynamoDBJobStore(JOBS_TABLE, dynamodb) if JOBS_TABLE else None
+job_queue = jobs.SQSJobQueue(JOBS_QUEUE_URL, sqs) if JOBS_QUEUE_URL else None
+
+# SSM parameters read by this function, cached for the container lifetime
+PARAMETER_TTL = int(os.environ.get('PARAMETER_TTL', '300'))
+ssm_parameters = parameters.ParameterCache(ssm_client, ttl=PARAMETER_TTL, names=["resize-lambda"])
+if PREPROCESS_MODE == 'lambda':
+    try:
+        ssm_parameters.prefetch()
+    except Exception as e:
+        # get_parameter falls back to GetParameter on first use
+        print("SSM prefetch failed: {}".format(e))
 
 
 def get_parameter(param_name):
-    response = ssm_client.get_parameter(
-        Name=param_name
-    )
-    return response['Parameter']['Value']
-
-
-def get_description(best_prediction_position, prediction):
-
-    chance = f'{prediction[best_prediction_position]*100:.2f}'
-
-    if(best_prediction_position == NAO):
-        return "Chance of " + chance + "% of not being mammography"
-    elif(best_prediction_position == CCD):
-        return "Chance of " + chance + "% of being a Cranial-Caudal Right (CC-Right)"
-    elif(best_prediction_position == CCE):
-        return "Chance of " + chance + "% of being a Cranial-Caudal Left (CC-Left)"
-    elif(best_prediction_position == MLOD):
-        return "Chance of " + chance + "% of being a Mediolateral-Oblique Right (MLO-Right)"
-    elif(best_prediction_position == MLOE):
-        return "Chance of " + chance + "% of being a Mediolateral-Oblique Left (MLO-Left)"
+    with tracing.span("ssm"):
+        return ssm_parameters.get(param_name)
 
 
 def get_object(bucket_name, object_name):
@@ -58,76 +105,341 @@ def get_object(bucket_name, object_name):
     return response['Body']
 
 
-def get_best_prediction_position(prediction):
+def get_model_version():
+    """Name of the endpoint config currently behind the endpoint.
 
-    higher_prediction = prediction[NAO]
-    position_higher_prediction = NAO
+    Each training run creates a new endpoint config, so the name changes with
+    every retrain. MODEL_VERSION overrides the lookup.
 
-    if prediction[CCD] > higher_prediction:
-        higher_prediction = prediction[CCD]
-        position_higher_prediction = CCD
-    if prediction[CCE] > higher_prediction:
-        higher_prediction = prediction[CCE]
-        position_higher_prediction = CCE
-    if prediction[MLOD] > higher_prediction:
-        higher_prediction = prediction[MLOD]
-        position_higher_prediction = MLOD
-    if prediction[MLOE] > higher_prediction:
-        higher_prediction = prediction[MLOE]
-        position_higher_prediction = MLOE
+    The lookup only serves the prediction cache: when DescribeEndpoint fails
+    (throttling, missing permission, endpoint being updated) the last known
+    name is kept, and without one the request goes without the cache.
 
-    return position_higher_prediction
+    :return: the endpoint config name, or None when it is unknown
+    """
+    if os.environ.get('MODEL_VERSION'):
+        return os.environ['MODEL_VERSION']
 
+    if model_version["expires_at"] <= time.time():
+        try:
+            with tracing.span("describe_endpoint"):
+                response = sagemaker_control.describe_endpoint(EndpointName=os.environ['ENDPOINT_NAME'])
+        except Exception as e:
+            tracing.log_error(e, "describe_endpoint")
+            model_version["expires_at"] = time.time() + MODEL_VERSION_RETRY
+            return model_version["value"]
+        model_version["value"] = response['EndpointConfigName']
+        model_version["expires_at"] = time.time() + MODEL_VERSION_TTL
+    return model_version["value"]
 
-def lambda_handler(event, context):
-    # Get the object from the event and show its content type
-    event_body = event["body"]   
-    payload = json.loads(event_body)
-    
-    bucket = 'mammo-v2-ecs-model-files'
-    filename = payload['filename']
 
-    try:
-        payload = {
-            "bucket": bucket,
-            "filename": filename
-        }
+def get_original_image(bucket, filename):
+    original_key = "{}/{}".format(preprocessing.ORIGINAL_PREFIX, filename)
+    with tracing.span("s3_get_original"):
+        s3_object = get_object(bucket, original_key)
+        if s3_object is None:
+            raise ValueError("Original image {} not found".format(original_key))
+
+        return s3_object.read()
+
+
+def get_resized_image_from_lambda(bucket, filename):
+    """Resize through the resize Lambda, which stores the result in S3.
 
+    :return: bytes of the resized image
+    """
+    payload = {
+        "bucket": bucket,
+        "filename": filename
+    }
+    if tracing.current() is not None:
+        # the resize function logs its stages under the same id
+        payload["trace_id"] = tracing.current().trace_id
+
+    function_name = get_parameter("resize-lambda")
+    with tracing.span("resize_lambda"):
         resized_location = lambda_client.invoke(
-            FunctionName=get_parameter("resize-lambda"),
+            FunctionName=function_name,
             InvocationType='RequestResponse',
             Payload=json.dumps(payload)
         )
 
         resized_location = json.load(resized_location['Payload'])
 
-        body = json.loads(resized_location['body'])
-        resized_bucket = body['bucket']
-        resized_key = body['key']
+    body = json.loads(resized_location['body'])
+    resized_bucket = body['bucket']
+    resized_key = body['key']
 
+    with tracing.span("s3_get_resized"):
         s3_object = get_object(resized_bucket, resized_key)
+        if s3_object is None:
+            raise ValueError("Resized image {} not found".format(resized_key))
+
+        return s3_object.read()
+
+
+def get_resized_artifact(bucket, filename):
+    """:return: bytes of the resized copy written on upload, or None if it is not there yet"""
+    with tracing.span("s3_get_resized"):
+        s3_object = get_object(bucket, "{}/{}".format(preprocessing.RESIZED_PREFIX, filename))
+        return s3_object.read() if s3_object is not None else None
+
 
-        s3_object_byte_array = s3_object.read()
+def get_resized_image(bucket, filename, original):
+    """Resize in memory, without the Lambda hop and the resized S3 copy,
+    unless PREPROCESS_MODE is "lambda". With RESIZED_ARTIFACTS, a copy
+    already made by the upload handler is used instead.
 
-        # invoke sagemaker and append on predicted array
+    :param original: bytes of the original image
+    :return: bytes of the resized image
+    """
+    if RESIZED_ARTIFACTS:
+        resized = get_resized_artifact(bucket, filename)
+        if resized is not None:
+            return resized
+    if PREPROCESS_MODE == 'lambda':
+        return get_resized_image_from_lambda(bucket, filename)
+    return preprocessing.preprocess_image(original, roi_padding=ROI_PADDING, **ENCODE_OPTIONS)
+
+
+def invoke_endpoint(image_bytes):
+    """Send a model-ready image to the endpoint.
+
+    :return: list of class probabilities
+    """
+    with invoke_slots, tracing.span("invoke_endpoint"):
         sagemaker_invoke = sagemaker.invoke_endpoint(EndpointName=os.environ['ENDPOINT_NAME'],
                                                      ContentType='application/x-image',
-                                                     Body=s3_object_byte_array)
+                                                     Body=image_bytes)
+
+    return json.loads(sagemaker_invoke['Body'].read().decode())
+
+
+def classify_original(original, resize):
+    """
+    :param original: bytes of the original image, the cache key is derived from them
+    :param resize: callable returning the resized image, only called on a cache miss
+    """
+    version = get_model_version()
+    if version is None:
+        # without the model version a cached prediction could be stale
+        prediction = invoke_endpoint(resize())
+    else:
+        key = prediction_cache.cache_key(original, version)
+        with tracing.span("cache_lookup"):
+            prediction = predictions.get(key)
+        if prediction is None:
+            prediction = invoke_endpoint(resize())
+            predictions.put(key, prediction)
 
-        prediction = json.loads(sagemaker_invoke['Body'].read().decode())
-        best_prediction_position = get_best_prediction_position(prediction)
+    best_prediction_position = get_best_prediction_position(prediction)
 
-        best_prediction = get_description(best_prediction_position, prediction)
-    
-        result = {
-                "prediction": best_prediction,               
-            }
-        return {
-                'statusCode': 200,
-                'body': json.dumps(result)
-            }
+    return get_description(best_prediction_position, prediction)
+
+
+def classify_image(filename):
+    original = get_original_image(bucket, filename)
+    return classify_original(original, lambda: get_resized_image(bucket, filename, original))
+
+
+class InvalidImage(ValueError):
+    """Bytes sent in the request that cannot be preprocessed, a client error."""
+
+
+def classify_inline_image(image_bytes):
+    """Classify image bytes sent in the request, without any S3 round trip.
+
+    Images the web app already resized to the model input size skip the
+    preprocessing.
+
+    :raises InvalidImage: the bytes are not an image the preprocessing reads
+    """
+    if preprocessing.is_model_ready(image_bytes):
+        return classify_original(image_bytes, lambda: image_bytes)
 
+    def resize():
+        try:
+            return preprocessing.preprocess_image(image_bytes, roi_padding=ROI_PADDING, **ENCODE_OPTIONS)
+        except ValueError as e:
+            raise InvalidImage(str(e)) from e
 
+    return classify_original(image_bytes, resize)
+
+
+def get_inline_image(event, payload):
+    """Image bytes sent in the request, if any.
+
+    Either a binary body (API Gateway binary media type, ``isBase64Encoded``)
+    or an ``image`` field holding base64 in a JSON body.
+
+    :return: bytes or None
+    :raises binascii.Error: the image is not valid base64
+    """
+    if event.get('isBase64Encoded') and payload is None:
+        return base64.b64decode(event['body'])
+    if payload is not None and 'image' in payload:
+        return base64.b64decode(payload['image'])
+    return None
+
+
+def preprocess_upload(bucket, filename):
+    """Resize a freshly uploaded original and store the copy next to it.
+
+    With PRECOMPUTE_PREDICTIONS the prediction is cached as well, so the
+    classify call that follows is only a cache lookup.
+    """
+    original = get_original_image(bucket, filename)
+    resized = preprocessing.preprocess_image(original, roi_padding=ROI_PADDING, **ENCODE_OPTIONS)
+    with tracing.span("s3_put_resized"):
+        s3.put_object(Bucket=bucket, Key="{}/{}".format(preprocessing.RESIZED_PREFIX, filename), Body=resized)
+
+    version = get_model_version() if PRECOMPUTE_PREDICTIONS else None
+    if version is not None:
+        key = prediction_cache.cache_key(original, version)
+        if predictions.get(key) is None:
+            predictions.put(key, invoke_endpoint(resized))
+
+
+def classify_images(filenames):
+    """Classify several images concurrently.
+
+    A failing image is reported in its own result instead of failing the batch.
+
+    :param filenames: list of strings
+    :return: list of {"filename", "prediction"} or {"filename", "error"} dicts, in input order
+    """
+    workers = max(1, min(PREPROCESS_WORKERS, len(filenames)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(classify_image, filename) for filename in filenames]
+
+    results = []
+    for filename, future in zip(filenames, futures):
+        try:
+            results.append({"filename": filename, "prediction": future.result()})
+        except Exception as e:
+            tracing.log_error(e, stage=filename)
+            results.append({"filename": filename, "error": str(e)})
+    return results
+
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body)
+    }
+
+
+def parse_json_body(event):
+    """:return: the JSON object sent in the body, or an error message"""
+    try:
+        payload = json.loads(event.get('body') or '')
+    except ValueError:
+        return None, "the request body must be a JSON object"
+    if not isinstance(payload, dict):
+        return None, "the request body must be a JSON object"
+    return payload, None
+
+
+def get_filenames(payload):
+    """:return: list of filenames, or an error message"""
+    if 'filenames' in payload:
+        filenames = payload['filenames']
+        if not isinstance(filenames, list) or not filenames or len(filenames) > MAX_BATCH_SIZE:
+            return None, "filenames must hold 1 to {} items".format(MAX_BATCH_SIZE)
+        return filenames, None
+    if 'filename' in payload:
+        return [payload['filename']], None
+    return None, "filename or filenames is required"
+
+
+def submit_job(payload):
+    if job_queue is None or job_store is None:
+        return response(501, {"error": "asynchronous jobs are not enabled"})
+
+    filenames, error = get_filenames(payload)
+    if error:
+        return response(400, {"error": error})
+
+    job_id = jobs.new_job_id()
+    job_store.put(job_id, jobs.QUEUED)
+    job_queue.send({"job_id": job_id, "filenames": filenames, "trace_id": tracing.current().trace_id})
+    return response(202, {"job_id": job_id, "status": jobs.QUEUED})
+
+
+def get_job(job_id):
+    if job_store is None:
+        return response(501, {"error": "asynchronous jobs are not enabled"})
+
+    job = job_store.get(job_id)
+    if job is None:
+        return response(404, {"error": "job {} not found".format(job_id)})
+    return response(200, job)
+
+
+def lambda_handler(event, context):
+    trace = tracing.start("classify", tracing.trace_id_from_event(event))
+    trace.payload_size = len(event.get('body') or '')
+    try:
+        result = handle_request(event)
     except Exception as e:
-        print(e)
-        raise e
+        tracing.log_error(e)
+        raise
+    finally:
+        tracing.finish()
+    result.setdefault('headers', {})['X-Correlation-Id'] = trace.trace_id
+    return result
+
+
+def handle_request(event):
+    # API Gateway proxy routes: POST / (synchronous), POST /jobs, GET /jobs/{id}
+    path = (event.get('path') or '/').strip('/')
+    if path.startswith('jobs'):
+        if event.get('httpMethod') == 'GET':
+            return get_job(path[len('jobs/'):])
+        payload, error = parse_json_body(event)
+        if error:
+            return response(400, {"error": error})
+        return submit_job(payload)
+
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    payload = None
+    if headers.get('content-type', 'application/json').startswith('application/json'):
+        payload, error = parse_json_body(event)
+        if error:
+            return response(400, {"error": error})
+
+    try:
+        image_bytes = get_inline_image(event, payload)
+    except (binascii.Error, TypeError):
+        return response(400, {"error": "the image is not valid base64"})
+    if image_bytes is not None:
+        if len(image_bytes) > MAX_INLINE_BYTES:
+            return response(413, {"error": "inline images are limited to {} bytes".format(MAX_INLINE_BYTES)})
+        try:
+            result = {"prediction": classify_inline_image(image_bytes)}
+        except InvalidImage as e:
+            return response(400, {"error": "the image cannot be read: {}".format(e)})
+        print(json.dumps({"prediction_cache": predictions.stats()}))
+        return response(200, result)
+    if payload is None:
+        return response(415, {"error": "unsupported content type {}".format(headers.get('content-type'))})
+
+    filenames, error = get_filenames(payload)
+    if error:
+        return response(400, {"error": error})
+
+    if 'filenames' in payload:
+        results = classify_images(filenames)
+        print(json.dumps({"prediction_cache": predictions.stats()}))
+        return response(200, {"results": results})
+
+    best_prediction = classify_image(filenames[0])
+    print(json.dumps({"prediction_cache": predictions.stats()}))
+
+    result = {
+            "prediction": best_prediction,
+        }
+    return {
+            'statusCode': 200,
+            'body': json.dumps(result)
+        }
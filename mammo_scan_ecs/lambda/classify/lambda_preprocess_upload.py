@@ -0,0 +1,33 @@
+import json
+from urllib.parse import unquote_plus
+
+import lambda_invoke_classifier as classifier
+from mammo_common import preprocessing, tracing
+
+
+def lambda_handler(event, context):
+    """Preprocess originals as soon as they land in S3 (ObjectCreated).
+
+    The page uploads when a file is selected, so the resize (and optionally
+    the prediction) runs while the user is still looking at the image.
+    """
+    tracing.start("upload-preprocess")
+    try:
+        preprocess_records(event['Records'])
+    finally:
+        tracing.finish()
+
+
+def preprocess_records(records):
+    prefix = preprocessing.ORIGINAL_PREFIX + "/"
+    for record in records:
+        bucket = record['s3']['bucket']['name']
+        # object keys are URL-encoded in S3 notifications
+        key = unquote_plus(record['s3']['object']['key'])
+        if not key.startswith(prefix):
+            print("Ignoring {}".format(key))
+            continue
+
+        classifier.preprocess_upload(bucket, key[len(prefix):])
+
+    print(json.dumps({"prediction_cache": classifier.predictions.stats()}))
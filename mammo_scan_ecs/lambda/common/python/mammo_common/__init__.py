@@ -0,0 +1,5 @@
+"""Code shared by the mammography Lambda functions.
+
+Packaged as a Lambda layer (``python/`` is added to ``sys.path`` by the
+Lambda runtime), so every handler can ``import mammo_common``.
+"""
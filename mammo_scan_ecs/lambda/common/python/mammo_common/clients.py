@@ -0,0 +1,67 @@
+"""boto3 clients created on first use, with timeouts matched to each service.
+
+Creating the clients (and importing boto3) at module level puts them on the
+cold start of every function, including the ones that never call a given
+service. ``LazyClient`` stands in for the client at module level and creates
+it on the first method call, so handlers keep using ``s3.get_object(...)``
+and tests can still replace the module attribute with a stub.
+
+All clients keep connections alive, share the pool size and use adaptive
+retries; connect and read timeouts are set per service so a stuck call fails
+within the request budget instead of the 60 s botocore default.
+"""
+import os
+import threading
+
+# Concurrent calls per client: batch requests run PREPROCESS_WORKERS S3 reads
+# and INVOKE_CONCURRENCY endpoint calls at once
+MAX_POOL_CONNECTIONS = int(os.environ.get("CLIENT_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.environ.get("CLIENT_CONNECT_TIMEOUT", "2"))
+MAX_ATTEMPTS = int(os.environ.get("CLIENT_MAX_ATTEMPTS", "3"))
+
+# Read timeouts in seconds. The endpoint answers in ~100 ms, a few seconds
+# leaves room for a slow instance within the 29 s API Gateway limit; the
+# nested resize invoke can take as long as that function's timeout.
+READ_TIMEOUTS = {
+    "sagemaker-runtime": float(os.environ.get("ENDPOINT_READ_TIMEOUT", "8")),
+    "lambda": float(os.environ.get("INVOKE_READ_TIMEOUT", "125")),
+    "s3": 10,
+}
+DEFAULT_READ_TIMEOUT = 5
+
+
+def client_config(service_name):
+    from botocore.config import Config
+
+    return Config(
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUTS.get(service_name, DEFAULT_READ_TIMEOUT),
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "max_attempts": MAX_ATTEMPTS},
+    )
+
+
+def create_client(service_name):
+    import boto3
+
+    return boto3.client(service_name, config=client_config(service_name))
+
+
+class LazyClient:
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """:return: the boto3 client, created on the first call"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = create_client(self.service_name)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,144 @@
+"""DICOM input: one frame of a file, through the Modality and VOI LUTs, to 8 bits.
+
+Only the frame that is classified is converted: the bytes of that frame
+alone are read from native (uncompressed) pixel data, and an encapsulated
+JPEG baseline frame is returned as is so cv2 can decode it at a reduced
+scale like any other JPEG. Other compressed transfer syntaxes go through the
+pydicom pixel data handlers, which decode every frame.
+
+The Modality LUT (rescale slope/intercept) and the VOI LUT (LUT sequence or
+window center/width) are not applied pixel by pixel: they are computed once
+for every stored value between the frame minimum and maximum, and the frame
+is converted with a single table lookup.
+
+preprocessing only imports this module for input carrying the DICM magic,
+so pydicom stays off the cold start of functions that never see DICOM.
+pydicom 2.x is used, the last series that runs on Python 3.9.
+"""
+import io
+import itertools
+
+import numpy as np
+import pydicom
+from pydicom.encaps import generate_pixel_data_frame
+from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi, pixel_dtype
+from pydicom.uid import JPEGBaseline8Bit
+
+# encapsulated transfer syntaxes whose frames cv2 decodes itself
+CV2_TRANSFER_SYNTAXES = {JPEGBaseline8Bit}
+MONOCHROME = ("MONOCHROME1", "MONOCHROME2")
+
+
+def read_header(image_bytes):
+    """:return: the dataset without its pixel data"""
+    return pydicom.dcmread(io.BytesIO(image_bytes), stop_before_pixels=True)
+
+
+def frame_count(header):
+    return int(header.get("NumberOfFrames") or 1)
+
+
+def default_frame(header):
+    """Frame classified in a multi-frame file: the central slice of a
+    tomosynthesis stack, the only frame of a plain mammogram."""
+    return frame_count(header) // 2
+
+
+def check_supported(header):
+    if header.get("SamplesPerPixel", 1) != 1 or header.get("PhotometricInterpretation") not in MONOCHROME:
+        raise ValueError("Unsupported DICOM photometric interpretation {}".format(
+            header.get("PhotometricInterpretation")))
+
+
+def encoded_frame(image_bytes, header, index):
+    """:return: the encoded bytes of the frame when cv2 can decode them, else None"""
+    if header.file_meta.get("TransferSyntaxUID") not in CV2_TRANSFER_SYNTAXES:
+        return None
+    dataset = pydicom.dcmread(io.BytesIO(image_bytes))
+    frames = generate_pixel_data_frame(dataset.PixelData, frame_count(header))
+    return next(itertools.islice(frames, index, None))
+
+
+def read_frame(image_bytes, index):
+    """:return: stored values of one frame, as an integer numpy.ndarray"""
+    dataset = pydicom.dcmread(io.BytesIO(image_bytes))
+    if dataset.file_meta.TransferSyntaxUID.is_compressed or dataset.BitsAllocated % 8:
+        frames = dataset.pixel_array
+        return frames[index] if frame_count(dataset) > 1 else frames
+
+    frame_length = dataset.Rows * dataset.Columns * dataset.BitsAllocated // 8
+    data = dataset.PixelData[index * frame_length:(index + 1) * frame_length]
+    frame = np.frombuffer(data, dtype=pixel_dtype(dataset)).reshape(dataset.Rows, dataset.Columns)
+    return stored_bits(frame, dataset)
+
+
+def stored_bits(frame, header):
+    """Drop the bits above BitsStored (overlays, padding), sign-extending signed data."""
+    unused = header.BitsAllocated - header.BitsStored
+    if not unused:
+        return frame
+    if header.get("PixelRepresentation", 0) == 1:
+        return (frame << unused) >> unused
+    return frame & (2 ** header.BitsStored - 1)
+
+
+def stored_range(header):
+    """:return: (lowest, highest) value the stored bits can hold"""
+    bits = header.BitsStored
+    if header.get("PixelRepresentation", 0) == 1:
+        return -(2 ** (bits - 1)), 2 ** (bits - 1) - 1
+    return 0, 2 ** bits - 1
+
+
+def window(values, center, width, function="LINEAR"):
+    """VOI windowing (PS3.3 C.11.2.1.2) of float values, to [0, 1]."""
+    if function == "SIGMOID":
+        return 1 / (1 + np.exp(-4 * (values - center) / width))
+    if function == "LINEAR_EXACT":
+        return np.clip((values - center) / width + 0.5, 0, 1)
+    if width <= 1:
+        # a one-value window is a threshold
+        return (values > center - 0.5).astype(np.float64)
+    return np.clip((values - (center - 0.5)) / (width - 1) + 0.5, 0, 1)
+
+
+def first_value(value):
+    # window center and width can hold several alternative windows
+    return float(value[0] if isinstance(value, pydicom.multival.MultiValue) else value)
+
+
+def display_lut(header, low, high):
+    """8-bit output for every stored value from low to high.
+
+    :return: uint8 numpy.ndarray of high - low + 1 entries
+    """
+    values = apply_modality_lut(np.arange(low, high + 1), header).astype(np.float64)
+
+    if "VOILUTSequence" in header:
+        bits = header.VOILUTSequence[0].LUTDescriptor[2]
+        output = apply_voi(values, header) / (2 ** bits - 1)
+    elif "WindowCenter" in header and "WindowWidth" in header:
+        output = window(values, first_value(header.WindowCenter), first_value(header.WindowWidth),
+                        header.get("VOILUTFunction", "LINEAR"))
+    else:
+        # no VOI in the file: the whole stored range, so the output does not
+        # depend on the frame content or on the scale it was read at
+        bounds = apply_modality_lut(np.array(stored_range(header)), header).astype(np.float64)
+        output = (values - bounds.min()) / max(bounds.max() - bounds.min(), 1)
+
+    lut = np.rint(np.clip(output, 0, 1) * 255).astype(np.uint8)
+    if header.PhotometricInterpretation == "MONOCHROME1":
+        # MONOCHROME1 shows the lowest value as white
+        lut = 255 - lut
+    return lut
+
+
+def to_uint8(frame, header):
+    """Apply the Modality and VOI LUTs to stored values.
+
+    :param frame: integer numpy.ndarray of stored values
+    :return: uint8 numpy.ndarray of the same shape
+    """
+    low, high = int(frame.min()), int(frame.max())
+    lut = display_lut(header, low, high)
+    return lut[np.subtract(frame, low, dtype=np.int32)]
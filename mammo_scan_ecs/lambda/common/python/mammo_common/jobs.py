@@ -0,0 +1,89 @@
+"""Asynchronous classification jobs.
+
+The API puts a job on a queue and returns its id right away; a worker
+Lambda consumes the queue and writes the outcome to the job store, which
+the API reads back for the status/result route.
+"""
+import json
+import time
+import uuid
+from collections import deque
+
+QUEUED = "QUEUED"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class DynamoDBJobStore:
+    """DynamoDB table with a ``job_id`` partition key and an ``expires_at`` TTL attribute."""
+
+    def __init__(self, table_name, client, ttl_seconds=86400):
+        self.table_name = table_name
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+
+    def put(self, job_id, status, result=None):
+        item = {
+            "job_id": {"S": job_id},
+            "status": {"S": status},
+            "updated_at": {"N": str(int(time.time()))},
+            "expires_at": {"N": str(int(time.time()) + self.ttl_seconds)},
+        }
+        if result is not None:
+            item["result"] = {"S": json.dumps(result)}
+        self.client.put_item(TableName=self.table_name, Item=item)
+
+    def get(self, job_id):
+        """:return: {"job_id", "status", "result"} or None"""
+        item = self.client.get_item(TableName=self.table_name, Key={"job_id": {"S": job_id}}).get("Item")
+        if item is None:
+            return None
+        return {
+            "job_id": job_id,
+            "status": item["status"]["S"],
+            "result": json.loads(item["result"]["S"]) if "result" in item else None,
+        }
+
+
+class InMemoryJobStore:
+    """Local stand-in for DynamoDBJobStore."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def put(self, job_id, status, result=None):
+        self.jobs[job_id] = {"job_id": job_id, "status": status, "result": result}
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+
+class SQSJobQueue:
+
+    def __init__(self, queue_url, client):
+        self.queue_url = queue_url
+        self.client = client
+
+    def send(self, job):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(job))
+
+
+class InMemoryJobQueue:
+    """Local stand-in for SQSJobQueue, hands out SQS-shaped event batches."""
+
+    def __init__(self):
+        self.messages = deque()
+
+    def send(self, job):
+        self.messages.append(json.dumps(job))
+
+    def receive_event(self, batch_size=10):
+        """:return: a Lambda SQS event with up to ``batch_size`` records, or None when empty"""
+        records = []
+        while self.messages and len(records) < batch_size:
+            records.append({"messageId": new_job_id(), "body": self.messages.popleft()})
+        return {"Records": records} if records else None
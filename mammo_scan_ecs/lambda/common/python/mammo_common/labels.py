@@ -0,0 +1,47 @@
+"""Decoding of the 5 class probabilities returned by the endpoint."""
+
+NAO = 0
+CCD = 1
+CCE = 2
+MLOD = 3
+MLOE = 4
+
+# Class folder names of the training dataset, by position
+CLASS_NAMES = ["NAO", "CCD", "CCE", "MLOD", "MLOE"]
+
+
+def get_description(best_prediction_position, prediction):
+
+    chance = f'{prediction[best_prediction_position]*100:.2f}'
+
+    if(best_prediction_position == NAO):
+        return "Chance of " + chance + "% of not being mammography"
+    elif(best_prediction_position == CCD):
+        return "Chance of " + chance + "% of being a Cranial-Caudal Right (CC-Right)"
+    elif(best_prediction_position == CCE):
+        return "Chance of " + chance + "% of being a Cranial-Caudal Left (CC-Left)"
+    elif(best_prediction_position == MLOD):
+        return "Chance of " + chance + "% of being a Mediolateral-Oblique Right (MLO-Right)"
+    elif(best_prediction_position == MLOE):
+        return "Chance of " + chance + "% of being a Mediolateral-Oblique Left (MLO-Left)"
+
+
+def get_best_prediction_position(prediction):
+
+    higher_prediction = prediction[NAO]
+    position_higher_prediction = NAO
+
+    if prediction[CCD] > higher_prediction:
+        higher_prediction = prediction[CCD]
+        position_higher_prediction = CCD
+    if prediction[CCE] > higher_prediction:
+        higher_prediction = prediction[CCE]
+        position_higher_prediction = CCE
+    if prediction[MLOD] > higher_prediction:
+        higher_prediction = prediction[MLOD]
+        position_higher_prediction = MLOD
+    if prediction[MLOE] > higher_prediction:
+        higher_prediction = prediction[MLOE]
+        position_higher_prediction = MLOE
+
+    return position_higher_prediction
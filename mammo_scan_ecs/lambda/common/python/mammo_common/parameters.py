@@ -0,0 +1,93 @@
+"""Cached SSM Parameter Store lookups.
+
+Shared by the Lambda functions and the Streamlit web app, both of which
+read the same few parameters on every request.
+"""
+import threading
+import time
+
+# GetParameters accepts at most 10 names per call
+GET_PARAMETERS_BATCH_SIZE = 10
+
+
+class ParameterCache:
+    """TTL cache in front of SSM ``GetParameter``.
+
+    - ``prefetch`` loads all known names with batched ``GetParameters`` calls.
+    - Values older than ``refresh_after * ttl`` are refreshed on a background
+      thread while the cached value keeps being served.
+    - Expired values are fetched synchronously, but if SSM fails (throttling,
+      network) the last known value is served instead of raising.
+    """
+
+    def __init__(self, client, ttl=300, refresh_after=0.8, names=(), clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.names = list(names)
+        self.clock = clock
+        # {name: (value, fetched_at)}
+        self.values = {}
+        self.refreshing = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, names=None):
+        names = list(names or self.names)
+        for start in range(0, len(names), GET_PARAMETERS_BATCH_SIZE):
+            response = self.client.get_parameters(Names=names[start:start + GET_PARAMETERS_BATCH_SIZE])
+            fetched_at = self.clock()
+            with self._lock:
+                for parameter in response["Parameters"]:
+                    self.values[parameter["Name"]] = (parameter["Value"], fetched_at)
+            if response.get("InvalidParameters"):
+                print("Unknown SSM parameters: {}".format(response["InvalidParameters"]))
+
+    def get(self, name):
+        with self._lock:
+            cached = self.values.get(name)
+
+        if cached is None:
+            return self._fetch(name)
+
+        value, fetched_at = cached
+        age = self.clock() - fetched_at
+        if age >= self.ttl:
+            try:
+                return self._fetch(name)
+            except Exception as e:
+                print("Serving cached {} after SSM error: {}".format(name, e))
+                return value
+        if age >= self.ttl * self.refresh_after:
+            self._refresh_in_background(name)
+        return value
+
+    def wait_for_refresh(self):
+        """Block until background refreshes are done (tests, shutdown)."""
+        with self._lock:
+            threads = list(self.refreshing.values())
+        for thread in threads:
+            thread.join()
+
+    def _fetch(self, name):
+        response = self.client.get_parameter(Name=name)
+        value = response["Parameter"]["Value"]
+        with self._lock:
+            self.values[name] = (value, self.clock())
+        return value
+
+    def _refresh(self, name):
+        try:
+            self._fetch(name)
+        except Exception as e:
+            print("Background refresh of {} failed: {}".format(name, e))
+        finally:
+            with self._lock:
+                self.refreshing.pop(name, None)
+
+    def _refresh_in_background(self, name):
+        with self._lock:
+            if name in self.refreshing:
+                return
+            thread = threading.Thread(target=self._refresh, args=(name,), daemon=True)
+            self.refreshing[name] = thread
+        thread.start()
@@ -0,0 +1,140 @@
+"""Prediction cache keyed by the hash of the original image bytes.
+
+Two tiers: an in-process LRU, which lives as long as the warm Lambda
+container, and a persistent table with a TTL shared by all containers.
+Keys include the model version, so a retrained model never sees the
+predictions of the previous one.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+def cache_key(image_bytes, model_version):
+    return "{}#{}".format(model_version, hashlib.sha256(image_bytes).hexdigest())
+
+
+class LRUCache:
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+class DynamoDBPredictionTable:
+    """DynamoDB table with a ``cache_key`` partition key and an ``expires_at`` TTL attribute."""
+
+    def __init__(self, table_name, client, ttl_seconds=86400):
+        self.table_name = table_name
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={"cache_key": {"S": key}}
+        )
+        item = response.get("Item")
+        # TTL deletion is lazy, expired items can still be returned
+        if item is None or int(item["expires_at"]["N"]) <= time.time():
+            return None
+        return json.loads(item["prediction"]["S"])
+
+    def put(self, key, prediction):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "prediction": {"S": json.dumps(prediction)},
+                "expires_at": {"N": str(int(time.time()) + self.ttl_seconds)},
+            }
+        )
+
+
+class InMemoryPredictionTable:
+    """Local stand-in for DynamoDBPredictionTable."""
+
+    def __init__(self, ttl_seconds=86400):
+        self.ttl_seconds = ttl_seconds
+        self.items = {}
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        prediction, expires_at = self.items[key]
+        if expires_at <= time.time():
+            return None
+        return prediction
+
+    def put(self, key, prediction):
+        self.items[key] = (prediction, time.time() + self.ttl_seconds)
+
+
+class PredictionCache:
+
+    def __init__(self, table=None, max_entries=256):
+        self.memory = LRUCache(max_entries)
+        self.table = table
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key):
+        prediction = self.memory.get(key)
+        if prediction is not None:
+            self._count("memory_hits")
+            return prediction
+
+        if self.table is not None:
+            try:
+                prediction = self.table.get(key)
+            except Exception as e:
+                # the cache must never fail a classification
+                print("Prediction cache lookup failed: {}".format(e))
+                prediction = None
+            if prediction is not None:
+                self._count("table_hits")
+                self.memory.put(key, prediction)
+                return prediction
+
+        self._count("misses")
+        return None
+
+    def put(self, key, prediction):
+        self.memory.put(key, prediction)
+        if self.table is not None:
+            try:
+                self.table.put(key, prediction)
+            except Exception as e:
+                print("Prediction cache store failed: {}".format(e))
+
+    def stats(self):
+        return {
+            "memory_hits": self.counters["memory_hits"],
+            "table_hits": self.counters["table_hits"],
+            "misses": self.counters["misses"],
+            "evictions": self.memory.evictions,
+            "entries": len(self.memory.entries),
+        }
@@ -0,0 +1,313 @@
+import os
+import struct
+
+from mammo_common import tracing
+
+# OpenCV and NumPy are imported on first use (load_cv2): importing them is most
+# of the cold start, and requests served from the cache never need them
+cv2 = None
+np = None
+
+# S3 layout used by the web app and the Lambda functions
+ORIGINAL_PREFIX = "downloaded/original"
+RESIZED_PREFIX = "downloaded/resized"
+
+# (width, height) expected by the model, see "image_shape": "3,300,150"
+TARGET_SIZE = (150, 300)
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 of the full resolution
+REDUCED_FACTORS = (8, 4, 2)
+# names of the cv2.IMREAD_REDUCED_* flags per factor
+REDUCED_GRAYSCALE_FLAGS = {
+    8: "IMREAD_REDUCED_GRAYSCALE_8",
+    4: "IMREAD_REDUCED_GRAYSCALE_4",
+    2: "IMREAD_REDUCED_GRAYSCALE_2",
+}
+REDUCED_COLOR_FLAGS = {
+    8: "IMREAD_REDUCED_COLOR_8",
+    4: "IMREAD_REDUCED_COLOR_4",
+    2: "IMREAD_REDUCED_COLOR_2",
+}
+
+# Region of interest: mammograms are mostly black background. The breast is
+# located on a copy strided down to about ROI_ANALYSIS_WIDTH columns; rows and
+# columns where less than ROI_MIN_FILL of the pixels are tissue are treated as
+# background, which also drops the burnt-in view labels.
+ROI_ANALYSIS_WIDTH = 128
+ROI_MIN_FILL = 0.02
+# margin around the box, as a share of its width and height
+DEFAULT_ROI_PADDING = 0.02
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# IHDR color types of the PNGs encode_image writes: gray (0) and RGB (2)
+PNG_MODEL_READY_COLOR_TYPES = (0, 2)
+# DICOM Part 10 files: a 128-byte preamble, then the magic
+DICOM_MAGIC = b"DICM"
+DICOM_PREAMBLE_LENGTH = 128
+# JPEG start-of-frame markers, the ones that carry the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def load_cv2():
+    global cv2, np
+    if cv2 is None:
+        import cv2 as cv2_module
+        import numpy as numpy_module
+        cv2, np = cv2_module, numpy_module
+
+
+def is_dicom(image_bytes):
+    return image_bytes[DICOM_PREAMBLE_LENGTH:DICOM_PREAMBLE_LENGTH + 4] == DICOM_MAGIC
+
+
+def read_image_header(image_bytes):
+    """Read format, size and channel count from a JPEG, PNG or DICOM header.
+
+    :param image_bytes: bytes
+    :return: ("jpeg" | "png" | "dicom", width, height, channels), or None for other formats
+    """
+    if is_dicom(image_bytes):
+        from mammo_common import dicom
+
+        header = dicom.read_header(image_bytes)
+        return "dicom", header.Columns, header.Rows, header.get("SamplesPerPixel", 1)
+
+    if image_bytes[:8] == PNG_SIGNATURE and image_bytes[12:16] == b"IHDR":
+        width, height, bit_depth, color_type = struct.unpack(">IIBB", image_bytes[16:26])
+        # color types 0 (gray) and 4 (gray + alpha) have a single color channel
+        return "png", width, height, 1 if color_type in (0, 4) else 3
+
+    if image_bytes[:2] != b"\xff\xd8":
+        return None
+
+    position = 2
+    while position + 4 <= len(image_bytes):
+        if image_bytes[position] != 0xFF:
+            return None
+        marker = image_bytes[position + 1]
+        if marker == 0xFF:
+            # fill byte
+            position += 1
+            continue
+        length = struct.unpack(">H", image_bytes[position + 2:position + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            height, width, channels = struct.unpack(">HHB", image_bytes[position + 5:position + 10])
+            return "jpeg", width, height, channels
+        position += 2 + length
+    return None
+
+
+def is_model_ready(image_bytes, size=TARGET_SIZE):
+    """True for a JPEG or PNG already at the model input size, e.g. resized by the web app.
+
+    Only the header is read, such images are sent to the endpoint as they are.
+    A PNG must also be 8-bit gray or RGB, as encode_image writes it: other
+    bit depths and color types still go through to_uint8 and the ROI crop.
+    """
+    if is_dicom(image_bytes):
+        return False
+    header = read_image_header(image_bytes)
+    if header is None or header[0] not in ("jpeg", "png") or tuple(header[1:3]) != tuple(size):
+        return False
+    if header[0] == "png":
+        bit_depth, color_type = struct.unpack(">BB", image_bytes[24:26])
+        return bit_depth == 8 and color_type in PNG_MODEL_READY_COLOR_TYPES
+    return True
+
+
+def reduced_decode_factor(width, height, size=TARGET_SIZE):
+    """Largest libjpeg scale factor that still decodes at or above ``size``."""
+    for factor in REDUCED_FACTORS:
+        if width // factor >= size[0] and height // factor >= size[1]:
+            return factor
+    return 1
+
+
+def decode_flag(image_bytes, size=TARGET_SIZE):
+    """cv2.imdecode flag for the cheapest decode that can still produce ``size``.
+
+    Only JPEG benefits from a reduced decode: libjpeg skips the DCT work and
+    never allocates the full-resolution frame. Other formats are decoded as
+    they are, keeping their bit depth.
+    """
+    load_cv2()
+    header = read_image_header(image_bytes)
+    if header is None or header[0] != "jpeg":
+        return cv2.IMREAD_UNCHANGED
+
+    _, width, height, channels = header
+    factor = reduced_decode_factor(width, height, size)
+    if factor == 1:
+        return cv2.IMREAD_UNCHANGED
+    flags = REDUCED_GRAYSCALE_FLAGS if channels == 1 else REDUCED_COLOR_FLAGS
+    return getattr(cv2, flags[factor])
+
+
+def decode_image(image_bytes, size=None):
+    """Decode an encoded image (JPEG, PNG, DICOM, ...) held in memory.
+
+    :param image_bytes: bytes
+    :param size: (width, height) the image will be resized to. When given,
+        large JPEGs are decoded at a reduced scale.
+    :return: numpy.ndarray
+    """
+    load_cv2()
+    if is_dicom(image_bytes):
+        return decode_dicom(image_bytes, size)
+    flag = cv2.IMREAD_UNCHANGED if size is None else decode_flag(image_bytes, size)
+    # frombuffer wraps the bytes without copying them
+    np_array = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(np_array, flag)
+    if image is None:
+        raise ValueError("Unable to decode image")
+    return image
+
+
+def decode_dicom(image_bytes, size=None, frame=None):
+    """Decode one frame of a DICOM file to 8 bits.
+
+    The frame is brought down to the reduced-decode scale before the VOI LUT
+    is applied: encapsulated JPEG frames go through the reduced JPEG decode,
+    native ones are area-averaged to the same factor.
+
+    :param image_bytes: bytes of a DICOM Part 10 file
+    :param size: (width, height) the image will be resized to, or None
+    :param frame: index of the frame, by default the central one
+    :return: uint8 numpy.ndarray
+    """
+    from mammo_common import dicom
+
+    load_cv2()
+    header = dicom.read_header(image_bytes)
+    dicom.check_supported(header)
+    index = dicom.default_frame(header) if frame is None else frame
+    if not 0 <= index < dicom.frame_count(header):
+        raise ValueError("Frame {} out of range, the file has {}".format(index, dicom.frame_count(header)))
+
+    encoded = dicom.encoded_frame(image_bytes, header, index)
+    if encoded is not None:
+        image = decode_image(encoded, size)
+    else:
+        image = dicom.read_frame(image_bytes, index)
+        if size is not None:
+            factor = reduced_decode_factor(header.Columns, header.Rows, size)
+            if factor > 1:
+                image = cv2.resize(image, (header.Columns // factor, header.Rows // factor),
+                                   interpolation=cv2.INTER_AREA)
+    return dicom.to_uint8(image, header)
+
+
+def resize_image(image, size=TARGET_SIZE):
+    load_cv2()
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def to_uint8(image):
+    """Scale 16-bit images (12/16-bit mammograms) to the 8 bits JPEG can hold."""
+    load_cv2()
+    if image.dtype == np.uint8:
+        return image
+    max_value = int(image.max()) or 1
+    return cv2.convertScaleAbs(image, alpha=255.0 / max_value)
+
+
+def encode_image(image, output_format="jpeg", jpeg_quality=95, png_compression=3):
+    """Encode an image in memory.
+
+    :param image: numpy.ndarray
+    :param output_format: "jpeg" or "png"
+    :param jpeg_quality: 0-100, used for JPEG
+    :param png_compression: 0-9, used for PNG
+    :return: bytes
+    """
+    load_cv2()
+    if output_format == "png":
+        ext, params = ".png", [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    elif output_format == "jpeg":
+        ext, params = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+    else:
+        raise ValueError("Unsupported output format {}".format(output_format))
+
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError("Unable to encode image as {}".format(output_format))
+    return buffer.tobytes()
+
+
+def encode_options_from_env():
+    """Output encoding configured through OUTPUT_FORMAT, JPEG_QUALITY and PNG_COMPRESSION."""
+    return {
+        "output_format": os.environ.get("OUTPUT_FORMAT", "jpeg"),
+        "jpeg_quality": int(os.environ.get("JPEG_QUALITY", "95")),
+        "png_compression": int(os.environ.get("PNG_COMPRESSION", "3")),
+    }
+
+
+def roi_padding_from_env():
+    """ROI_PADDING when ROI_CROP is "true", None (no crop) otherwise.
+
+    Training and inference must agree: the stacks set both from the dataset manifest.
+    """
+    if os.environ.get("ROI_CROP", "false") != "true":
+        return None
+    return float(os.environ.get("ROI_PADDING", str(DEFAULT_ROI_PADDING)))
+
+
+def find_roi(image, padding=DEFAULT_ROI_PADDING, min_fill=ROI_MIN_FILL):
+    """Bounding box of the breast.
+
+    Otsu threshold on a strided copy of the image, then the first and last
+    rows and columns whose share of tissue pixels reaches ``min_fill``.
+
+    :param image: numpy.ndarray, grayscale or color, any bit depth
+    :param padding: margin added on each side, as a share of the box size
+    :return: (x0, y0, x1, y1); the whole frame when no tissue is found
+    """
+    load_cv2()
+    height, width = image.shape[:2]
+    step = max(1, width // ROI_ANALYSIS_WIDTH)
+    small = image[::step, ::step]
+    if small.ndim == 3:
+        small = small.max(axis=2)
+    small = to_uint8(np.ascontiguousarray(small))
+
+    _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    tissue = mask > 0
+    rows = np.flatnonzero(tissue.mean(axis=1) >= min_fill)
+    columns = np.flatnonzero(tissue.mean(axis=0) >= min_fill)
+    if not len(rows) or not len(columns):
+        return 0, 0, width, height
+
+    x0, x1 = columns[0] * step, min(width, (columns[-1] + 1) * step)
+    y0, y1 = rows[0] * step, min(height, (rows[-1] + 1) * step)
+    pad_x, pad_y = int((x1 - x0) * padding), int((y1 - y0) * padding)
+    return max(0, x0 - pad_x), max(0, y0 - pad_y), min(width, x1 + pad_x), min(height, y1 + pad_y)
+
+
+def crop_to_roi(image, padding=DEFAULT_ROI_PADDING):
+    """:return: view of the image cropped to find_roi, no pixels are copied"""
+    x0, y0, x1, y1 = find_roi(image, padding)
+    return image[y0:y1, x0:x1]
+
+
+def preprocess_image(image_bytes, size=TARGET_SIZE, roi_padding=None, **encode_options):
+    """Turn the original image into the model-ready payload.
+
+    :param image_bytes: bytes of the original image
+    :param roi_padding: crop to the breast region with this padding before
+        resizing, None keeps the whole frame
+    :param encode_options: keyword arguments of encode_image
+    :return: bytes of the resized image, ready for invoke_endpoint
+    """
+    with tracing.span("decode"):
+        image = decode_image(image_bytes, size)
+    if roi_padding is not None:
+        with tracing.span("roi"):
+            cropped = crop_to_roi(image, roi_padding)
+        # decoded pixels the resize no longer reads
+        tracing.measure("RoiBytesSaved", image.nbytes - cropped.nbytes, "Bytes")
+        image = cropped
+    with tracing.span("resize"):
+        resized_image = to_uint8(resize_image(image, size))
+    with tracing.span("encode"):
+        return encode_image(resized_image, **encode_options)
@@ -0,0 +1,162 @@
+"""Per-stage timings, emitted as CloudWatch Embedded Metric Format (EMF).
+
+A handler starts a trace per invocation, wraps each stage in ``span(name)``
+and calls ``finish()`` before returning. ``finish()`` prints one EMF line:
+CloudWatch turns the stage durations into metrics, with the function name,
+cold/warm start and payload size class as dimensions, and the line stays
+searchable by ``trace_id``.
+
+The trace id comes from the ``X-Correlation-Id`` header (or the API Gateway
+request id) and is passed on to nested invocations, so the lines written by
+the classify and resize functions for one request share it.
+
+A Lambda container handles one request at a time, so the current trace is
+module state; spans opened from worker threads are recorded on it as well.
+Traces nest when a handler calls another one in-process (tests, benchmarks).
+"""
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+NAMESPACE = "MammographyClassification"
+TRACE_HEADER = "x-correlation-id"
+
+# Upper bounds of the PayloadSize dimension, a few classes keep the metric count low
+PAYLOAD_SIZE_CLASSES = ((100 * 1024, "<100KB"), (1024 * 1024, "<1MB"), (5 * 1024 * 1024, "<5MB"))
+
+_cold_start = True
+_current = None
+_outer = []
+
+
+def payload_size_class(size):
+    if size is None:
+        return "unknown"
+    for limit, name in PAYLOAD_SIZE_CLASSES:
+        if size < limit:
+            return name
+    return ">=5MB"
+
+
+def trace_id_from_event(event):
+    """:return: the caller's correlation id, the API Gateway request id, or a new id"""
+    if event.get('trace_id'):
+        return event['trace_id']
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    if headers.get(TRACE_HEADER):
+        return headers[TRACE_HEADER]
+    request_id = (event.get('requestContext') or {}).get('requestId')
+    return request_id or uuid.uuid4().hex
+
+
+class Trace:
+
+    def __init__(self, function_name, trace_id=None, clock=time.perf_counter):
+        global _cold_start
+        self.function_name = function_name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.cold_start = _cold_start
+        _cold_start = False
+        self.clock = clock
+        self.started = clock()
+        self.payload_size = None
+        # {stage: [milliseconds, ...]}, a stage may run once per image of a batch
+        self.spans = defaultdict(list)
+        # other per-request metrics: {name: (unit, [values])}
+        self.measurements = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, milliseconds):
+        with self._lock:
+            self.spans[name].append(round(milliseconds, 3))
+
+    def measure(self, name, value, unit):
+        with self._lock:
+            self.measurements.setdefault(name, (unit, []))[1].append(value)
+
+    @contextmanager
+    def span(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, (self.clock() - start) * 1000)
+
+    def error(self, e, stage=None):
+        print(json.dumps({"trace_id": self.trace_id, "function": self.function_name,
+                          "stage": stage, "error": type(e).__name__, "message": str(e)}))
+
+    def emf(self):
+        """:return: the EMF document for this trace"""
+        self.record("total", (self.clock() - self.started) * 1000)
+        dimensions = {
+            "Function": self.function_name,
+            "ColdStart": "cold" if self.cold_start else "warm",
+            "PayloadSize": payload_size_class(self.payload_size),
+        }
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in self.spans]
+                               + [{"Name": name, "Unit": unit} for name, (unit, _) in self.measurements.items()],
+                }],
+            },
+            "trace_id": self.trace_id,
+            "payload_bytes": self.payload_size,
+        }
+        document.update(dimensions)
+        document.update({name: values if len(values) > 1 else values[0] for name, values in self.spans.items()})
+        document.update({name: values if len(values) > 1 else values[0]
+                         for name, (_, values) in self.measurements.items()})
+        return document
+
+
+def start(function_name, trace_id=None):
+    """Start the trace of the current invocation."""
+    global _current
+    _outer.append(_current)
+    _current = Trace(function_name, trace_id)
+    return _current
+
+
+def current():
+    return _current
+
+
+@contextmanager
+def span(name):
+    """Time a stage of the current trace, a plain block when no trace is started."""
+    if _current is None:
+        yield
+        return
+    with _current.span(name):
+        yield
+
+
+def measure(name, value, unit="None"):
+    """Add a metric other than a duration to the current trace, ignored without one."""
+    if _current is not None:
+        _current.measure(name, value, unit)
+
+
+def log_error(e, stage=None):
+    """Log an error with the current trace id, if any."""
+    if _current is None:
+        print("{}: {}".format(stage, e) if stage else e)
+        return
+    _current.error(e, stage)
+
+
+def finish():
+    """Print the EMF line of the current trace and end it."""
+    global _current
+    if _current is None:
+        return
+    print(json.dumps(_current.emf()))
+    _current = _outer.pop() if _outer else None
@@ -1,42 +1,41 @@
 import json
-import cv2
-import boto3
-import numpy as np
 
+from mammo_common import preprocessing, tracing
+from mammo_common.clients import LazyClient
 
-s3 = boto3.client('s3')
-sagemaker = boto3.client('runtime.sagemaker')
-lambda_client = boto3.client('lambda')
 
-original_path = "downloaded/original"
-resized_path = "downloaded/resized"
+s3 = LazyClient('s3')
+
+original_path = preprocessing.ORIGINAL_PREFIX
+resized_path = preprocessing.RESIZED_PREFIX
+
+ENCODE_OPTIONS = preprocessing.encode_options_from_env()
+# crop to the breast region, as the training dataset was (None: whole frame)
+ROI_PADDING = preprocessing.roi_padding_from_env()
 
 
 def lambda_handler(event, context):
-       
+
     IMAGE_FILE = event['filename']
     bucket = event['bucket']
 
-    try:
-        s3_object = s3.get_object(Bucket=bucket, Key="{}/{}".format(original_path, IMAGE_FILE))
-        s3_object_byte_array = s3_object['Body'].read()
+    # the classify function passes its trace id along
+    trace = tracing.start("resize", tracing.trace_id_from_event(event))
 
-        # creating 1D array from bytes data range between[0,255]
-        np_array = np.fromstring(s3_object_byte_array, np.uint8)
-
-        # decoding array
-        s3_object_imdecode = cv2.imdecode(np_array, cv2.IMREAD_UNCHANGED)
+    try:
+        with tracing.span("s3_get_original"):
+            s3_object = s3.get_object(Bucket=bucket, Key="{}/{}".format(original_path, IMAGE_FILE))
+            s3_object_byte_array = s3_object['Body'].read()
+        trace.payload_size = len(s3_object_byte_array)
 
-        resized_image = cv2.resize(
-            s3_object_imdecode, (150, 300), interpolation=cv2.INTER_AREA)
-       
-        # saving image to tmp (writable) directory    
-        print("ResizeMammography.tmp_file_name = " + IMAGE_FILE)
-        cv2.imwrite(IMAGE_FILE, resized_image)
+        # reduced-scale decode, resize and encode in memory, no /tmp round trip
+        resized_image = preprocessing.preprocess_image(
+            s3_object_byte_array, roi_padding=ROI_PADDING, **ENCODE_OPTIONS)
 
         # uploading converted image to S3 bucket
-        s3.put_object(Bucket=bucket, Key="{}/{}".format(resized_path, IMAGE_FILE),
-                      Body=open("/tmp/"+ IMAGE_FILE, "rb").read())
+        with tracing.span("s3_put_resized"):
+            s3.put_object(Bucket=bucket, Key="{}/{}".format(resized_path, IMAGE_FILE),
+                          Body=resized_image)
 
         result = {
             "bucket": bucket,
@@ -48,5 +47,8 @@ def lambda_handler(event, context):
         }
 
     except Exception as e:
-        print(e)
-        raise e
\ No newline at end of file
+        tracing.log_error(e)
+        raise e
+
+    finally:
+        tracing.finish()
@@ -7,28 +7,47 @@ sfn_client = boto3.client('stepfunctions')
 prefix = 'resize'
 bucket = 'mammo-v2-ecs-model-files'
 STATE_MACHINE_ARN = os.environ['STATE_MACHINE_ARN']
+# "Pipe" trains from the RecordIO shards written by scripts/build_dataset.py
+INPUT_MODE = os.environ.get('INPUT_MODE', 'File')
 
 
 
 # Four channels: train, validation, train_lst, and validation_lst
-s3train = 's3://{}/{}/train/'.format(bucket, prefix)
-s3validation = 's3://{}/{}/test/'.format(bucket, prefix)
+# (Pipe mode only uses train and validation)
+if INPUT_MODE == 'Pipe':
+    s3train = 's3://{}/{}/recordio/train/'.format(bucket, prefix)
+    s3validation = 's3://{}/{}/recordio/test/'.format(bucket, prefix)
+else:
+    s3train = 's3://{}/{}/train/'.format(bucket, prefix)
+    s3validation = 's3://{}/{}/test/'.format(bucket, prefix)
 s3train_lst = 's3://{}/{}/train-data.lst'.format(bucket, prefix)
 s3validation_lst = 's3://{}/{}/test-data.lst'.format(bucket, prefix)
-job_name = 'mammography-classification-' + datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
 prefix_output='model/output'
 s3_output_location = 's3://{}/{}'.format(bucket, prefix_output)
+# Spot training checkpoints, one folder per run
+prefix_checkpoints = 'model/checkpoints'
 
 
 def lambda_handler(event, context):
+    # a warm container starts several runs, each needs its own job names
+    now = datetime.now()
+    job_name = 'mammography-classification-' + now.strftime("%Y-%m-%d-%H-%M-%S")
+    # Tuning job names are limited to 32 characters
+    tuning_job_name = 'mammo-hpo-' + now.strftime("%y%m%d-%H%M%S")
+    # {"resume": "<smJobName of an earlier run>"} continues that run from its
+    # last checkpoint, e.g. after it hit the maximum runtime
+    run_name = (event or {}).get('resume') or job_name
+    s3_checkpoint_location = 's3://{}/{}/{}'.format(bucket, prefix_checkpoints, run_name)
    
     statemachine_payload = {
         "smJobName": job_name,              
+        "smTuningJobName": tuning_job_name,
         "s3train": s3train,          
         "s3validation": s3validation,
         "s3train_lst": s3train_lst,
         "s3validation_lst": s3validation_lst,
         "s3_output_location": s3_output_location,     
+        "s3_checkpoint_location": s3_checkpoint_location,
     }
  
     response = sfn_client.start_execution(
@@ -0,0 +1,39 @@
+from aws_cdk import aws_lambda as _lambda
+
+
+def preprocessing_layers(scope, runtime):
+    """Layers of the functions that preprocess images: opencv, numpy, pydicom and mammo_common.
+
+    The opencv, numpy and pydicom zips are built outside the repo
+    (lambda_layers/), for the given runtime.
+
+    :return: [opencv layer, numpy layer, pydicom layer, common layer]
+    """
+    cv2_layer = _lambda.LayerVersion(    
+        scope, "opencv-layer",
+        code=_lambda.Code.from_asset("./lambda_layers/opencv.zip"),
+        compatible_runtimes=[runtime],
+    )
+
+    numpy_layer = _lambda.LayerVersion(
+        scope, "numpy-layer",
+        code=_lambda.Code.from_asset("./lambda_layers/numpy.zip"),
+        compatible_runtimes=[runtime],
+    )
+
+    # DICOM input, only imported when a DICOM file comes in
+    pydicom_layer = _lambda.LayerVersion(
+        scope, "pydicom-layer",
+        code=_lambda.Code.from_asset("./lambda_layers/pydicom.zip"),
+        compatible_runtimes=[runtime],
+    )
+
+    # Code shared by the functions (preprocessing, labels, ...)
+    common_layer = _lambda.LayerVersion(
+        scope, "common-layer",
+        code=_lambda.Code.from_asset("./mammo_scan_ecs/lambda/common"),
+        compatible_runtimes=[runtime],
+    )
+
+    return [cv2_layer, numpy_layer, pydicom_layer, common_layer]
+
@@ -15,6 +15,13 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from mammo_scan_ecs.batch_config import batch_transform_settings
+from mammo_scan_ecs.endpoint_config import VARIANT_NAME, deployment_config, endpoint_settings, rollout_seconds
+from mammo_scan_ecs.layers import preprocessing_layers
+from mammo_scan_ecs.training_config import (CHECKPOINT_LOCAL_PATH, preprocessing_environment, spot_training,
+                                            training_resources)
+from mammo_scan_ecs.tuning_config import hyperparameter_search, tuning_job_config
+
 class SageMakerStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, sagemaker_configs, **kwargs) -> None:
@@ -25,6 +32,11 @@ class SageMakerStack(Stack):
         ENDPOINT_NAME = sagemaker_configs["endpoint_name"]
         TRN_INSTANCE_TYPE = sagemaker_configs["training_instance_type"]
         INFERENCE_INSTANCE_TYPE = sagemaker_configs["inference_instance_type"]
+        # "instance" (optionally autoscaled) or "serverless" inference
+        ENDPOINT_SETTINGS = endpoint_settings(sagemaker_configs.get("endpoint"))
+        AUTOSCALING = ENDPOINT_SETTINGS["autoscaling"]
+        ROLLOUT = ENDPOINT_SETTINGS["rollout"]
+        BATCH_TRANSFORM = batch_transform_settings(sagemaker_configs.get("batch_transform"))
 
         random_number = random.randint(1000, 2000)   
 
@@ -44,56 +56,92 @@ class SageMakerStack(Stack):
                 ])},
             role_name="sagemaker-execution-role"
          )
-        training_job_task = tasks.SageMakerCreateTrainingJob(self, "CreateTrainingJob",
-            algorithm_specification=tasks.AlgorithmSpecification(
-                training_image=tasks.DockerImage.from_registry(IMAGE_URI),
-                training_input_mode=tasks.InputMode.FILE
-            ),
-            input_data_config=[tasks.Channel(
-                channel_name="train",
-                data_source=tasks.DataSource(
-                    s3_data_source=tasks.S3DataSource(
-                        s3_data_distribution_type=tasks.S3DataDistributionType.FULLY_REPLICATED,
-                        s3_data_type=tasks.S3DataType.S3_PREFIX,
-                        s3_location=tasks.S3Location.from_json_expression("$.s3train")
-                    )
-                ),
-                content_type="application/x-image"
-            ),
-            tasks.Channel(
-                channel_name="validation",
-                data_source=tasks.DataSource(
-                    s3_data_source=tasks.S3DataSource(
-                        s3_data_distribution_type=tasks.S3DataDistributionType.FULLY_REPLICATED,
-                        s3_data_type=tasks.S3DataType.S3_PREFIX,
-                        s3_location=tasks.S3Location.from_json_expression("$.s3validation")
-                    )
-                ),
-                content_type="application/x-image"
-            ),
-            tasks.Channel(
-                channel_name="train_lst",
-                data_source=tasks.DataSource(
-                    s3_data_source=tasks.S3DataSource(
-                        s3_data_distribution_type=tasks.S3DataDistributionType.FULLY_REPLICATED,
-                        s3_data_type=tasks.S3DataType.S3_PREFIX,
-                        s3_location=tasks.S3Location.from_json_expression("$.s3train_lst")
-                    )
-                ),
-                content_type="application/x-image"
-            ),
-            tasks.Channel(
-                channel_name="validation_lst",
+        # File copies the dataset (images + .lst) to the instance volume before
+        # training starts, Pipe streams RecordIO shards from S3.
+        TRAINING_RESOURCES = training_resources(
+            sagemaker_configs.get("dataset_manifest"),
+            input_mode=sagemaker_configs.get("training_input_mode", "auto"),
+        )
+        INPUT_MODE = TRAINING_RESOURCES["input_mode"]
+        TRN_INSTANCE_COUNT = TRAINING_RESOURCES["instance_count"]
+
+        if TRN_INSTANCE_COUNT > 1:
+            HYPER_PARAMS = {**HYPER_PARAMS, "kv_store": "dist_sync"}
+
+        HYPERPARAMETER_SEARCH = hyperparameter_search(sagemaker_configs.get("hyperparameter_search"), HYPER_PARAMS)
+
+        MAX_RUNTIME_HOURS = 2
+        SPOT_TRAINING = spot_training(sagemaker_configs.get("spot_training"), MAX_RUNTIME_HOURS)
+        stopping_condition = {"MaxRuntimeInSeconds": Duration.hours(MAX_RUNTIME_HOURS).to_seconds()}
+        spot_parameters = {}
+        if SPOT_TRAINING:
+            stopping_condition["MaxWaitTimeInSeconds"] = Duration.hours(SPOT_TRAINING["max_wait_hours"]).to_seconds()
+            # SageMaker syncs LocalPath to S3 during training and restores it when
+            # the job restarts after an interruption; the algorithm resumes from
+            # the last epoch checkpoint it finds there
+            spot_parameters = {
+                "EnableManagedSpotTraining": True,
+                "CheckpointConfig": {"S3Uri.$": "$.s3_checkpoint_location", "LocalPath": CHECKPOINT_LOCAL_PATH},
+            }
+        # a training job can take until its MaxWaitTime (spot) or MaxRuntime
+        TRAINING_JOB_MINUTES = 60 * (SPOT_TRAINING["max_wait_hours"] if SPOT_TRAINING else MAX_RUNTIME_HOURS)
+
+        def training_channel(channel_name, json_path, content_type, sharded=False):
+            return tasks.Channel(
+                channel_name=channel_name,
                 data_source=tasks.DataSource(
                     s3_data_source=tasks.S3DataSource(
-                        s3_data_distribution_type=tasks.S3DataDistributionType.FULLY_REPLICATED,
+                        s3_data_distribution_type=tasks.S3DataDistributionType.SHARDED_BY_S3_KEY if sharded
+                            else tasks.S3DataDistributionType.FULLY_REPLICATED,
                         s3_data_type=tasks.S3DataType.S3_PREFIX,
-                        s3_location=tasks.S3Location.from_json_expression("$.s3validation_lst")
+                        s3_location=tasks.S3Location.from_json_expression(json_path)
                     )
                 ),
-                content_type="application/x-image"
+                content_type=content_type
             )
-            ],
+
+        def tuning_channel(channel_name, json_path, content_type, sharded=False):
+            return {
+                "ChannelName": channel_name,
+                "DataSource": {
+                    "S3DataSource": {
+                        "S3DataDistributionType": "ShardedByS3Key" if sharded else "FullyReplicated",
+                        "S3DataType": "S3Prefix",
+                        "S3Uri.$": json_path,
+                    }
+                },
+                "ContentType": content_type,
+            }
+
+        if INPUT_MODE == "Pipe":
+            # Each RecordIO shard is self-contained, so instances can train on
+            # disjoint shards instead of each reading the whole dataset
+            channels = [
+                ("train", "$.s3train", "application/x-recordio", TRN_INSTANCE_COUNT > 1),
+                ("validation", "$.s3validation", "application/x-recordio", False),
+            ]
+        else:
+            # .lst files reference images by path, every instance needs all of them
+            channels = [
+                ("train", "$.s3train", "application/x-image", False),
+                ("validation", "$.s3validation", "application/x-image", False),
+                ("train_lst", "$.s3train_lst", "application/x-image", False),
+                ("validation_lst", "$.s3validation_lst", "application/x-image", False),
+            ]
+        input_data_config = [training_channel(*channel) for channel in channels]
+
+        # billable time is below the training time by the spot savings
+        training_time_selector = {
+            "TrainingTimeInSeconds.$": "$.TrainingTimeInSeconds",
+            "BillableTimeInSeconds.$": "$.BillableTimeInSeconds",
+        } if SPOT_TRAINING else {}
+
+        training_job_task = tasks.SageMakerCreateTrainingJob(self, "CreateTrainingJob",
+            algorithm_specification=tasks.AlgorithmSpecification(
+                training_image=tasks.DockerImage.from_registry(IMAGE_URI),
+                training_input_mode=tasks.InputMode.PIPE if INPUT_MODE == "Pipe" else tasks.InputMode.FILE
+            ),
+            input_data_config=input_data_config,
             output_data_config=tasks.OutputDataConfig(
                 s3_output_location=tasks.S3Location.from_json_expression("$.s3_output_location")
             ),
@@ -101,23 +149,111 @@ class SageMakerStack(Stack):
             hyperparameters=HYPER_PARAMS,
             role=tasks_execution_role,           
             resource_config=tasks.ResourceConfig(
-                instance_count=1,
+                instance_count=TRN_INSTANCE_COUNT,
                 instance_type=ec2.InstanceType(TRN_INSTANCE_TYPE),
-                volume_size=Size.gibibytes(20)
+                volume_size=Size.gibibytes(TRAINING_RESOURCES["volume_size_gib"])
             ),
             stopping_condition=tasks.StoppingCondition(
-                max_runtime=Duration.hours(2)
+                max_runtime=Duration.hours(MAX_RUNTIME_HOURS)
             ),
             integration_pattern=sfn.IntegrationPattern.RUN_JOB,
             result_path= "$.TrainJobResults",
             result_selector={ 
                 "ModelName.$": "$.TrainingJobName",
-                "ModelArtifacts.$": "$.ModelArtifacts.S3ModelArtifacts"
+                "ModelArtifacts.$": "$.ModelArtifacts.S3ModelArtifacts",
+                **training_time_selector,
              },
-            task_timeout=sfn.Timeout.duration(Duration.minutes(60)),
+            task_timeout=sfn.Timeout.duration(Duration.minutes(TRAINING_JOB_MINUTES)),
             # state_name="Train Model"           
         )
 
+        if SPOT_TRAINING:
+            # EnableManagedSpotTraining, MaxWaitTime and CheckpointConfig are not
+            # exposed by SageMakerCreateTrainingJob in this CDK version: render
+            # the task and add them to its parameters
+            training_state = training_job_task.to_state_json()
+            training_state.pop("End", None)
+            training_state["Parameters"].update(spot_parameters)
+            training_state["Parameters"]["StoppingCondition"] = stopping_condition
+            training_job_task = sfn.CustomState(Construct(self, "SpotTraining"), "CreateTrainingJob",
+                state_json=training_state)
+
+        if HYPERPARAMETER_SEARCH:
+            # One tuning job trains the grid, max_parallel_jobs at a time, and
+            # ranks the jobs by validation accuracy. Neither the tuning job nor
+            # its .sync integration has a task construct in this CDK version.
+            tuning_job_task = sfn.CustomState(self, "CreateHyperParameterTuningJob",
+                state_json={
+                    "Type": "Task",
+                    "Resource": f"arn:{Aws.PARTITION}:states:::sagemaker:createHyperParameterTuningJob.sync",
+                    "Parameters": {
+                        "HyperParameterTuningJobName.$": "$.smTuningJobName",
+                        "HyperParameterTuningJobConfig": tuning_job_config(HYPERPARAMETER_SEARCH),
+                        "TrainingJobDefinition": {
+                            "AlgorithmSpecification": {
+                                "TrainingImage": IMAGE_URI,
+                                "TrainingInputMode": INPUT_MODE,
+                            },
+                            "RoleArn": tasks_execution_role.role_arn,
+                            "InputDataConfig": [tuning_channel(*channel) for channel in channels],
+                            "OutputDataConfig": {"S3OutputPath.$": "$.s3_output_location"},
+                            "ResourceConfig": {
+                                "InstanceCount": TRN_INSTANCE_COUNT,
+                                "InstanceType": f"ml.{TRN_INSTANCE_TYPE}",
+                                "VolumeSizeInGB": TRAINING_RESOURCES["volume_size_gib"],
+                            },
+                            "StoppingCondition": stopping_condition,
+                            "StaticHyperParameters": HYPERPARAMETER_SEARCH["static_hyperparameters"],
+                            **spot_parameters,
+                        },
+                    },
+                    "ResultPath": "$.TuningJobResults",
+                    "ResultSelector": {
+                        "BestTrainingJobName.$": "$.BestTrainingJob.TrainingJobName",
+                        "BestAccuracy.$": "$.BestTrainingJob.FinalHyperParameterTuningJobObjectiveMetric.Value",
+                    },
+                    "TimeoutSeconds": Duration.minutes(TRAINING_JOB_MINUTES * HYPERPARAMETER_SEARCH["waves"]).to_seconds(),
+                },
+            )
+            # Same shape as the CreateTrainingJob result, CreateModel is unchanged
+            best_training_job_task = tasks.CallAwsService(self, "DescribeBestTrainingJob",
+                service="sagemaker",
+                action="describeTrainingJob",
+                parameters={"TrainingJobName": sfn.JsonPath.string_at("$.TuningJobResults.BestTrainingJobName")},
+                iam_resources=["*"],
+                result_path="$.TrainJobResults",
+                result_selector={
+                    "ModelName.$": "$.TrainingJobName",
+                    "ModelArtifacts.$": "$.ModelArtifacts.S3ModelArtifacts",
+                    **training_time_selector,
+                },
+            )
+            training = sfn.Chain.start(tuning_job_task).next(best_training_job_task)
+            TRAINING_MINUTES = TRAINING_JOB_MINUTES * HYPERPARAMETER_SEARCH["waves"]
+        else:
+            training = sfn.Chain.start(training_job_task)
+            TRAINING_MINUTES = TRAINING_JOB_MINUTES
+
+        if SPOT_TRAINING:
+            # Track the spot savings per training run (of the best job with a search)
+            report_training_time_task = tasks.CallAwsService(self, "ReportTrainingTime",
+                service="cloudwatch",
+                action="putMetricData",
+                iam_action="cloudwatch:PutMetricData",
+                parameters={
+                    "Namespace": "MammographyClassification",
+                    "MetricData": [
+                        {"MetricName": "TrainingSeconds", "Unit": "Seconds",
+                         "Value": sfn.JsonPath.number_at("$.TrainJobResults.TrainingTimeInSeconds")},
+                        {"MetricName": "BillableTrainingSeconds", "Unit": "Seconds",
+                         "Value": sfn.JsonPath.number_at("$.TrainJobResults.BillableTimeInSeconds")},
+                    ],
+                },
+                iam_resources=["*"],
+                result_path=sfn.JsonPath.DISCARD,
+            )
+            training = training.next(report_training_time_task)
+
 
         create_model_task = tasks.SageMakerCreateModel(self, "CreateModel",
             model_name=sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
@@ -137,24 +273,54 @@ class SageMakerStack(Stack):
 
         )
 
-        endpoint_config_task = tasks.SageMakerCreateEndpointConfig(self, "CreateEndpointConfig",
-            endpoint_config_name=sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
-            production_variants=[tasks.ProductionVariant(
-                initial_instance_count=1,
-                instance_type=ec2.InstanceType(INFERENCE_INSTANCE_TYPE),
-                model_name=sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
-                variant_name="AllTraffic",
+        if ENDPOINT_SETTINGS["mode"] == "serverless":
+            serverless = ENDPOINT_SETTINGS["serverless"]
+            serverless_config = {
+                "MemorySizeInMB": serverless["memory_size_mb"],
+                "MaxConcurrency": serverless["max_concurrency"],
+            }
+            if serverless["provisioned_concurrency"]:
+                serverless_config["ProvisionedConcurrency"] = serverless["provisioned_concurrency"]
 
-            )],
-            integration_pattern=sfn.IntegrationPattern.REQUEST_RESPONSE,
-            result_path="$.CreateEndpointConfigResults",
-            result_selector={
-                "HttpStatusCode.$": "$.SdkHttpMetadata.HttpStatusCode",
-                "EndpointConfigArn.$": "$.EndpointConfigArn"
-            },
-            task_timeout=sfn.Timeout.duration(Duration.minutes(10)),
-            # state_name="Create Endpoint Config"
-        )
+            # ServerlessConfig is not exposed by SageMakerCreateEndpointConfig in this CDK version
+            endpoint_config_task = tasks.CallAwsService(self, "CreateEndpointConfig",
+                service="sagemaker",
+                action="createEndpointConfig",
+                parameters={
+                    "EndpointConfigName": sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
+                    "ProductionVariants": [{
+                        "VariantName": VARIANT_NAME,
+                        "ModelName": sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
+                        "ServerlessConfig": serverless_config,
+                    }],
+                },
+                iam_resources=["*"],
+                result_path="$.CreateEndpointConfigResults",
+                result_selector={
+                    "EndpointConfigArn.$": "$.EndpointConfigArn"
+                },
+                task_timeout=sfn.Timeout.duration(Duration.minutes(10)),
+            )
+        else:
+            endpoint_config_task = tasks.SageMakerCreateEndpointConfig(self, "CreateEndpointConfig",
+                endpoint_config_name=sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
+                production_variants=[tasks.ProductionVariant(
+                    # autoscaling takes it from there
+                    initial_instance_count=AUTOSCALING["min_capacity"] if AUTOSCALING else 1,
+                    instance_type=ec2.InstanceType(INFERENCE_INSTANCE_TYPE),
+                    model_name=sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
+                    variant_name=VARIANT_NAME,
+
+                )],
+                integration_pattern=sfn.IntegrationPattern.REQUEST_RESPONSE,
+                result_path="$.CreateEndpointConfigResults",
+                result_selector={
+                    "HttpStatusCode.$": "$.SdkHttpMetadata.HttpStatusCode",
+                    "EndpointConfigArn.$": "$.EndpointConfigArn"
+                },
+                task_timeout=sfn.Timeout.duration(Duration.minutes(10)),
+                # state_name="Create Endpoint Config"
+            )
 
         create_endpoint_task = tasks.SageMakerCreateEndpoint(
             self, "CreateEndpoint",
@@ -170,6 +336,84 @@ class SageMakerStack(Stack):
             # state_name="Create Endpoint"
         )
 
+        scaling_target = {
+            "ServiceNamespace": "sagemaker",
+            "ResourceId": f"endpoint/{ENDPOINT_NAME}/variant/{VARIANT_NAME}",
+            "ScalableDimension": "sagemaker:variant:DesiredInstanceCount",
+        }
+
+        # A retrain updates the existing endpoint in place: SageMaker provisions
+        # the new config next to the old one and moves the traffic once it is
+        # InService, so the endpoint keeps serving throughout
+        update_deployment = deployment_config(ROLLOUT)
+        if update_deployment:
+            # DeploymentConfig is not exposed by SageMakerUpdateEndpoint in this CDK version
+            update_endpoint_task = tasks.CallAwsService(self, "UpdateEndpoint",
+                service="sagemaker",
+                action="updateEndpoint",
+                parameters={
+                    "EndpointName": ENDPOINT_NAME,
+                    "EndpointConfigName": sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
+                    "DeploymentConfig": update_deployment,
+                },
+                iam_resources=["*"],
+                result_path="$.UpdateEndpointResults",
+                result_selector={
+                    "EndpointArn.$": "$.EndpointArn"
+                },
+                task_timeout=sfn.Timeout.duration(Duration.minutes(10)),
+            )
+        else:
+            update_endpoint_task = tasks.SageMakerUpdateEndpoint(self, "UpdateEndpoint",
+                endpoint_config_name=sfn.JsonPath.string_at("$.TrainJobResults.ModelName"),
+                endpoint_name=ENDPOINT_NAME,
+                integration_pattern=sfn.IntegrationPattern.REQUEST_RESPONSE,
+                result_path="$.UpdateEndpointResults",
+                result_selector={
+                    "HttpStatusCode.$": "$.SdkHttpMetadata.HttpStatusCode",
+                    "EndpointArn.$": "$.EndpointArn"
+                },
+                task_timeout=sfn.Timeout.duration(Duration.minutes(10)),
+            )
+
+        find_endpoint_task = tasks.CallAwsService(self, "FindEndpoint",
+            service="sagemaker",
+            action="listEndpoints",
+            parameters={"NameContains": ENDPOINT_NAME},
+            iam_action="sagemaker:ListEndpoints",
+            iam_resources=["*"],
+            result_path="$.FindEndpointResults",
+            result_selector={"EndpointNames.$": "$.Endpoints[*].EndpointName"},
+        )
+        # NameContains also matches longer names, look for the exact one
+        check_endpoint_name = sfn.Pass(self, "CheckEndpointName",
+            parameters={
+                "Exists": sfn.JsonPath.array_contains(
+                    sfn.JsonPath.list_at("$.FindEndpointResults.EndpointNames"), ENDPOINT_NAME)
+            },
+            result_path="$.EndpointExists",
+        )
+        update_endpoint = update_endpoint_task
+        if AUTOSCALING:
+            # UpdateEndpoint fails for an autoscaled variant whose instance type
+            # changes; the target is registered again once the new model is InService
+            deregister_scaling_task = tasks.CallAwsService(self, "DeregisterScalableTarget",
+                service="applicationautoscaling",
+                action="deregisterScalableTarget",
+                iam_action="application-autoscaling:DeregisterScalableTarget",
+                parameters=scaling_target,
+                iam_resources=["*"],
+                result_path=sfn.JsonPath.DISCARD,
+            )
+            # not registered yet, e.g. the endpoint was deployed without autoscaling
+            deregister_scaling_task.add_catch(update_endpoint_task, errors=["States.TaskFailed"],
+                                              result_path=sfn.JsonPath.DISCARD)
+            update_endpoint = deregister_scaling_task.next(update_endpoint_task)
+
+        endpoint_exists = sfn.Choice(self, "EndpointExists") \
+            .when(sfn.Condition.boolean_equals("$.EndpointExists.Exists", True), update_endpoint) \
+            .otherwise(create_endpoint_task)
+
 
         state_machine_role = _iam.Role(self, "StateMachineExecutionRole",
             assumed_by=_iam.ServicePrincipal("states.amazonaws.com"),
@@ -180,17 +424,119 @@ class SageMakerStack(Stack):
             ],
             role_name="StateMachineExecutionRole",
          )
+        if HYPERPARAMETER_SEARCH or SPOT_TRAINING:
+            # what the CreateTrainingJob task grants itself
+            tasks_execution_role.grant_pass_role(state_machine_role)
+            state_machine_role.add_to_policy(_iam.PolicyStatement(
+                actions=["events:PutTargets", "events:PutRule", "events:DescribeRule"],
+                resources=[f"arn:{Aws.PARTITION}:events:{Aws.REGION}:{Aws.ACCOUNT_ID}:rule/"
+                           f"StepFunctionsGetEventsForSageMaker{'TuningJobs' if HYPERPARAMETER_SEARCH else 'TrainingJobs'}Rule"],
+            ))
         
-        definition = sfn.Chain.start(training_job_task) \
+        # Scaling can only be registered once the variant exists, i.e. the endpoint is InService
+        wait_for_endpoint = sfn.Wait(self, "WaitForEndpoint",
+            time=sfn.WaitTime.duration(Duration.seconds(30)))
+        describe_endpoint_task = tasks.CallAwsService(self, "DescribeEndpoint",
+            service="sagemaker",
+            action="describeEndpoint",
+            parameters={"EndpointName": ENDPOINT_NAME},
+            iam_resources=["*"],
+            result_path="$.DescribeEndpointResults",
+            result_selector={
+                "EndpointStatus.$": "$.EndpointStatus",
+                "EndpointConfigName.$": "$.EndpointConfigName"
+            },
+        )
+
+        def scaling_tasks(register_id, policy_id):
+            """:return: (RegisterScalableTarget task, PutScalingPolicy task) of the variant"""
+            register_task = tasks.CallAwsService(self, register_id,
+                service="applicationautoscaling",
+                action="registerScalableTarget",
+                iam_action="application-autoscaling:RegisterScalableTarget",
+                parameters={
+                    **scaling_target,
+                    "MinCapacity": AUTOSCALING["min_capacity"],
+                    "MaxCapacity": AUTOSCALING["max_capacity"],
+                },
+                iam_resources=["*"],
+                result_path=sfn.JsonPath.DISCARD,
+            )
+            policy_task = tasks.CallAwsService(self, policy_id,
+                service="applicationautoscaling",
+                action="putScalingPolicy",
+                iam_action="application-autoscaling:PutScalingPolicy",
+                parameters={
+                    **scaling_target,
+                    "PolicyName": "InvocationsPerInstance",
+                    "PolicyType": "TargetTrackingScaling",
+                    "TargetTrackingScalingPolicyConfiguration": {
+                        "TargetValue": AUTOSCALING["target_invocations_per_instance"],
+                        "PredefinedMetricSpecification": {
+                            "PredefinedMetricType": "SageMakerVariantInvocationsPerInstance"
+                        },
+                        "ScaleInCooldown": AUTOSCALING["scale_in_cooldown"],
+                        "ScaleOutCooldown": AUTOSCALING["scale_out_cooldown"],
+                    },
+                },
+                iam_resources=["*"],
+                result_path=sfn.JsonPath.DISCARD,
+            )
+            return register_task, policy_task
+
+        endpoint_in_service = sfn.Pass(self, "EndpointInService")
+        # a failed or rolled back update leaves the previous config serving
+        update_rolled_back = sfn.Fail(self, "EndpointUpdateRolledBack", error="EndpointUpdateRolledBack",
+                                      cause="The endpoint is still serving the previous model")
+        endpoint_failed = sfn.Fail(self, "EndpointFailed", error="EndpointFailed",
+                                   cause="The endpoint did not reach InService")
+        rolled_back_state, failed_state = update_rolled_back, endpoint_failed
+        if AUTOSCALING:
+            register_scaling_task, scaling_policy_task = scaling_tasks("RegisterScalableTarget", "PutScalingPolicy")
+            endpoint_in_service.next(register_scaling_task).next(scaling_policy_task)
+
+            # the scalable target was deregistered before the update: register it
+            # again for the config still serving before the execution fails
+            failed_update = sfn.Choice(self, "FailedUpdate") \
+                .when(sfn.Condition.string_equals("$.DescribeEndpointResults.EndpointStatus", "Failed"),
+                      endpoint_failed) \
+                .otherwise(update_rolled_back)
+            restore_target_task, restore_policy_task = scaling_tasks("RestoreScalableTarget", "RestoreScalingPolicy")
+            for task in (restore_target_task, restore_policy_task):
+                # e.g. a new endpoint that failed has no variant to scale
+                task.add_catch(failed_update, errors=["States.ALL"], result_path=sfn.JsonPath.DISCARD)
+            restore_target_task.next(restore_policy_task).next(failed_update)
+            rolled_back_state = failed_state = restore_target_task
+
+        endpoint_status = sfn.Choice(self, "EndpointStatus") \
+            .when(sfn.Condition.and_(
+                      sfn.Condition.string_equals("$.DescribeEndpointResults.EndpointStatus", "InService"),
+                      sfn.Condition.string_equals_json_path("$.DescribeEndpointResults.EndpointConfigName",
+                                                            "$.TrainJobResults.ModelName")),
+                  endpoint_in_service) \
+            .when(sfn.Condition.string_equals("$.DescribeEndpointResults.EndpointStatus", "InService"),
+                  rolled_back_state) \
+            .when(sfn.Condition.string_equals("$.DescribeEndpointResults.EndpointStatus", "Failed"),
+                  failed_state) \
+            .otherwise(wait_for_endpoint)
+
+        definition = sfn.Chain.start(training) \
                               .next(create_model_task) \
                               .next(endpoint_config_task) \
-                              .next(create_endpoint_task)
+                              .next(find_endpoint_task) \
+                              .next(check_endpoint_name) \
+                              .next(endpoint_exists.afterwards()) \
+                              .next(wait_for_endpoint) \
+                              .next(describe_endpoint_task) \
+                              .next(endpoint_status)
+
         
         state_machine = sfn.StateMachine(self, "mammpgraphy-state-machine",
             definition=definition,
             state_machine_name="mammpgraphy-state-machine",
             role=state_machine_role,
-            timeout=Duration.minutes(60),
+            # training, waiting for the endpoint to be InService, then shifting the traffic
+            timeout=Duration.minutes(TRAINING_MINUTES + 30).plus(Duration.seconds(rollout_seconds(ROLLOUT))),
             removal_policy=RemovalPolicy.DESTROY    
         )
 
@@ -223,14 +569,163 @@ class SageMakerStack(Stack):
             memory_size=256,
             environment={
                 "STATE_MACHINE_ARN": state_machine.state_machine_arn,
+                "INPUT_MODE": INPUT_MODE,
             }
         )
 
+        # Bulk classification: {"source": "s3://bucket/prefix/"} -> Parquet file
+        # of the predictions, through a batch transform job instead of the API
+        if BATCH_TRANSFORM:
+            batch_runtime = lambda_.Runtime(BATCH_TRANSFORM["lambda_runtime"], lambda_.RuntimeFamily.PYTHON)
+            cv2_layer, numpy_layer, pydicom_layer, common_layer = preprocessing_layers(self, batch_runtime)
+            pandas_layer = lambda_.LayerVersion.from_layer_version_arn(
+                self, "pandas-layer", BATCH_TRANSFORM["pandas_layer_arn"])
 
-        
-        
-        
-        
+            batch_lambda_role = _iam.Role(self, "BatchClassificationLambdaRole",
+                assumed_by=_iam.ServicePrincipal("lambda.amazonaws.com"),
+                path="/service-role/",
+                managed_policies=[_iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole")],
+                inline_policies={
+                    "s3_access": _iam.PolicyDocument(statements=[
+                        _iam.PolicyStatement(
+                            effect=_iam.Effect.ALLOW,
+                            actions=["s3:GetObject", "s3:PutObject"],
+                            resources=["arn:aws:s3:::*/*"]
+                        ),
+                        _iam.PolicyStatement(
+                            effect=_iam.Effect.ALLOW,
+                            actions=["s3:ListBucket"],
+                            resources=["arn:aws:s3:::*"]
+                        ),
+                    ]),
+                }
+            )
 
+            def batch_function(construct_id, handler, layers, timeout, memory_size, environment=None):
+                return lambda_.Function(self, construct_id,
+                    runtime=batch_runtime,
+                    handler=handler,
+                    code=lambda_.Code.from_asset("./mammo_scan_ecs/lambda/batch"),
+                    role=batch_lambda_role,
+                    layers=layers,
+                    timeout=timeout,
+                    memory_size=memory_size,
+                    environment=environment,
+                )
+
+            batch_prepare_lambda = batch_function("batch-prepare-lambda",
+                "lambda_batch_prepare.lambda_handler", [common_layer], Duration.minutes(5), 512,
+                {"CHUNK_SIZE": str(BATCH_TRANSFORM["chunk_size"])})
+            batch_preprocess_lambda = batch_function("batch-preprocess-lambda",
+                "lambda_batch_preprocess.lambda_handler", [cv2_layer, numpy_layer, pydicom_layer, common_layer],
+                Duration.minutes(10), 2048,
+                {"PREPROCESS_WORKERS": "8", **preprocessing_environment(sagemaker_configs.get("dataset_manifest"))})
+            batch_results_lambda = batch_function("batch-results-lambda",
+                "lambda_batch_results.lambda_handler", [pandas_layer, common_layer], Duration.minutes(15), 2048)
+
+            prepare_batch_task = tasks.LambdaInvoke(self, "PrepareBatch",
+                lambda_function=batch_prepare_lambda,
+                payload=sfn.TaskInput.from_object({
+                    "source": sfn.JsonPath.string_at("$.source"),
+                    "run_name": sfn.JsonPath.string_at("$$.Execution.Name"),
+                }),
+                payload_response_only=True,
+                result_path="$.Batch",
+            )
+
+            # One invocation per chunk manifest, preprocess_concurrency at a time
+            preprocess_chunks = sfn.Map(self, "PreprocessChunks",
+                items_path="$.Batch.chunks",
+                max_concurrency=BATCH_TRANSFORM["preprocess_concurrency"],
+                parameters={
+                    "manifest": sfn.JsonPath.string_at("$$.Map.Item.Value"),
+                    "bucket": sfn.JsonPath.string_at("$.Batch.bucket"),
+                    "source_bucket": sfn.JsonPath.string_at("$.Batch.source_bucket"),
+                    "source_prefix": sfn.JsonPath.string_at("$.Batch.source_prefix"),
+                    "input_prefix": sfn.JsonPath.string_at("$.Batch.input_prefix"),
+                },
+                result_path="$.PreprocessResults",
+            )
+            preprocess_chunk_task = tasks.LambdaInvoke(self, "PreprocessChunk",
+                lambda_function=batch_preprocess_lambda,
+                payload_response_only=True,
+            )
+            preprocess_chunk_task.add_retry(errors=["Lambda.TooManyRequestsException", "Lambda.ServiceException"],
+                                            interval=Duration.seconds(5), backoff_rate=2, max_attempts=4)
+            preprocess_chunks.iterator(preprocess_chunk_task)
 
+            # The model currently deployed behind the endpoint
+            serving_endpoint_task = tasks.CallAwsService(self, "DescribeServingEndpoint",
+                service="sagemaker",
+                action="describeEndpoint",
+                parameters={"EndpointName": ENDPOINT_NAME},
+                iam_resources=["*"],
+                result_path="$.ServingEndpoint",
+                result_selector={"EndpointConfigName.$": "$.EndpointConfigName"},
+            )
+            serving_model_task = tasks.CallAwsService(self, "DescribeServingEndpointConfig",
+                service="sagemaker",
+                action="describeEndpointConfig",
+                parameters={"EndpointConfigName": sfn.JsonPath.string_at("$.ServingEndpoint.EndpointConfigName")},
+                iam_resources=["*"],
+                result_path="$.ServingModel",
+                result_selector={"ModelName.$": "$.ProductionVariants[0].ModelName"},
+            )
+
+            transform_job_task = tasks.SageMakerCreateTransformJob(self, "CreateTransformJob",
+                transform_job_name=sfn.JsonPath.string_at("$.Batch.job_name"),
+                model_name=sfn.JsonPath.string_at("$.ServingModel.ModelName"),
+                transform_input=tasks.TransformInput(
+                    transform_data_source=tasks.TransformDataSource(
+                        s3_data_source=tasks.TransformS3DataSource(
+                            s3_uri=sfn.JsonPath.string_at("$.Batch.input_uri"),
+                            s3_data_type=tasks.S3DataType.S3_PREFIX,
+                        )
+                    ),
+                    content_type="application/x-image",
+                    # every object is one image
+                    split_type=tasks.SplitType.NONE,
+                ),
+                transform_output=tasks.TransformOutput(
+                    s3_output_path=sfn.JsonPath.string_at("$.Batch.output_uri"),
+                    accept="application/json",
+                ),
+                transform_resources=tasks.TransformResources(
+                    instance_count=BATCH_TRANSFORM["instance_count"],
+                    instance_type=ec2.InstanceType(BATCH_TRANSFORM["instance_type"]),
+                ),
+                batch_strategy=tasks.BatchStrategy.SINGLE_RECORD if BATCH_TRANSFORM["batch_strategy"] == "SingleRecord"
+                    else tasks.BatchStrategy.MULTI_RECORD,
+                max_concurrent_transforms=BATCH_TRANSFORM["max_concurrent_transforms"],
+                role=tasks_execution_role,
+                integration_pattern=sfn.IntegrationPattern.RUN_JOB,
+                result_path="$.TransformJobResults",
+                result_selector={
+                    "TransformJobName.$": "$.TransformJobName",
+                    "TransformJobStatus.$": "$.TransformJobStatus"
+                },
+                task_timeout=sfn.Timeout.duration(Duration.hours(6)),
+            )
+
+            aggregate_results_task = tasks.LambdaInvoke(self, "AggregateResults",
+                lambda_function=batch_results_lambda,
+                payload=sfn.TaskInput.from_json_path_at("$.Batch"),
+                payload_response_only=True,
+                result_path="$.Results",
+            )
+
+            batch_definition = sfn.Chain.start(prepare_batch_task) \
+                                        .next(preprocess_chunks) \
+                                        .next(serving_endpoint_task) \
+                                        .next(serving_model_task) \
+                                        .next(transform_job_task) \
+                                        .next(aggregate_results_task)
+
+            sfn.StateMachine(self, "batch-classification-state-machine",
+                definition=batch_definition,
+                state_machine_name="batch-classification-state-machine",
+                role=state_machine_role,
+                timeout=Duration.hours(8),
+                removal_policy=RemovalPolicy.DESTROY
+            )
 
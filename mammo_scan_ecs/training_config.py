@@ -0,0 +1,82 @@
+import math
+
+GIB = 1024 ** 3
+
+# Datasets at least this large are streamed (Pipe mode) when RecordIO shards exist
+PIPE_MODE_MIN_BYTES = 10 * GIB
+# Training samples one instance is expected to handle within max_runtime
+SAMPLES_PER_INSTANCE = 50000
+MAX_INSTANCE_COUNT = 4
+# Room for the model, checkpoints and logs on top of the copied dataset
+BASE_VOLUME_GIB = 10
+MIN_FILE_MODE_VOLUME_GIB = 20
+
+
+def training_resources(dataset_manifest, input_mode="auto",
+                       samples_per_instance=SAMPLES_PER_INSTANCE, max_instance_count=MAX_INSTANCE_COUNT):
+    """Derive the training input mode, instance count and volume size.
+
+    :param dataset_manifest: summary written by scripts/build_dataset.py, or None
+    :param input_mode: "File", "Pipe" or "auto"
+    :return: {"input_mode", "instance_count", "volume_size_gib"}
+    """
+    if not dataset_manifest:
+        return {"input_mode": "File" if input_mode == "auto" else input_mode,
+                "instance_count": 1,
+                "volume_size_gib": MIN_FILE_MODE_VOLUME_GIB}
+
+    total_bytes = dataset_manifest.get("total_bytes", 0)
+    if input_mode == "auto":
+        large = total_bytes >= PIPE_MODE_MIN_BYTES
+        input_mode = "Pipe" if large and dataset_manifest.get("recordio") else "File"
+    if input_mode == "Pipe" and not dataset_manifest.get("recordio"):
+        raise ValueError("Pipe mode needs RecordIO shards, build the dataset with --recordio-shard-size")
+
+    instance_count = math.ceil(dataset_manifest["num_training_samples"] / samples_per_instance)
+    instance_count = max(1, min(max_instance_count, instance_count))
+
+    if input_mode == "Pipe":
+        # data is streamed from S3, nothing is copied to the volume
+        volume_size_gib = BASE_VOLUME_GIB
+    else:
+        # File mode copies the full dataset to every instance
+        volume_size_gib = max(MIN_FILE_MODE_VOLUME_GIB, math.ceil(total_bytes / GIB) + BASE_VOLUME_GIB)
+
+    return {"input_mode": input_mode, "instance_count": instance_count, "volume_size_gib": volume_size_gib}
+
+
+# Managed spot training: the job may wait up to max_wait_hours for capacity
+# and restarts from the last checkpoint after an interruption
+DEFAULT_SPOT_TRAINING = {
+    "enabled": False,
+    "max_wait_hours": 4,
+}
+CHECKPOINT_LOCAL_PATH = "/opt/ml/checkpoints"
+
+
+def spot_training(spot_configs, max_runtime_hours):
+    """Normalize the "spot_training" entry of sagemaker_configs.
+
+    :param spot_configs: {"enabled": bool, "max_wait_hours": number}, or None
+    :param max_runtime_hours: MaxRuntime of the training job
+    :return: None when disabled, else {"max_wait_hours"}
+    """
+    spot_configs = {**DEFAULT_SPOT_TRAINING, **(spot_configs or {})}
+    if not spot_configs["enabled"]:
+        return None
+    # MaxWaitTime covers the waiting for spot capacity and the training itself
+    if spot_configs["max_wait_hours"] < max_runtime_hours:
+        raise ValueError("max_wait_hours must be at least the {} h training max runtime".format(max_runtime_hours))
+    return {"max_wait_hours": spot_configs["max_wait_hours"]}
+
+
+def preprocessing_environment(dataset_manifest):
+    """Environment of the functions that preprocess images for the model.
+
+    The model sees images preprocessed like its training dataset: when the
+    dataset was built with --roi-padding, inference crops the same way.
+    """
+    roi_padding = (dataset_manifest or {}).get("roi_padding")
+    if roi_padding is None:
+        return {"ROI_CROP": "false"}
+    return {"ROI_CROP": "true", "ROI_PADDING": str(roi_padding)}
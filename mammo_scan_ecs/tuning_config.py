@@ -0,0 +1,60 @@
+import math
+
+# Metric the built-in image-classification algorithm logs after every epoch
+OBJECTIVE_METRIC = "validation:accuracy"
+DEFAULT_MAX_PARALLEL_JOBS = 4
+# Grid search runs every combination, SageMaker caps a tuning job at 500
+MAX_GRID_SIZE = 500
+
+
+def grid_size(grid):
+    return math.prod(len(values) for values in grid.values())
+
+
+def hyperparameter_search(search_configs, hyperparameters):
+    """Normalize the "hyperparameter_search" entry of sagemaker_configs.
+
+    :param search_configs: {"grid": {name: [values]}, "max_parallel_jobs": int}, or None
+    :param hyperparameters: the single-job hyperparameters, the grid overrides them
+    :return: None when disabled, else {"grid", "static_hyperparameters",
+        "max_parallel_jobs", "num_jobs", "waves"}
+    """
+    if not search_configs or not search_configs.get("grid"):
+        return None
+
+    # SageMaker passes hyperparameters as strings
+    grid = {name: [str(value) for value in values] for name, values in search_configs["grid"].items()}
+    if any(not values for values in grid.values()):
+        raise ValueError("Every hyperparameter in the search grid needs at least one value")
+    num_jobs = grid_size(grid)
+    if num_jobs > MAX_GRID_SIZE:
+        raise ValueError("The search grid has {} combinations, the limit is {}".format(num_jobs, MAX_GRID_SIZE))
+
+    max_parallel_jobs = search_configs.get("max_parallel_jobs", DEFAULT_MAX_PARALLEL_JOBS)
+    if max_parallel_jobs < 1:
+        raise ValueError("max_parallel_jobs must be at least 1")
+
+    return {
+        "grid": grid,
+        "static_hyperparameters": {name: value for name, value in hyperparameters.items() if name not in grid},
+        "max_parallel_jobs": max_parallel_jobs,
+        "num_jobs": num_jobs,
+        # rounds of concurrent training jobs, for the state machine timeout
+        "waves": math.ceil(num_jobs / max_parallel_jobs),
+    }
+
+
+def tuning_job_config(search):
+    """HyperParameterTuningJobConfig of CreateHyperParameterTuningJob for a grid search."""
+    return {
+        "Strategy": "Grid",
+        "HyperParameterTuningJobObjective": {"Type": "Maximize", "MetricName": OBJECTIVE_METRIC},
+        # grid search derives the number of jobs from the grid
+        "ResourceLimits": {"MaxParallelTrainingJobs": search["max_parallel_jobs"]},
+        "ParameterRanges": {
+            "CategoricalParameterRanges": [
+                {"Name": name, "Values": values} for name, values in search["grid"].items()
+            ],
+        },
+    }
+
@@ -0,0 +1,37 @@
+# Services reached from the private subnets without the NAT gateways.
+# Gateway endpoints (S3, DynamoDB) are free and only add routes to the
+# private route tables; interface endpoints put a network interface in
+# every private subnet and are billed per AZ and per GB.
+DEFAULT_VPC = {
+    # PRIVATE_WITH_EGRESS subnets need at least one; one per AZ keeps an AZ
+    # outage or a saturated NAT from taking the other AZ down with it
+    "nat_gateways": 1,
+    "max_azs": 2,
+    "vpc_endpoints": False,
+    # S3 originals and resized copies, prediction cache and jobs tables
+    "gateway_endpoints": ["s3", "dynamodb"],
+    # InvokeEndpoint, SSM parameters, nested resize invoke
+    "interface_endpoints": ["sagemaker.runtime", "ssm", "lambda"],
+}
+
+GATEWAY_SERVICES = ("s3", "dynamodb")
+
+
+def vpc_settings(vpc_configs=None):
+    """Normalize the VPC configuration of one environment.
+
+    :param vpc_configs: overrides of DEFAULT_VPC
+    :return: the complete settings, with empty endpoint lists when
+        vpc_endpoints is off
+    """
+    settings = {**DEFAULT_VPC, **(vpc_configs or {})}
+    if not 1 <= settings["nat_gateways"] <= settings["max_azs"]:
+        raise ValueError("nat_gateways must be between 1 and max_azs ({})".format(settings["max_azs"]))
+    for name in settings["gateway_endpoints"]:
+        if name not in GATEWAY_SERVICES:
+            raise ValueError("Gateway endpoints exist for {} only, got {}".format(GATEWAY_SERVICES, name))
+
+    if not settings["vpc_endpoints"]:
+        settings["gateway_endpoints"] = []
+        settings["interface_endpoints"] = []
+    return settings
@@ -4,21 +4,43 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from mammo_scan_ecs.vpc_config import vpc_settings
+
+
 class MammoScanVpcStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, vpc_configs=None, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        settings = vpc_settings(vpc_configs)
 
         self.vpc_output = ec2.Vpc(self, "VPC",
-            nat_gateways=1,
+            nat_gateways=settings["nat_gateways"],
             ip_addresses=ec2.IpAddresses.cidr("10.0.0.0/16"),
-            max_azs=2,
+            max_azs=settings["max_azs"],
             subnet_configuration=[
                 ec2.SubnetConfiguration(name="public", subnet_type=ec2.SubnetType.PUBLIC, cidr_mask=24),
                 ec2.SubnetConfiguration(name="private", subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS, cidr_mask=24)
             ]
         )
+
+        # The Lambda functions reach these services through the endpoints
+        # instead of the NAT gateways
+        private_subnets = ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)
+        for name in settings["gateway_endpoints"]:
+            self.vpc_output.add_gateway_endpoint(
+                "{}GatewayEndpoint".format(name.title()),
+                service=ec2.GatewayVpcEndpointAwsService(name),
+                subnets=[private_subnets],
+            )
+        for name in settings["interface_endpoints"]:
+            # private DNS: the SDKs keep using the public service names
+            self.vpc_output.add_interface_endpoint(
+                "{}Endpoint".format(name.title().replace(".", "")),
+                service=ec2.InterfaceVpcEndpointAwsService(name),
+                subnets=private_subnets,
+                private_dns_enabled=True,
+            )
            
     @property
     def get_vpc(self) -> ec2.Vpc:
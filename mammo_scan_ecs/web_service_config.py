@@ -0,0 +1,60 @@
+CAPACITY_PROVIDERS = ("FARGATE", "FARGATE_SPOT")
+
+# Streamlit keeps each session (widgets, uploaded files) in the memory of the
+# task that opened its websocket, and file uploads are separate HTTP requests
+# that must reach that same task: the load balancer cookie pins a browser to
+# a task for stickiness_hours, longer than a working session.
+#
+# A websocket counts as one ALB request for its whole life, so
+# RequestCountPerTarget follows page loads, static assets and uploads (new
+# and active sessions) rather than interactions; CPU tracking stays on for
+# sessions resizing images in the task.
+DEFAULT_WEB_SERVICE = {
+    # one on-demand task always, further tasks 3:1 on Fargate Spot
+    "capacity_provider_strategy": [
+        {"capacity_provider": "FARGATE", "base": 1, "weight": 1},
+        {"capacity_provider": "FARGATE_SPOT", "weight": 3},
+    ],
+    "min_capacity": 1,
+    "max_capacity": 10,
+    # ALB requests per task per minute
+    "requests_per_target": 1000,
+    "cpu_target_percent": 50,
+    "scale_in_cooldown": 300,
+    "scale_out_cooldown": 60,
+    "stickiness_hours": 8,
+    # EC2 spot instances registered to the cluster, None leaves the cluster Fargate-only:
+    # {"instance_type": "c5.xlarge", "spot_price": "0.0735", "min_capacity": 1, "max_capacity": 2}
+    "ec2_spot_capacity": None,
+}
+
+# longest duration of an ALB stickiness cookie
+MAX_STICKINESS_HOURS = 7 * 24
+
+
+def web_service_settings(web_service_configs=None):
+    """Normalize the "web_service" entry of frontend_configs.
+
+    :param web_service_configs: overrides of DEFAULT_WEB_SERVICE
+    :return: the complete settings
+    """
+    settings = {**DEFAULT_WEB_SERVICE, **(web_service_configs or {})}
+
+    strategy = settings["capacity_provider_strategy"]
+    if not strategy:
+        raise ValueError("The capacity provider strategy needs at least one provider")
+    for entry in strategy:
+        if entry["capacity_provider"] not in CAPACITY_PROVIDERS:
+            raise ValueError("Unknown capacity provider {}, expected one of {}".format(
+                entry["capacity_provider"], CAPACITY_PROVIDERS))
+    if sum(entry.get("base", 0) > 0 for entry in strategy) > 1:
+        # ECS only allows a base on one provider of the strategy
+        raise ValueError("Only one capacity provider can have a base")
+    if not any(entry.get("weight", 0) > 0 for entry in strategy):
+        raise ValueError("At least one capacity provider needs a weight above 0")
+
+    if not 1 <= settings["min_capacity"] <= settings["max_capacity"]:
+        raise ValueError("The web service needs 1 <= min_capacity <= max_capacity")
+    if not 0 < settings["stickiness_hours"] <= MAX_STICKINESS_HOURS:
+        raise ValueError("stickiness_hours must be in (0, {}]".format(MAX_STICKINESS_HOURS))
+    return settings
@@ -0,0 +1,331 @@
+"""Build the training channels read by the state machine.
+
+Reads the original images from one or more source prefixes laid out as
+``<source>/<class>/<image>``, resizes them with the same preprocessing code
+as the inference Lambdas and writes, under the output prefix:
+
+- ``train/<class>/<image>.jpg`` and ``test/<class>/<image>.jpg``
+- ``train-data.lst`` and ``test-data.lst``
+- optionally RecordIO shards under ``recordio/train/`` and ``recordio/test/``
+- ``manifest.json``, used to only process new or changed images on re-runs
+
+Outputs of images removed from the sources, or moved to the other split,
+are deleted.
+
+Sources and output are either ``s3://bucket/prefix`` or local directories.
+
+    python scripts/build_dataset.py s3://mammo-v2-ecs-model-files/raw \\
+        --output s3://mammo-v2-ecs-model-files/resize --summary dataset_manifest.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "mammo_scan_ecs", "lambda", "common", "python"))
+
+from mammo_common import preprocessing  # noqa: E402
+
+# Same order as the classes decoded by the classify Lambda
+CLASS_NAMES = ["NAO", "CCD", "CCE", "MLOD", "MLOE"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".dcm")
+# The resized images are encoded as preprocess_image does by default
+OUTPUT_EXTENSION = ".jpg"
+# Keys per S3 DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+MANIFEST_NAME = "manifest.json"
+# what the train/test split of an image is computed from, kept in the summary
+# so that a build with another split scheme starts over
+SPLIT_KEY = "relative-key"
+
+# MXNet RecordIO framing, as read by the built-in image-classification algorithm
+RECORDIO_MAGIC = 0xced7230a
+
+
+class LocalStorage:
+    """Directory standing in for an S3 bucket, keys are relative paths."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list(self, prefix):
+        """:return: list of (key, etag, size)"""
+        objects = []
+        for directory, _, files in os.walk(os.path.join(self.root, prefix)):
+            for name in files:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                objects.append((key, "{}-{}".format(stat.st_size, stat.st_mtime_ns), stat.st_size))
+        return objects
+
+    def uri(self, key):
+        return os.path.join(self.root, key)
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+    def write(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    def delete(self, keys):
+        for key in keys:
+            path = os.path.join(self.root, key)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class S3Storage:
+
+    def __init__(self, bucket, client):
+        self.bucket = bucket
+        self.client = client
+
+    def list(self, prefix):
+        objects = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                objects.append((item["Key"], item["ETag"], item["Size"]))
+        return objects
+
+    def uri(self, key):
+        return "s3://{}/{}".format(self.bucket, key)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception:
+            return False
+        return True
+
+    def delete(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": key} for key in keys[start:start + DELETE_BATCH_SIZE]], "Quiet": True})
+
+
+def open_location(location, s3_client=None):
+    """:return: (storage, prefix) for ``s3://bucket/prefix`` or a local directory"""
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        if s3_client is None:
+            import boto3
+            s3_client = boto3.client("s3")
+        return S3Storage(bucket, s3_client), prefix.strip("/")
+    return LocalStorage(location), ""
+
+
+def join_key(*parts):
+    return "/".join(part.strip("/") for part in parts if part)
+
+
+def output_name(key):
+    """Every original, JPEG, PNG or DICOM, is written as the JPEG the model reads, under a .jpg name."""
+    return os.path.splitext(os.path.basename(key))[0] + OUTPUT_EXTENSION
+
+
+def split_for(key, test_percent):
+    """Deterministic train/test split, stable across re-runs.
+
+    :param key: image key relative to its source prefix (``<class>/<image>``),
+        so an image stays in its split whichever bucket or directory it is read from
+    """
+    bucket = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) % 100
+    return "test" if bucket < test_percent else "train"
+
+
+def list_sources(sources, classes, workers):
+    """List ``<prefix>/<class>/`` for every source and class in parallel.
+
+    :param sources: list of (storage, prefix)
+    :return: list of {"uri", "storage", "key", "relative_key", "etag", "label", "class"} dicts
+    """
+    jobs = [(storage, prefix, label, name) for storage, prefix in sources for label, name in enumerate(classes)]
+
+    def list_one(job):
+        storage, prefix, label, name = job
+        return [{"uri": storage.uri(key), "storage": storage, "key": key,
+                 "relative_key": key[len(prefix) + 1:] if prefix else key,
+                 "etag": etag, "label": label, "class": name}
+                for key, etag, _ in storage.list(join_key(prefix, name) + "/")
+                if key.lower().endswith(IMAGE_EXTENSIONS)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [source for listed in executor.map(list_one, jobs) for source in listed]
+
+
+def recordio_record(index, label, image_bytes):
+    # IRHeader: flag, label, id, id2
+    record = struct.pack("<IfQQ", 0, float(label), index, 0) + image_bytes
+    padding = (4 - len(record) % 4) % 4
+    return struct.pack("<II", RECORDIO_MAGIC, len(record)) + record + b"\x00" * padding
+
+
+def write_lst_and_recordio(storage, output_prefix, entries, recordio_shard_size):
+    """Write the .lst files (and RecordIO shards) from the manifest entries.
+
+    :return: {"train": count, "test": count}
+    """
+    counts = {}
+    for split, lst_name in (("train", "train-data.lst"), ("test", "test-data.lst")):
+        rows = sorted((entry for entry in entries.values() if entry["split"] == split),
+                      key=lambda entry: entry["output_key"])
+        counts[split] = len(rows)
+
+        channel_prefix = join_key(output_prefix, split) + "/"
+        lines = ["{}\t{}\t{}".format(index, row["label"], row["output_key"][len(channel_prefix):])
+                 for index, row in enumerate(rows)]
+        # an empty split is an empty file, not a blank line
+        storage.write(join_key(output_prefix, lst_name), "".join(line + "\n" for line in lines).encode())
+
+        written = set()
+        if recordio_shard_size:
+            for shard, start in enumerate(range(0, len(rows), recordio_shard_size)):
+                shard_rows = rows[start:start + recordio_shard_size]
+                data = b"".join(recordio_record(start + offset, row["label"], storage.read(row["output_key"]))
+                                for offset, row in enumerate(shard_rows))
+                shard_key = join_key(output_prefix, "recordio", split, "part-{:05d}.rec".format(shard))
+                storage.write(shard_key, data)
+                written.add(shard_key)
+        # shards of a previous, larger build
+        storage.delete([key for key, _, _ in storage.list(join_key(output_prefix, "recordio", split) + "/")
+                        if key not in written])
+    return counts
+
+
+def load_manifest(storage, output_prefix):
+    key = join_key(output_prefix, MANIFEST_NAME)
+    if not storage.exists(key):
+        return {"entries": {}}
+    return json.loads(storage.read(key))
+
+
+def build_dataset(sources, output_storage, output_prefix, classes=CLASS_NAMES, test_percent=20,
+                  workers=8, recordio_shard_size=0, chunk_size=64, roi_padding=None):
+    """Incrementally build the dataset and return its summary.
+
+    :param sources: list of (storage, prefix) holding ``<class>/<image>`` folders
+    :param roi_padding: crop to the breast region before resizing, as the
+        inference Lambdas do when the summary says so; None keeps the whole frame
+    """
+    manifest = load_manifest(output_storage, output_prefix)
+    previous = manifest["entries"]
+    previous_summary = manifest.get("summary", {})
+    if previous_summary.get("roi_padding") != roi_padding:
+        # every image was preprocessed differently
+        previous = {}
+    if (previous_summary.get("split_key"), previous_summary.get("test_percent")) != (SPLIT_KEY, test_percent):
+        # images would land in other splits than the ones already written
+        previous = {}
+
+    listed = list_sources(sources, classes, workers)
+    output_sources = {}
+    for source in listed:
+        source["split"] = split_for(source["relative_key"], test_percent)
+        source["output_key"] = join_key(output_prefix, source["split"], source["class"], output_name(source["key"]))
+        if source["output_key"] in output_sources:
+            raise ValueError("{} and {} would both be written to {}".format(
+                output_sources[source["output_key"]], source["uri"], source["output_key"]))
+        output_sources[source["output_key"]] = source["uri"]
+
+    # new or changed images, and images written under another key by an earlier build
+    pending = [source for source in listed
+               if (previous.get(source["uri"], {}).get("etag"), previous.get(source["uri"], {}).get("output_key"))
+               != (source["etag"], source["output_key"])]
+    print("{} images listed, {} new or changed".format(len(listed), len(pending)))
+
+    entries = {source["uri"]: previous[source["uri"]] for source in listed if source["uri"] in previous}
+    with ThreadPoolExecutor(max_workers=workers) as io_pool, ProcessPoolExecutor(max_workers=workers) as cpu_pool:
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            originals = list(io_pool.map(lambda source: source["storage"].read(source["key"]), chunk))
+            resized = list(cpu_pool.map(partial(preprocessing.preprocess_image, roi_padding=roi_padding), originals))
+
+            writes = []
+            for source, image_bytes in zip(chunk, resized):
+                writes.append((source["output_key"], image_bytes))
+                entries[source["uri"]] = {
+                    "etag": source["etag"],
+                    "label": source["label"],
+                    "split": source["split"],
+                    "output_key": source["output_key"],
+                    "size": len(image_bytes),
+                }
+            list(io_pool.map(lambda write: output_storage.write(*write), writes))
+            print("processed {}/{}".format(start + len(chunk), len(pending)))
+
+    # outputs of images removed from the sources, or now written under another key
+    stale = {entry["output_key"] for entry in manifest["entries"].values()} - set(output_sources)
+    output_storage.delete(sorted(stale))
+    if stale:
+        print("{} stale images deleted".format(len(stale)))
+
+    counts = write_lst_and_recordio(output_storage, output_prefix, entries, recordio_shard_size)
+    total_bytes = sum(entry["size"] for entry in entries.values())
+    summary = {
+        "num_training_samples": counts["train"],
+        "num_validation_samples": counts["test"],
+        "num_classes": len(classes),
+        "image_shape": "3,{},{}".format(preprocessing.TARGET_SIZE[1], preprocessing.TARGET_SIZE[0]),
+        "total_bytes": total_bytes,
+        "recordio": bool(recordio_shard_size),
+        "processed": len(pending),
+        "roi_padding": roi_padding,
+        "split_key": SPLIT_KEY,
+        "test_percent": test_percent,
+    }
+    output_storage.write(join_key(output_prefix, MANIFEST_NAME),
+                         json.dumps({"summary": summary, "entries": entries}, indent=1).encode())
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="+", help="s3://bucket/prefix or local directory")
+    parser.add_argument("--output", required=True, help="s3://bucket/prefix or local directory")
+    parser.add_argument("--classes", default=",".join(CLASS_NAMES),
+                        help="class folder names, in label order")
+    parser.add_argument("--test-percent", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--recordio-shard-size", type=int, default=0,
+                        help="images per RecordIO shard, 0 disables RecordIO output")
+    parser.add_argument("--roi-padding", type=float,
+                        help="crop to the breast region with this padding (e.g. 0.02), the Lambdas follow the summary")
+    parser.add_argument("--summary", help="local file the dataset summary is written to, read by app.py")
+    args = parser.parse_args(argv)
+
+    sources = [open_location(source) for source in args.sources]
+    output_storage, output_prefix = open_location(args.output)
+    summary = build_dataset(sources, output_storage, output_prefix, classes=args.classes.split(","), test_percent=args.test_percent,
+                            workers=args.workers, recordio_shard_size=args.recordio_shard_size,
+                            roi_padding=args.roi_padding)
+
+    print(json.dumps(summary, indent=1))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=1)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
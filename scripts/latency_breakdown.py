@@ -0,0 +1,99 @@
+"""Per-stage latency breakdown from captured Lambda output.
+
+Reads the EMF lines printed by ``mammo_common.tracing`` from log files or
+stdin: a CloudWatch Logs export, ``sam logs`` output or the stdout of the
+benchmarks. Lines without an EMF document are skipped.
+
+    aws logs tail /aws/lambda/<classify function> --since 1h > classify.log
+    python scripts/latency_breakdown.py classify.log resize.log
+    python scripts/latency_breakdown.py classify.log resize.log --trace <trace id>
+"""
+import argparse
+import fileinput
+import json
+import statistics
+from collections import defaultdict
+
+
+def parse_line(line):
+    """:return: the EMF document in a log line, or None"""
+    start = line.find("{")
+    if start < 0 or '"_aws"' not in line:
+        return None
+    try:
+        document = json.loads(line[start:])
+    except ValueError:
+        return None
+    return document if "_aws" in document else None
+
+
+def stage_names(document):
+    return [metric["Name"] for directive in document["_aws"]["CloudWatchMetrics"]
+            for metric in directive["Metrics"]]
+
+
+def stage_values(document, stage):
+    value = document[stage]
+    return value if isinstance(value, list) else [value]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def breakdown(documents):
+    """Aggregate stage durations per function and cold/warm start.
+
+    :return: {(function, cold start): {stage: {"count", "p50", "p95", "mean"}}}
+    """
+    samples = defaultdict(lambda: defaultdict(list))
+    for document in documents:
+        group = samples[(document["Function"], document["ColdStart"])]
+        for stage in stage_names(document):
+            group[stage].extend(stage_values(document, stage))
+
+    return {group: {stage: {"count": len(values),
+                            "p50": percentile(values, 50),
+                            "p95": percentile(values, 95),
+                            "mean": statistics.mean(values)}
+                    for stage, values in stages.items()}
+            for group, stages in samples.items()}
+
+
+def print_breakdown(result):
+    for (function, cold_start), stages in sorted(result.items()):
+        print("{} ({})".format(function, cold_start))
+        print("  {:<20} {:>6} {:>10} {:>10} {:>10}".format("stage", "count", "p50 ms", "p95 ms", "mean ms"))
+        for stage, summary in sorted(stages.items(), key=lambda item: -item[1]["mean"]):
+            print("  {:<20} {:>6} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                stage, summary["count"], summary["p50"], summary["p95"], summary["mean"]))
+
+
+def print_trace(documents, trace_id):
+    for document in documents:
+        if document.get("trace_id") != trace_id:
+            continue
+        print("{} ({}, {} bytes)".format(document["Function"], document["ColdStart"], document.get("payload_bytes")))
+        for stage in stage_names(document):
+            print("  {:<20} {}".format(stage, ", ".join("{:.1f}".format(v) for v in stage_values(document, stage))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="log files, stdin when omitted")
+    parser.add_argument("--trace", help="only show the stages of this trace id")
+    args = parser.parse_args(argv)
+
+    with fileinput.input(args.files) as lines:
+        documents = [document for document in map(parse_line, lines) if document is not None]
+
+    if args.trace:
+        print_trace(documents, args.trace)
+    else:
+        print_breakdown(breakdown(documents))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+import aws_cdk.assertions as assertions
+import pytest
+
+# Puts the Lambda asset folders on sys.path, as the Lambda runtime does
+import benchmarks  # noqa: F401
+
+
+@pytest.fixture
+def sagemaker_configs():
+    return {
+        "hyperparameters": {
+            "num_layers": "18",
+            "image_shape": "3,300,150",
+            "num_classes": "5",
+            "num_training_samples": "1752",
+            "mini_batch_size": "120",
+            "epochs": "20",
+            "learning_rate": "0.01",
+        },
+        "image_uri": "811284229777.dkr.ecr.us-east-1.amazonaws.com/image-classification:1",
+        "endpoint_name": "mammography-classification-endpoint",
+        "training_instance_type": "p3.2xlarge",
+        "inference_instance_type": "m5.large",
+        "dataset_manifest": None,
+    }
+
+
+def render(value):
+    """Flatten CloudFormation intrinsics (Fn::Join, Ref, ...) into a plain string."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict) and "Fn::Join" in value:
+        separator, parts = value["Fn::Join"]
+        return separator.join(render(part) for part in parts)
+    return "TOKEN"
+
+
+@pytest.fixture
+def state_machine_definitions():
+    """:return: function(template) -> {state machine name: parsed definition}"""
+    def definitions(template):
+        return {
+            resource["Properties"].get("StateMachineName", logical_id):
+                json.loads(render(resource["Properties"]["DefinitionString"]))
+            for logical_id, resource in template.find_resources("AWS::StepFunctions::StateMachine").items()
+        }
+    return definitions
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def asset_dir(tmp_path_factory):
+    """Copy of the asset folders, with placeholder layers: the real ones are built outside the repo."""
+    root = tmp_path_factory.mktemp("assets")
+    for name in ("mammo_scan_ecs", "web-app"):
+        shutil.copytree(os.path.join(ROOT_DIR, name), str(root / name),
+                        ignore=shutil.ignore_patterns("__pycache__"))
+    (root / "lambda_layers").mkdir()
+    for layer in ("opencv", "numpy", "pydicom"):
+        with zipfile.ZipFile(str(root / "lambda_layers" / "{}.zip".format(layer)), "w") as archive:
+            archive.writestr("python/placeholder.txt", "")
+    return root
+
+
+@pytest.fixture
+def synth_in_asset_dir(asset_dir):
+    """Asset paths are relative to the working directory of the CDK (node)
+    process, so stacks with layers are synthesized in a child process started
+    in the asset copy.
+
+    :return: function(script, args) -> Template; the script reads json.loads(sys.argv[1])
+        and prints the template JSON last
+    """
+    def synth(script, args):
+        result = subprocess.run([sys.executable, "-c", script, json.dumps(args)],
+                                cwd=str(asset_dir), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise ValueError(result.stderr.decode().strip().splitlines()[-1])
+        return assertions.Template.from_json(json.loads(result.stdout.decode().strip().splitlines()[-1]))
+
+    return synth
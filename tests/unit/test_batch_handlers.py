@@ -0,0 +1,74 @@
+import io
+import json
+
+import pyarrow.parquet
+import pytest
+
+import lambda_batch_prepare
+import lambda_batch_preprocess
+import lambda_batch_results
+from benchmarks import endpoint_server, images
+from benchmarks.stubs import StubS3
+from mammo_common import labels, preprocessing
+
+SOURCE_BUCKET = "archive-bucket"
+BATCH_BUCKET = lambda_batch_prepare.BATCH_BUCKET
+NAMES = ["2019/a.jpg", "2019/b.png", "2020/c.jpg", "2020/d.jpeg", "2020/e.jpg"]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    original = images.encode(images.synthetic_mammogram(600, 800))
+    objects = {(SOURCE_BUCKET, "scans/" + name): original for name in NAMES}
+    objects[(SOURCE_BUCKET, "scans/index.csv")] = b"not an image"
+    objects[(SOURCE_BUCKET, "scans/2020/e.jpg")] = b"damaged"
+    s3 = StubS3(objects)
+    for module in (lambda_batch_prepare, lambda_batch_preprocess, lambda_batch_results):
+        monkeypatch.setattr(module, "s3", s3)
+    monkeypatch.setattr(lambda_batch_prepare, "CHUNK_SIZE", 2)
+    return s3
+
+
+def transform(s3, batch):
+    """What the batch transform job writes: <output prefix>/<input key>.out per input image."""
+    input_prefix = batch["input_prefix"] + "/"
+    for bucket, key in list(s3.objects):
+        if bucket == BATCH_BUCKET and key.startswith(input_prefix):
+            output_key = "{}/{}.out".format(batch["output_prefix"], key[len(input_prefix):])
+            s3.objects[(bucket, output_key)] = json.dumps(endpoint_server.probabilities(s3.objects[(bucket, key)])).encode()
+
+
+def test_batch_run_writes_one_parquet_file(s3):
+    batch = lambda_batch_prepare.lambda_handler({"source": "s3://archive-bucket/scans", "run_name": "run:1"}, None)
+
+    assert batch["images"] == 5
+    assert batch["source_prefix"] == "scans/"
+    assert batch["job_name"] == "batch-run-1"
+    assert len(batch["chunks"]) == 3
+    assert json.loads(s3.objects[(BATCH_BUCKET, batch["chunks"][0])]) == ["scans/2019/a.jpg", "scans/2019/b.png"]
+
+    outcomes = [lambda_batch_preprocess.lambda_handler({**batch, "manifest": manifest}, None)
+                for manifest in batch["chunks"]]
+    assert sum(outcome["processed"] for outcome in outcomes) == 4
+    assert [outcome["failures"] for outcome in outcomes][-1] == ["scans/2020/e.jpg"]
+    resized = s3.objects[(BATCH_BUCKET, "batch/run-1/input/2019/b.png")]
+    assert preprocessing.decode_image(resized).shape[:2] == (300, 150)
+
+    transform(s3, batch)
+    result = lambda_batch_results.lambda_handler(batch, None)
+
+    assert result == {"results": "s3://{}/batch/run-1/results.parquet".format(BATCH_BUCKET), "images": 4}
+    table = pyarrow.parquet.read_table(io.BytesIO(s3.objects[(BATCH_BUCKET, "batch/run-1/results.parquet")]))
+    rows = table.to_pylist()
+    assert [row["image"] for row in rows] == ["s3://archive-bucket/scans/" + name for name in NAMES[:4]]
+
+    # decoded like the classify API
+    prediction = [rows[0]["p_" + name] for name in labels.CLASS_NAMES]
+    position = labels.get_best_prediction_position(prediction)
+    assert rows[0]["label"] == labels.CLASS_NAMES[position]
+    assert rows[0]["description"] == labels.get_description(position, prediction)
+
+
+def test_prepare_rejects_an_empty_prefix(s3):
+    with pytest.raises(ValueError):
+        lambda_batch_prepare.lambda_handler({"source": "s3://archive-bucket/missing/", "run_name": "run"}, None)
@@ -0,0 +1,58 @@
+import time
+
+from benchmarks import suite
+from mammo_common import preprocessing
+
+SMALL_CASE = [("jpeg-600x800", 600, 800, "jpeg")]
+NO_LATENCY = {"s3": 0.0, "ssm": 0.0, "invoke": 0.0, "endpoint": 0.0}
+
+
+def run_small():
+    return suite.run_suite(3, NO_LATENCY, cases=SMALL_CASE, scenarios=["resize-handler", "classify-lambda"])
+
+
+def test_suite_reports_requests_and_stages():
+    results = run_small()
+
+    resize = results["jpeg-600x800/resize-handler"]
+    assert resize["requests"] == 3
+    assert resize["p50_ms"] <= resize["p95_ms"] <= resize["p99_ms"]
+    assert {"s3_get_original", "decode", "resize", "encode", "s3_put_resized"} <= set(resize["stages"])
+    assert resize["peak_mib"] >= resize["stages"]["decode"]["peak_mib"] > 0
+
+    # stages of the nested resize function are reported under its name
+    assert "resize.decode" in results["jpeg-600x800/classify-lambda"]["stages"]
+
+
+def handler_globals():
+    return {(module.__name__, name): getattr(module, name) for module, names in suite.STUBBED_GLOBALS for name in names}
+
+
+def test_suite_restores_the_handler_globals():
+    before = handler_globals()
+    run_small()
+
+    assert handler_globals() == before
+
+
+def test_check_flags_a_slower_decode(monkeypatch):
+    baseline = {"results": run_small()}
+    decode_image = preprocessing.decode_image
+
+    def slow_decode(*args, **kwargs):
+        time.sleep(0.02)
+        return decode_image(*args, **kwargs)
+
+    monkeypatch.setattr(preprocessing, "decode_image", slow_decode)
+    regressions = suite.compare(run_small(), baseline, tolerance=0.25)
+
+    labels = {label for label, _, _, _ in regressions}
+    assert "jpeg-600x800/resize-handler:decode" in labels
+    assert "jpeg-600x800/resize-handler:encode" not in labels
+
+
+def test_compare_ignores_missing_and_small_changes():
+    result = {"p50_ms": 10.0, "stages": {"decode": {"p50_ms": 0.4}}}
+    baseline = {"results": {"case/scenario": {"p50_ms": 9.5, "stages": {"decode": {"p50_ms": 0.2}}}}}
+
+    assert suite.compare({"case/scenario": result, "other/scenario": result}, baseline, 0.25) == []
@@ -0,0 +1,179 @@
+import json
+import os
+
+import pytest
+
+from benchmarks import images
+from benchmarks.stubs import StubS3
+from mammo_common import preprocessing
+from scripts import build_dataset
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    root = tmp_path / "raw"
+    for label, name in enumerate(build_dataset.CLASS_NAMES):
+        (root / name).mkdir(parents=True)
+        for index in range(4):
+            image = images.synthetic_mammogram(400, 600, seed=label * 10 + index)
+            (root / name / "{}-{}.jpg".format(name, index)).write_bytes(images.encode(image))
+    return root
+
+
+def build(source_dir, output_dir, **kwargs):
+    sources = [build_dataset.open_location(str(source_dir))]
+    output_storage, output_prefix = build_dataset.open_location(str(output_dir))
+    return build_dataset.build_dataset(sources, output_storage, output_prefix, workers=2, **kwargs)
+
+
+def read_lst(path):
+    return [line.split("\t") for line in path.read_text().splitlines()]
+
+
+def test_builds_channels_lst_and_sample_count(source_dir, tmp_path):
+    output_dir = tmp_path / "resize"
+    summary = build(source_dir, output_dir)
+
+    train = read_lst(output_dir / "train-data.lst")
+    test = read_lst(output_dir / "test-data.lst")
+    assert summary["num_training_samples"] == len(train)
+    assert summary["num_validation_samples"] == len(test)
+    assert len(train) + len(test) == 20
+    # the split only depends on the image names of the fixture
+    assert train and test
+    assert summary["image_shape"] == "3,300,150"
+
+    index, label, path = train[0]
+    assert index == "0"
+    assert path.startswith(build_dataset.CLASS_NAMES[int(label)] + "/")
+    resized = preprocessing.decode_image((output_dir / "train" / path).read_bytes())
+    assert resized.shape == (300, 150)
+
+
+def test_rerun_only_processes_new_or_changed_images(source_dir, tmp_path):
+    output_dir = tmp_path / "resize"
+    build(source_dir, output_dir)
+
+    assert build(source_dir, output_dir)["processed"] == 0
+
+    (source_dir / "CCD" / "CCD-0.jpg").write_bytes(images.encode(images.synthetic_mammogram(500, 700)))
+    (source_dir / "MLOE" / "MLOE-9.jpg").write_bytes(images.encode(images.synthetic_mammogram(500, 700)))
+    os.remove(source_dir / "NAO" / "NAO-0.jpg")
+    summary = build(source_dir, output_dir)
+
+    assert summary["processed"] == 2
+    assert summary["num_training_samples"] + summary["num_validation_samples"] == 20
+    # the output of the removed image is deleted
+    assert not list(output_dir.glob("*/NAO/NAO-0.jpg"))
+
+
+def test_recordio_shards(source_dir, tmp_path):
+    output_dir = tmp_path / "resize"
+    summary = build(source_dir, output_dir, recordio_shard_size=5)
+
+    shards = sorted(os.listdir(output_dir / "recordio" / "train"))
+    assert len(shards) == -(-summary["num_training_samples"] // 5)
+    data = (output_dir / "recordio" / "train" / shards[0]).read_bytes()
+    magic, length = build_dataset.struct.unpack("<II", data[:8])
+    assert magic == build_dataset.RECORDIO_MAGIC
+    # the record holds the IRHeader followed by a JPEG
+    assert data[8 + 24:8 + 26] == b"\xff\xd8"
+
+
+def test_split_does_not_depend_on_the_source_location(source_dir, tmp_path):
+    s3 = StubS3()
+    for path in source_dir.rglob("*.jpg"):
+        s3.objects[("bucket", "some/prefix/" + path.relative_to(source_dir).as_posix())] = path.read_bytes()
+    storage = build_dataset.S3Storage("bucket", s3)
+    build_dataset.build_dataset([(storage, "some/prefix")], storage, "resize", workers=2)
+
+    output_dir = tmp_path / "resize"
+    build(source_dir, output_dir)
+    assert s3.objects[("bucket", "resize/test-data.lst")].decode() == (output_dir / "test-data.lst").read_text()
+
+
+def test_empty_split_writes_an_empty_lst(source_dir, tmp_path):
+    output_dir = tmp_path / "resize"
+    summary = build(source_dir, output_dir, test_percent=0)
+
+    assert summary["num_validation_samples"] == 0
+    assert (output_dir / "test-data.lst").read_bytes() == b""
+    assert len(read_lst(output_dir / "train-data.lst")) == 20
+
+
+def test_paginated_s3_listing(source_dir):
+    s3 = StubS3()
+    for path in source_dir.rglob("*.jpg"):
+        s3.objects[("bucket", "raw/" + path.relative_to(source_dir).as_posix())] = path.read_bytes()
+    s3.page_size = 3
+    storage = build_dataset.S3Storage("bucket", s3)
+
+    assert len(storage.list("raw/CCD/")) == 4
+    assert s3.calls["ListObjectsV2"] == 2
+
+    summary = build_dataset.build_dataset([(storage, "raw")], storage, "resize", workers=2)
+    assert summary["num_training_samples"] + summary["num_validation_samples"] == 20
+    assert ("bucket", "resize/train-data.lst") in s3.objects
+    manifest = json.loads(s3.objects[("bucket", "resize/manifest.json")])
+    assert all(uri.startswith("s3://bucket/raw/") for uri in manifest["entries"])
+
+
+def test_cli_writes_summary(source_dir, tmp_path):
+    summary_path = tmp_path / "dataset_manifest.json"
+    build_dataset.main([str(source_dir), "--output", str(tmp_path / "resize"), "--workers", "2",
+                        "--summary", str(summary_path)])
+
+    assert json.loads(summary_path.read_text())["num_classes"] == 5
+
+
+def test_roi_padding_change_rebuilds_every_image(source_dir, tmp_path):
+    output_dir = tmp_path / "resize"
+    build(source_dir, output_dir)
+
+    summary = build(source_dir, output_dir, roi_padding=0.02)
+    assert summary["processed"] == 20
+    assert summary["roi_padding"] == 0.02
+    assert build(source_dir, output_dir, roi_padding=0.02)["processed"] == 0
+
+
+def test_dicom_sources_are_written_as_jpeg(source_dir, tmp_path):
+    image = images.synthetic_mammogram(400, 600).astype("uint16") * 16
+    (source_dir / "CCE" / "CCE-9.dcm").write_bytes(images.encode_dicom(image))
+    output_dir = tmp_path / "resize"
+    build(source_dir, output_dir)
+
+    paths = [path for _, _, path in read_lst(output_dir / "train-data.lst") + read_lst(output_dir / "test-data.lst")]
+    assert "CCE/CCE-9.jpg" in paths
+
+
+def output_files(output_dir):
+    return sorted(path.relative_to(output_dir).as_posix() for path in output_dir.glob("t*/*/*"))
+
+
+def test_png_sources_are_written_as_jpeg(source_dir, tmp_path):
+    image = images.synthetic_mammogram(400, 600).astype("uint16") * 16
+    (source_dir / "CCE" / "CCE-9.png").write_bytes(images.encode(image, ".png"))
+    output_dir = tmp_path / "resize"
+    build(source_dir, output_dir)
+
+    (path,) = [path for path in output_files(output_dir) if "CCE-9" in path]
+    assert path.endswith("/CCE/CCE-9.jpg")
+    assert (output_dir / path).read_bytes()[:2] == b"\xff\xd8"
+
+
+def test_same_output_name_is_an_error(source_dir, tmp_path):
+    (source_dir / "CCE" / "CCE-0.png").write_bytes(images.encode(images.synthetic_mammogram(400, 600), ".png"))
+
+    with pytest.raises(ValueError, match="CCE-0.jpg"):
+        build(source_dir, tmp_path / "resize")
+
+
+def test_outputs_moved_to_the_other_split_are_deleted(source_dir, tmp_path):
+    output_dir = tmp_path / "resize"
+    build(source_dir, output_dir, recordio_shard_size=5)
+    summary = build(source_dir, output_dir, test_percent=0, recordio_shard_size=5)
+
+    assert summary["num_validation_samples"] == 0
+    assert all(path.startswith("train/") for path in output_files(output_dir))
+    assert len(output_files(output_dir)) == 20
+    assert os.listdir(output_dir / "recordio" / "test") == []
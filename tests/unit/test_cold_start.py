@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import LAMBDA_CODE_PATHS
+from mammo_common import clients
+
+# Import time of a handler module, without OpenCV, NumPy or boto3. Generous
+# for slow CI machines, it is ~30 ms on a laptop and ~1 s with eager imports.
+IMPORT_BUDGET_MS = 400
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed, "loaded": [name for name in ("cv2", "numpy", "boto3") if name in sys.modules]}}))
+"""
+
+
+def import_in_fresh_process(module, **env):
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(LAMBDA_CODE_PATHS),
+                       AWS_DEFAULT_REGION="us-east-1", ENDPOINT_NAME="endpoint", **env)
+    output = subprocess.check_output([sys.executable, "-c", PROBE.format(module=module)], env=environment)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_classifier_import_is_light():
+    result = import_in_fresh_process("lambda_invoke_classifier", PREPROCESS_MODE="inline")
+    assert result["loaded"] == []
+    assert result["ms"] < IMPORT_BUDGET_MS
+
+
+def test_resize_import_is_light():
+    result = import_in_fresh_process("lambda_resize_image")
+    assert result["loaded"] == []
+    assert result["ms"] < IMPORT_BUDGET_MS
+
+
+def test_lazy_client_is_created_once_with_tuned_config(monkeypatch):
+    created = []
+    monkeypatch.setattr(clients, "create_client", lambda name: created.append(name) or object())
+
+    client = clients.LazyClient("sagemaker-runtime")
+    assert created == []
+    assert client.get() is client.get()
+    assert created == ["sagemaker-runtime"]
+
+    config = clients.client_config("sagemaker-runtime")
+    assert config.read_timeout == clients.READ_TIMEOUTS["sagemaker-runtime"]
+    assert config.retries["mode"] == "adaptive"
+    assert config.tcp_keepalive is True
@@ -0,0 +1,71 @@
+import json
+import threading
+import time
+
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from benchmarks import endpoint_server, images, load_generator
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "local")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "local")
+    servers = []
+
+    def start(model):
+        server, url = endpoint_server.start_server(model)
+        servers.append(server)
+        return boto3.client("sagemaker-runtime", endpoint_url=url, region_name="us-east-1",
+                            config=Config(retries={"max_attempts": 1, "mode": "standard"}))
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def invoke(client, body):
+    response = client.invoke_endpoint(EndpointName="mammography-classification-endpoint",
+                                      ContentType="application/x-image", Body=body)
+    return json.loads(response["Body"].read())
+
+
+def test_invoke_endpoint_contract(serve):
+    client = serve(endpoint_server.EndpointModel(latency_ms=1, jitter=0))
+    body = images.encode(images.synthetic_mammogram(150, 300))
+
+    prediction = invoke(client, body)
+    assert len(prediction) == 5 and sum(prediction) == pytest.approx(1, abs=1e-4)
+    assert invoke(client, body) == prediction
+
+
+def test_model_errors(serve):
+    client = serve(endpoint_server.EndpointModel(latency_ms=1, jitter=0, error_rate=1))
+    with pytest.raises(ClientError) as error:
+        invoke(client, b"image")
+    assert error.value.response["Error"]["Code"] == "ModelError"
+
+
+def test_requests_beyond_the_queue_are_throttled():
+    model = endpoint_server.EndpointModel(latency_ms=200, jitter=0, concurrency=1, queue_limit=1)
+    statuses = []
+    threads = [threading.Thread(target=lambda: statuses.append(model.invoke(b"image")[0])) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [200, 200, 429, 429]
+
+
+def test_load_generator_reports_steps(capsys):
+    steps = load_generator.main(["--rps", "5,10", "--duration", "0.5", "--latency-ms", "5",
+                                 "--lambda-concurrency", "4"])
+
+    assert [step["target_rps"] for step in steps] == [5.0, 10.0]
+    assert steps[0]["requests"] == 2 and steps[0]["errors"] == 0
+    assert "rps" in capsys.readouterr().out.splitlines()[-1]
@@ -0,0 +1,135 @@
+import pytest
+
+from mammo_scan_ecs.web_service_config import web_service_settings
+
+SYNTH = """
+import json, sys
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+from mammo_scan_ecs.frontend_stack import FrontEndWebStack
+from mammo_scan_ecs.vpc_stack import MammoScanVpcStack
+
+sagemaker_configs, frontend_configs = json.loads(sys.argv[1])
+app = core.App()
+vpc_stack = MammoScanVpcStack(app, "VpcStack")
+stack = FrontEndWebStack(app, "FrontEndWebStack", vpc=vpc_stack.get_vpc,
+                         sagemaker_configs=sagemaker_configs, frontend_configs=frontend_configs)
+print(json.dumps(assertions.Template.from_stack(stack).to_json()))
+"""
+
+
+@pytest.fixture
+def synth_frontend_stack(synth_in_asset_dir, sagemaker_configs):
+
+    def synth(frontend_configs=None):
+        return synth_in_asset_dir(SYNTH, [sagemaker_configs, frontend_configs])
+
+    return synth
+
+
+def classification_function(template):
+    functions = template.find_resources("AWS::Lambda::Function", {
+        "Properties": {"Handler": "lambda_invoke_classifier.lambda_handler"}})
+    (function,) = functions.values()
+    return function["Properties"]
+
+
+def test_api_calls_the_function_by_default(synth_frontend_stack):
+    template = synth_frontend_stack()
+
+    template.resource_count_is("AWS::Lambda::Alias", 0)
+    (task,) = template.find_resources("AWS::ECS::TaskDefinition").values()
+    environment = {variable["Name"]: variable["Value"]
+                   for variable in task["Properties"]["ContainerDefinitions"][0]["Environment"]}
+    assert environment["WEB_PREPROCESS"] == "false"
+    assert environment["ROI_CROP"] == "false"
+    assert classification_function(template)["Runtime"] == "python3.9"
+    assert "SnapStart" not in classification_function(template)
+    # the default dataset was built without ROI cropping
+    assert classification_function(template)["Environment"]["Variables"]["ROI_CROP"] == "false"
+    assert classification_function(template)["Environment"]["Variables"]["PRECOMPUTE_PREDICTIONS"] == "false"
+
+
+def test_provisioned_concurrency_alias(synth_frontend_stack):
+    template = synth_frontend_stack({"provisioned_concurrency": 2})
+
+    template.has_resource_properties("AWS::Lambda::Alias", {
+        "Name": "live",
+        "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 2},
+    })
+
+
+def test_snap_start_needs_a_supported_runtime(synth_frontend_stack):
+    with pytest.raises(ValueError, match="python3.12"):
+        synth_frontend_stack({"snap_start": True})
+
+    template = synth_frontend_stack({"snap_start": True, "lambda_runtime": "python3.12"})
+    function = classification_function(template)
+    assert function["Runtime"] == "python3.12"
+    assert function["SnapStart"] == {"ApplyOn": "PublishedVersions"}
+    template.resource_count_is("AWS::Lambda::Alias", 1)
+
+
+def web_service(template):
+    (service,) = template.find_resources("AWS::ECS::Service").values()
+    return service["Properties"]
+
+
+def test_web_service_mixes_fargate_and_spot_and_scales_on_requests(synth_frontend_stack):
+    template = synth_frontend_stack()
+
+    service = web_service(template)
+    assert "LaunchType" not in service
+    assert service["CapacityProviderStrategy"] == [
+        {"CapacityProvider": "FARGATE", "Base": 1, "Weight": 1},
+        {"CapacityProvider": "FARGATE_SPOT", "Weight": 3},
+    ]
+    template.has_resource_properties("AWS::ECS::ClusterCapacityProviderAssociations", {
+        "CapacityProviders": ["FARGATE", "FARGATE_SPOT"]})
+    # the EC2 capacity is opt-in
+    template.resource_count_is("AWS::AutoScaling::AutoScalingGroup", 0)
+
+    (target_group,) = template.find_resources("AWS::ElasticLoadBalancingV2::TargetGroup").values()
+    attributes = {attribute["Key"]: attribute["Value"]
+                  for attribute in target_group["Properties"]["TargetGroupAttributes"]}
+    assert attributes["stickiness.enabled"] == "true"
+    assert attributes["stickiness.type"] == "lb_cookie"
+    assert attributes["stickiness.lb_cookie.duration_seconds"] == str(8 * 3600)
+
+    policies = template.find_resources("AWS::ApplicationAutoScaling::ScalingPolicy")
+    metrics = sorted(policy["Properties"]["TargetTrackingScalingPolicyConfiguration"]
+                     ["PredefinedMetricSpecification"]["PredefinedMetricType"] for policy in policies.values())
+    assert metrics == ["ALBRequestCountPerTarget", "ECSServiceAverageCPUUtilization"]
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "TargetTrackingScalingPolicyConfiguration": {"TargetValue": 1000}})
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 1, "MaxCapacity": 10})
+
+
+def test_web_service_on_fargate_only_with_ec2_capacity(synth_frontend_stack):
+    template = synth_frontend_stack({"web_service": {
+        "capacity_provider_strategy": [{"capacity_provider": "FARGATE", "weight": 1}],
+        "min_capacity": 2,
+        "stickiness_hours": 1,
+        "ec2_spot_capacity": {"instance_type": "c5.xlarge", "spot_price": "0.0735", "max_capacity": 2},
+    }})
+
+    assert web_service(template)["CapacityProviderStrategy"] == [{"CapacityProvider": "FARGATE", "Weight": 1}]
+    assert web_service(template)["DesiredCount"] == 2
+    template.has_resource_properties("AWS::AutoScaling::AutoScalingGroup", {"MaxSize": "2", "MinSize": "1"})
+    template.has_resource_properties("AWS::AutoScaling::LaunchConfiguration", {
+        "InstanceType": "c5.xlarge", "SpotPrice": "0.0735"})
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {"MinCapacity": 2})
+
+
+@pytest.mark.parametrize("web_service, message", [
+    ({"capacity_provider_strategy": [{"capacity_provider": "EC2", "weight": 1}]}, "Unknown capacity provider"),
+    ({"capacity_provider_strategy": [{"capacity_provider": "FARGATE", "base": 1, "weight": 1},
+                                     {"capacity_provider": "FARGATE_SPOT", "base": 1, "weight": 1}]}, "base"),
+    ({"capacity_provider_strategy": [{"capacity_provider": "FARGATE_SPOT", "weight": 0}]}, "weight"),
+    ({"min_capacity": 3, "max_capacity": 2}, "min_capacity"),
+    ({"stickiness_hours": 24 * 8}, "stickiness_hours"),
+])
+def test_web_service_settings_are_validated(web_service, message):
+    with pytest.raises(ValueError, match=message):
+        web_service_settings(web_service)
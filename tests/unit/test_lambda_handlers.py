@@ -0,0 +1,429 @@
+import base64
+import datetime
+import importlib.util
+import json
+import os
+
+import pytest
+
+import lambda_classify_worker
+import lambda_invoke_classifier
+import lambda_preprocess_upload
+import lambda_resize_image
+from benchmarks import images
+from benchmarks.stubs import StubDynamoDB, StubLambda, StubS3, StubSageMaker, StubSageMakerRuntime, StubSSM
+from benchmarks import LAMBDA_DIR
+from mammo_common import jobs, parameters, prediction_cache, preprocessing
+
+BUCKET = lambda_invoke_classifier.bucket
+FILENAME = "scan.jpg"
+ORIGINAL_KEY = "{}/{}".format(preprocessing.ORIGINAL_PREFIX, FILENAME)
+RESIZED_KEY = "{}/{}".format(preprocessing.RESIZED_PREFIX, FILENAME)
+
+
+@pytest.fixture
+def original():
+    return images.encode(images.synthetic_mammogram(600, 800))
+
+
+@pytest.fixture
+def clients(monkeypatch, original):
+    s3 = StubS3({(BUCKET, ORIGINAL_KEY): original})
+    ssm = StubSSM({"resize-lambda": "resize-function"})
+    lambda_client = StubLambda({"resize-function": lambda_resize_image.lambda_handler})
+    sagemaker = StubSageMakerRuntime()
+
+    monkeypatch.setattr(lambda_resize_image, "s3", s3)
+    monkeypatch.setattr(lambda_invoke_classifier, "s3", s3)
+    monkeypatch.setattr(lambda_invoke_classifier, "ssm_client", ssm)
+    monkeypatch.setattr(lambda_invoke_classifier, "ssm_parameters", parameters.ParameterCache(ssm))
+    monkeypatch.setattr(lambda_invoke_classifier, "lambda_client", lambda_client)
+    monkeypatch.setattr(lambda_invoke_classifier, "sagemaker", sagemaker)
+    monkeypatch.setattr(lambda_invoke_classifier, "sagemaker_control", StubSageMaker())
+    monkeypatch.setattr(lambda_invoke_classifier, "model_version", {"value": None, "expires_at": 0})
+    monkeypatch.setattr(lambda_invoke_classifier, "predictions",
+                        prediction_cache.PredictionCache(prediction_cache.InMemoryPredictionTable()))
+    return s3, ssm, lambda_client, sagemaker
+
+
+def classify(filename=FILENAME):
+    response = lambda_invoke_classifier.lambda_handler({"body": json.dumps({"filename": filename})}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_preprocess_image_resizes_to_model_shape(original):
+    resized = preprocessing.decode_image(preprocessing.preprocess_image(original))
+    assert resized.shape[:2] == (300, 150)
+
+
+def test_resize_lambda_stores_resized_copy(clients):
+    s3 = clients[0]
+    response = lambda_resize_image.lambda_handler({"bucket": BUCKET, "filename": FILENAME}, None)
+
+    assert json.loads(response["body"]) == {"bucket": BUCKET, "key": RESIZED_KEY}
+    assert preprocessing.decode_image(s3.objects[(BUCKET, RESIZED_KEY)]).shape[:2] == (300, 150)
+
+
+def test_inline_mode_skips_resize_lambda(monkeypatch, clients):
+    s3, ssm, lambda_client, sagemaker = clients
+    monkeypatch.setattr(lambda_invoke_classifier, "PREPROCESS_MODE", "inline")
+
+    status, body = classify()
+
+    assert status == 200
+    assert "Cranial-Caudal Right" in body["prediction"]
+    assert lambda_client.calls["Invoke"] == 0
+    assert ssm.calls["GetParameter"] == 0
+    assert s3.calls == {"GetObject": 1}
+    assert preprocessing.decode_image(sagemaker.bodies[0]).shape[:2] == (300, 150)
+
+
+def test_lambda_mode_matches_inline_mode(monkeypatch, clients):
+    s3, ssm, lambda_client, sagemaker = clients
+    monkeypatch.setattr(lambda_invoke_classifier, "PREPROCESS_MODE", "lambda")
+
+    assert classify() == (200, {"prediction": "Chance of 80.00% of being a Cranial-Caudal Right (CC-Right)"})
+    assert lambda_client.calls["Invoke"] == 1
+    # the original is read once more to compute the prediction cache key
+    assert s3.calls == {"GetObject": 3, "PutObject": 1}
+    assert sagemaker.bodies[0] == s3.objects[(BUCKET, RESIZED_KEY)]
+
+
+def test_missing_original_raises(clients):
+    with pytest.raises(ValueError):
+        classify("missing.jpg")
+
+
+def classify_batch(filenames):
+    response = lambda_invoke_classifier.lambda_handler({"body": json.dumps({"filenames": filenames})}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_batch_reports_per_image_errors(clients, original):
+    s3 = clients[0]
+    s3.objects[(BUCKET, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, "other.jpg"))] = original
+
+    status, body = classify_batch([FILENAME, "missing.jpg", "other.jpg"])
+
+    assert status == 200
+    assert [result["filename"] for result in body["results"]] == [FILENAME, "missing.jpg", "other.jpg"]
+    assert "prediction" in body["results"][0] and "prediction" in body["results"][2]
+    assert "not found" in body["results"][1]["error"]
+
+
+def test_batch_invokes_endpoint_concurrently_within_limit(monkeypatch, clients, original):
+    s3, sagemaker = clients[0], clients[3]
+    sagemaker.latency = 0.05
+    monkeypatch.setattr(lambda_invoke_classifier, "PREPROCESS_WORKERS", 4)
+    monkeypatch.setattr(lambda_invoke_classifier, "invoke_slots", lambda_invoke_classifier.threading.BoundedSemaphore(2))
+    filenames = ["view-{}.jpg".format(i) for i in range(4)]
+    for filename in filenames:
+        s3.objects[(BUCKET, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, filename))] = original
+
+    status, body = classify_batch(filenames)
+
+    assert status == 200
+    assert all("prediction" in result for result in body["results"])
+    assert sagemaker.max_in_flight == 2
+
+
+def test_batch_size_is_bounded(clients):
+    status, body = classify_batch(["scan.jpg"] * (lambda_invoke_classifier.MAX_BATCH_SIZE + 1))
+    assert status == 400
+    assert classify_batch([])[0] == 400
+
+
+def test_repeated_image_is_served_from_cache(clients, original, capsys):
+    s3, sagemaker = clients[0], clients[3]
+    s3.objects[(BUCKET, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, "resubmitted.jpg"))] = original
+
+    first = classify()
+    assert classify("resubmitted.jpg") == first
+    assert sagemaker.calls["InvokeEndpoint"] == 1
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if "prediction_cache" in line]
+    stats = lines[-1]["prediction_cache"]
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1
+
+
+def test_cache_table_is_shared_between_containers(monkeypatch, clients):
+    sagemaker = clients[3]
+    classify()
+    # a new container starts with an empty in-memory tier
+    table = lambda_invoke_classifier.predictions.table
+    monkeypatch.setattr(lambda_invoke_classifier, "predictions", prediction_cache.PredictionCache(table))
+
+    classify()
+
+    assert sagemaker.calls["InvokeEndpoint"] == 1
+    assert lambda_invoke_classifier.predictions.stats()["table_hits"] == 1
+
+
+def test_new_model_version_invalidates_cache(monkeypatch, clients):
+    sagemaker = clients[3]
+    classify()
+    monkeypatch.setattr(lambda_invoke_classifier, "sagemaker_control", StubSageMaker("model-v2"))
+    monkeypatch.setattr(lambda_invoke_classifier, "model_version", {"value": None, "expires_at": 0})
+
+    classify()
+
+    assert sagemaker.calls["InvokeEndpoint"] == 2
+
+
+class FailingSageMaker(StubSageMaker):
+
+    def describe_endpoint(self, EndpointName, **kwargs):
+        self._call("DescribeEndpoint")
+        raise RuntimeError("ThrottlingException")
+
+
+def test_describe_endpoint_failure_does_not_fail_classification(monkeypatch, clients):
+    sagemaker = clients[3]
+    monkeypatch.setattr(lambda_invoke_classifier, "sagemaker_control", FailingSageMaker())
+
+    # no known model version: classified without the cache
+    assert classify()[0] == 200
+    assert classify()[0] == 200
+    assert sagemaker.calls["InvokeEndpoint"] == 2
+    # the failed lookup is not retried on every request
+    assert lambda_invoke_classifier.sagemaker_control.calls["DescribeEndpoint"] == 1
+
+    # a known version is kept when the lookup fails later on
+    monkeypatch.setattr(lambda_invoke_classifier, "model_version", {"value": "model-v1", "expires_at": 0})
+    assert classify()[0] == 200
+    assert classify()[0] == 200
+    assert sagemaker.calls["InvokeEndpoint"] == 3
+
+
+def test_lru_evicts_least_recently_used():
+    cache = prediction_cache.LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_dynamodb_table_ignores_expired_items():
+    dynamodb = StubDynamoDB()
+    table = prediction_cache.DynamoDBPredictionTable("cache", dynamodb, ttl_seconds=60)
+    table.put("model-v1#abc", [0.1, 0.9])
+    assert table.get("model-v1#abc") == [0.1, 0.9]
+
+    dynamodb.tables["cache"]["model-v1#abc"]["expires_at"] = {"N": "0"}
+    assert table.get("model-v1#abc") is None
+
+
+@pytest.fixture
+def job_backends(monkeypatch):
+    store, queue = jobs.InMemoryJobStore(), jobs.InMemoryJobQueue()
+    monkeypatch.setattr(lambda_invoke_classifier, "job_store", store)
+    monkeypatch.setattr(lambda_invoke_classifier, "job_queue", queue)
+    return store, queue
+
+
+def api_request(method, path, body=None):
+    event = {"httpMethod": method, "path": path, "body": json.dumps(body) if body is not None else None}
+    response = lambda_invoke_classifier.lambda_handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_async_job_flow(clients, job_backends, original):
+    s3 = clients[0]
+    s3.objects[(BUCKET, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, "other.jpg"))] = original
+    store, queue = job_backends
+
+    status, submitted = api_request("POST", "/jobs", {"filename": FILENAME})
+    assert status == 202
+    status, batch_submitted = api_request("POST", "/jobs", {"filenames": ["other.jpg", "missing.jpg"]})
+    assert status == 202
+    assert api_request("GET", "/jobs/" + submitted["job_id"])[1]["status"] == jobs.QUEUED
+
+    assert lambda_classify_worker.lambda_handler(queue.receive_event(), None) == {"batchItemFailures": []}
+
+    status, job = api_request("GET", "/jobs/" + submitted["job_id"])
+    assert status == 200
+    assert job["status"] == jobs.SUCCEEDED
+    assert "Cranial-Caudal Right" in job["result"]["results"][0]["prediction"]
+    results = api_request("GET", "/jobs/" + batch_submitted["job_id"])[1]["result"]["results"]
+    assert "prediction" in results[0] and "error" in results[1]
+
+
+def test_unknown_job_is_404(clients, job_backends):
+    assert api_request("GET", "/jobs/nope")[0] == 404
+
+
+def test_async_jobs_disabled_without_backends(clients):
+    assert api_request("POST", "/jobs", {"filename": FILENAME})[0] == 501
+
+
+def test_worker_reports_invalid_messages(clients, job_backends):
+    event = {"Records": [{"messageId": "bad", "body": "not json"}]}
+    assert lambda_classify_worker.lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "bad"}]}
+
+
+def test_worker_only_fails_malformed_jobs(clients, job_backends):
+    store, queue = job_backends
+    api_request("POST", "/jobs", {"filename": FILENAME})
+    event = queue.receive_event()
+    event["Records"] += [
+        {"messageId": "no-filenames", "body": json.dumps({"job_id": "job-2"})},
+        {"messageId": "no-job-id", "body": json.dumps({"filenames": [FILENAME]})},
+        {"messageId": "not-a-job", "body": "[]"},
+    ]
+
+    assert lambda_classify_worker.lambda_handler(event, None) == {"batchItemFailures": [
+        {"itemIdentifier": "no-filenames"}, {"itemIdentifier": "no-job-id"}, {"itemIdentifier": "not-a-job"}]}
+    job_id = json.loads(event["Records"][0]["body"])["job_id"]
+    assert store.get(job_id)["status"] == jobs.SUCCEEDED
+
+
+def test_dynamodb_job_store_round_trip():
+    store = jobs.DynamoDBJobStore("jobs", StubDynamoDB(key_name="job_id"))
+    store.put("job-1", jobs.QUEUED)
+    assert store.get("job-1") == {"job_id": "job-1", "status": jobs.QUEUED, "result": None}
+
+    store.put("job-1", jobs.SUCCEEDED, {"results": []})
+    assert store.get("job-1")["result"] == {"results": []}
+    assert store.get("job-2") is None
+
+
+def upload_event(key=ORIGINAL_KEY):
+    return {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": key}}}]}
+
+
+def test_upload_handler_stores_resized_copy_and_prediction(monkeypatch, clients):
+    s3, ssm, lambda_client, sagemaker = clients
+    monkeypatch.setattr(lambda_invoke_classifier, "PRECOMPUTE_PREDICTIONS", True)
+
+    lambda_preprocess_upload.lambda_handler(upload_event(), None)
+    assert preprocessing.decode_image(s3.objects[(BUCKET, RESIZED_KEY)]).shape[:2] == (300, 150)
+    assert sagemaker.calls["InvokeEndpoint"] == 1
+
+    # the classify call that follows is answered from the cache
+    assert classify()[0] == 200
+    assert sagemaker.calls["InvokeEndpoint"] == 1
+
+
+def test_upload_handler_ignores_other_prefixes(clients):
+    s3 = clients[0]
+    lambda_preprocess_upload.lambda_handler(upload_event(RESIZED_KEY), None)
+    assert s3.calls["PutObject"] == 0
+
+
+def test_classify_skips_resize_when_artifact_exists(monkeypatch, clients):
+    s3, ssm, lambda_client, sagemaker = clients
+    lambda_preprocess_upload.lambda_handler(upload_event(), None)
+    resized = s3.objects[(BUCKET, RESIZED_KEY)]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("resized again")
+
+    monkeypatch.setattr(lambda_invoke_classifier, "RESIZED_ARTIFACTS", True)
+    monkeypatch.setattr(lambda_invoke_classifier, "PREPROCESS_MODE", "lambda")
+    monkeypatch.setattr(preprocessing, "preprocess_image", fail)
+
+    assert classify()[0] == 200
+    assert sagemaker.bodies == [resized]
+    assert lambda_client.calls["Invoke"] == 0
+
+
+def classify_body_image(image_bytes):
+    body = json.dumps({"image": base64.b64encode(image_bytes).decode()})
+    return lambda_invoke_classifier.lambda_handler({"body": body}, None)
+
+
+def test_inline_image_skips_s3(clients, original):
+    s3, ssm, lambda_client, sagemaker = clients
+    body = json.dumps({"image": base64.b64encode(original).decode()})
+
+    response = lambda_invoke_classifier.lambda_handler({"body": body}, None)
+
+    assert json.loads(response["body"]) == {"prediction": "Chance of 80.00% of being a Cranial-Caudal Right (CC-Right)"}
+    assert s3.calls == {}
+    assert preprocessing.decode_image(sagemaker.bodies[0]).shape[:2] == (300, 150)
+
+
+def test_binary_body_matches_base64_field(clients, original):
+    sagemaker = clients[3]
+    event = {"body": base64.b64encode(original).decode(), "isBase64Encoded": True,
+             "headers": {"Content-Type": "image/jpeg"}}
+
+    assert lambda_invoke_classifier.lambda_handler(event, None)["statusCode"] == 200
+    # the same bytes again are served from the prediction cache
+    assert classify_body_image(original)["statusCode"] == 200
+    assert sagemaker.calls["InvokeEndpoint"] == 1
+
+
+def test_inline_image_size_limit(monkeypatch, clients, original):
+    monkeypatch.setattr(lambda_invoke_classifier, "MAX_INLINE_BYTES", len(original) - 1)
+    assert classify_body_image(original)["statusCode"] == 413
+
+
+@pytest.mark.parametrize("event", [
+    {"body": None},
+    {"body": "not json"},
+    {"body": json.dumps(["scan.jpg"])},
+    {"body": json.dumps({})},
+    {"body": json.dumps({"filenames": "scan.jpg"})},
+    {"body": json.dumps({"image": "not base64!"})},
+    {"body": json.dumps({"image": base64.b64encode(b"not an image").decode()})},
+    {"body": "bm90IGJhc2U2NA=", "isBase64Encoded": True, "headers": {"Content-Type": "application/octet-stream"}},
+    {"body": None, "path": "/jobs", "httpMethod": "POST"},
+])
+def test_invalid_requests_are_client_errors(clients, event):
+    response = lambda_invoke_classifier.lambda_handler(event, None)
+
+    assert response["statusCode"] == 400
+    assert "error" in json.loads(response["body"])
+
+
+def test_model_ready_image_is_sent_as_is(monkeypatch, clients, original):
+    sagemaker = clients[3]
+    resized = preprocessing.preprocess_image(original)
+    assert preprocessing.is_model_ready(resized) and not preprocessing.is_model_ready(original)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("model-ready images must not be preprocessed again")
+
+    monkeypatch.setattr(preprocessing, "preprocess_image", fail)
+    assert classify_body_image(resized)["statusCode"] == 200
+    assert sagemaker.bodies[0] == resized
+
+
+class StubStepFunctions:
+
+    def __init__(self):
+        self.inputs = []
+
+    def start_execution(self, stateMachineArn, input):
+        self.inputs.append(json.loads(input))
+        return {"executionArn": "arn:execution"}
+
+
+def test_start_state_names_jobs_per_invocation(monkeypatch):
+    monkeypatch.setenv("STATE_MACHINE_ARN", "arn:state-machine")
+    spec = importlib.util.spec_from_file_location("start_state", os.path.join(LAMBDA_DIR, "statestart", "start-state.py"))
+    start_state = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(start_state)
+    sfn = StubStepFunctions()
+    monkeypatch.setattr(start_state, "sfn_client", sfn)
+
+    times = iter([datetime.datetime(2024, 5, 1, 10, 0, 0), datetime.datetime(2024, 5, 1, 11, 30, 0)])
+
+    class Clock(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return next(times)
+
+    monkeypatch.setattr(start_state, "datetime", Clock)
+    start_state.lambda_handler({}, None)
+    start_state.lambda_handler({}, None)
+
+    assert [payload["smJobName"] for payload in sfn.inputs] == [
+        "mammography-classification-2024-05-01-10-00-00", "mammography-classification-2024-05-01-11-30-00"]
+    assert sfn.inputs[1]["smTuningJobName"] == "mammo-hpo-240501-113000"
+    assert sfn.inputs[1]["s3_checkpoint_location"].endswith("/model/checkpoints/mammography-classification-2024-05-01-11-30-00")
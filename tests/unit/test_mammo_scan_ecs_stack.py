@@ -1,15 +1,342 @@
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
 
-from mammo_scan_ecs.mammo_scan_ecs_stack import MammoScanEcsStack
+from mammo_scan_ecs.batch_config import batch_transform_settings
+from mammo_scan_ecs.endpoint_config import deployment_config, endpoint_settings, rollout_seconds
+from mammo_scan_ecs.sagemaker_stack import SageMakerStack
+from mammo_scan_ecs.training_config import GIB, spot_training, training_resources
+from mammo_scan_ecs.tuning_config import hyperparameter_search
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in mammo_scan_ecs/mammo_scan_ecs_stack.py
-def test_sqs_queue_created():
+STATE_MACHINE_NAME = "mammpgraphy-state-machine"
+
+
+def synth_sagemaker_stack(sagemaker_configs):
     app = core.App()
-    stack = MammoScanEcsStack(app, "mammo-scan-ecs")
-    template = assertions.Template.from_stack(stack)
+    stack = SageMakerStack(app, "SagemakerStack", sagemaker_configs=sagemaker_configs)
+    return assertions.Template.from_stack(stack)
+
+
+def training_job(template, state_machine_definitions):
+    definition = state_machine_definitions(template)[STATE_MACHINE_NAME]
+    return definition["States"]["CreateTrainingJob"]["Parameters"]
+
+
+def small_dataset():
+    return {"num_training_samples": 1752, "num_validation_samples": 438, "num_classes": 5,
+            "image_shape": "3,300,150", "total_bytes": 40 * 1024 ** 2, "recordio": False}
+
+
+def large_dataset():
+    return {"num_training_samples": 180000, "num_validation_samples": 45000, "num_classes": 5,
+            "image_shape": "3,300,150", "total_bytes": 60 * GIB, "recordio": True}
+
+
+def test_file_mode_without_manifest_keeps_defaults(sagemaker_configs, state_machine_definitions):
+    parameters = training_job(synth_sagemaker_stack(sagemaker_configs), state_machine_definitions)
+
+    assert parameters["AlgorithmSpecification"]["TrainingInputMode"] == "File"
+    assert [channel["ChannelName"] for channel in parameters["InputDataConfig"]] == \
+        ["train", "validation", "train_lst", "validation_lst"]
+    assert parameters["ResourceConfig"] == {"InstanceCount": 1, "InstanceType": "ml.p3.2xlarge", "VolumeSizeInGB": 20}
+
+
+def test_small_dataset_trains_in_file_mode(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["dataset_manifest"] = small_dataset()
+    parameters = training_job(synth_sagemaker_stack(sagemaker_configs), state_machine_definitions)
+
+    assert parameters["AlgorithmSpecification"]["TrainingInputMode"] == "File"
+    assert {channel["DataSource"]["S3DataSource"]["S3DataDistributionType"]
+            for channel in parameters["InputDataConfig"]} == {"FullyReplicated"}
+    assert parameters["ResourceConfig"]["InstanceCount"] == 1
+    assert "kv_store" not in parameters["HyperParameters"]
+
+
+def test_large_dataset_streams_sharded_recordio(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["dataset_manifest"] = large_dataset()
+    template = synth_sagemaker_stack(sagemaker_configs)
+    parameters = training_job(template, state_machine_definitions)
+
+    assert parameters["AlgorithmSpecification"]["TrainingInputMode"] == "Pipe"
+    channels = {channel["ChannelName"]: channel for channel in parameters["InputDataConfig"]}
+    assert set(channels) == {"train", "validation"}
+    assert channels["train"]["ContentType"] == "application/x-recordio"
+    assert channels["train"]["DataSource"]["S3DataSource"]["S3DataDistributionType"] == "ShardedByS3Key"
+    assert channels["validation"]["DataSource"]["S3DataSource"]["S3DataDistributionType"] == "FullyReplicated"
+    assert parameters["ResourceConfig"]["InstanceCount"] == 4
+    assert parameters["ResourceConfig"]["VolumeSizeInGB"] == 10
+    assert parameters["HyperParameters"]["kv_store"] == "dist_sync"
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "start-state.lambda_handler",
+        "Environment": {"Variables": assertions.Match.object_like({"INPUT_MODE": "Pipe"})},
+    })
+
+
+def test_input_mode_can_be_forced(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["dataset_manifest"] = large_dataset()
+    sagemaker_configs["training_input_mode"] = "File"
+    parameters = training_job(synth_sagemaker_stack(sagemaker_configs), state_machine_definitions)
+
+    assert parameters["AlgorithmSpecification"]["TrainingInputMode"] == "File"
+    # the whole dataset is copied to the volume
+    assert parameters["ResourceConfig"]["VolumeSizeInGB"] == 70
+
+
+def test_pipe_mode_needs_recordio():
+    with pytest.raises(ValueError):
+        training_resources(small_dataset(), input_mode="Pipe")
+
+
+def test_instance_endpoint_registers_autoscaling(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["endpoint"] = {"mode": "instance", "autoscaling": {"min_capacity": 2, "max_capacity": 6}}
+    states = state_machine_definitions(synth_sagemaker_stack(sagemaker_configs))[STATE_MACHINE_NAME]["States"]
+
+    variant = states["CreateEndpointConfig"]["Parameters"]["ProductionVariants"][0]
+    assert variant["InitialInstanceCount"] == 2
+    assert states["CreateEndpoint"]["Next"] == "WaitForEndpoint"
+    assert states["EndpointInService"]["Next"] == "RegisterScalableTarget"
+
+    register = states["RegisterScalableTarget"]["Parameters"]
+    assert register["ResourceId"] == "endpoint/mammography-classification-endpoint/variant/AllTraffic"
+    assert register["ScalableDimension"] == "sagemaker:variant:DesiredInstanceCount"
+    assert (register["MinCapacity"], register["MaxCapacity"]) == (2, 6)
+
+    policy = states["PutScalingPolicy"]["Parameters"]["TargetTrackingScalingPolicyConfiguration"]
+    assert policy["PredefinedMetricSpecification"]["PredefinedMetricType"] == "SageMakerVariantInvocationsPerInstance"
+    assert policy["TargetValue"] == 600
+    assert (policy["ScaleInCooldown"], policy["ScaleOutCooldown"]) == (300, 60)
+
+
+def test_serverless_endpoint_skips_autoscaling(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["endpoint"] = {"mode": "serverless", "serverless": {"memory_size_mb": 2048, "max_concurrency": 5}}
+    states = state_machine_definitions(synth_sagemaker_stack(sagemaker_configs))[STATE_MACHINE_NAME]["States"]
+
+    config = states["CreateEndpointConfig"]
+    assert config["Resource"].endswith(":states:::aws-sdk:sagemaker:createEndpointConfig")
+    variant = config["Parameters"]["ProductionVariants"][0]
+    assert variant["ServerlessConfig"] == {"MemorySizeInMB": 2048, "MaxConcurrency": 5}
+    assert "InstanceType" not in variant
+    assert "RegisterScalableTarget" not in states
+    assert "Next" not in states["EndpointInService"]
+    assert states["EndpointStatus"]["Choices"][1]["Next"] == "EndpointUpdateRolledBack"
+
+
+@pytest.mark.parametrize("endpoint", [
+    {"mode": "multi-model"},
+    {"mode": "instance", "autoscaling": {"min_capacity": 3, "max_capacity": 2}},
+    {"mode": "serverless", "serverless": {"memory_size_mb": 1500}},
+    {"mode": "serverless", "serverless": {"max_concurrency": 2, "provisioned_concurrency": 4}},
+    {"mode": "serverless", "rollout": {"mode": "linear"}},
+    {"rollout": {"mode": "linear", "step_percent": 0}},
+])
+def test_invalid_endpoint_settings(endpoint):
+    with pytest.raises(ValueError):
+        endpoint_settings(endpoint)
+
+
+def test_existing_endpoint_is_updated_in_place(sagemaker_configs, state_machine_definitions):
+    states = state_machine_definitions(synth_sagemaker_stack(sagemaker_configs))[STATE_MACHINE_NAME]["States"]
+
+    assert states["CreateEndpointConfig"]["Next"] == "FindEndpoint"
+    assert states["CheckEndpointName"]["Parameters"]["Exists.$"] == \
+        "States.ArrayContains($.FindEndpointResults.EndpointNames, 'mammography-classification-endpoint')"
+    choice = states["EndpointExists"]
+    assert choice["Choices"][0]["Next"] == "DeregisterScalableTarget"
+    assert choice["Default"] == "CreateEndpoint"
+
+    # the scalable target may not be registered yet
+    assert states["DeregisterScalableTarget"]["Catch"][0]["Next"] == "UpdateEndpoint"
+    assert states["DeregisterScalableTarget"]["Next"] == "UpdateEndpoint"
+    assert states["UpdateEndpoint"]["Resource"].endswith(":states:::sagemaker:updateEndpoint")
+    # both branches wait for InService with the new config
+    assert states["UpdateEndpoint"]["Next"] == states["CreateEndpoint"]["Next"] == "WaitForEndpoint"
+    in_service = states["EndpointStatus"]["Choices"][0]
+    assert in_service["Next"] == "EndpointInService"
+    assert in_service["And"][1] == {"Variable": "$.DescribeEndpointResults.EndpointConfigName",
+                                    "StringEqualsPath": "$.TrainJobResults.ModelName"}
+    # the previous config gets its autoscaling back before the execution fails
+    assert states["EndpointStatus"]["Choices"][1]["Next"] == "RestoreScalableTarget"
+    assert states["EndpointStatus"]["Choices"][2]["Next"] == "RestoreScalableTarget"
+    assert states["RestoreScalableTarget"]["Parameters"] == states["RegisterScalableTarget"]["Parameters"]
+    assert states["RestoreScalableTarget"]["Next"] == "RestoreScalingPolicy"
+    assert states["RestoreScalingPolicy"]["Parameters"] == states["PutScalingPolicy"]["Parameters"]
+    assert states["RestoreScalingPolicy"]["Next"] == "FailedUpdate"
+    assert states["RestoreScalableTarget"]["Catch"][0]["Next"] == "FailedUpdate"
+    assert states["FailedUpdate"]["Choices"][0]["Next"] == "EndpointFailed"
+    assert states["FailedUpdate"]["Default"] == "EndpointUpdateRolledBack"
+
+
+def test_linear_rollout_shifts_traffic_gradually(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["endpoint"] = {"autoscaling": None,
+                                     "rollout": {"mode": "linear", "step_percent": 50, "wait_seconds": 600}}
+    template = synth_sagemaker_stack(sagemaker_configs)
+    states = state_machine_definitions(template)[STATE_MACHINE_NAME]["States"]
+
+    assert states["EndpointExists"]["Choices"][0]["Next"] == "UpdateEndpoint"
+    update = states["UpdateEndpoint"]
+    assert update["Resource"].endswith(":states:::aws-sdk:sagemaker:updateEndpoint")
+    assert update["Parameters"]["DeploymentConfig"]["BlueGreenUpdatePolicy"] == {
+        "TrafficRoutingConfiguration": {"Type": "LINEAR", "WaitIntervalInSeconds": 600,
+                                        "LinearStepSize": {"Type": "CAPACITY_PERCENT", "Value": 50}},
+        "TerminationWaitInSeconds": 300,
+    }
+    # 2 steps of 10 minutes and the termination wait on top of the 90 minutes
+    assert rollout_seconds(endpoint_settings(sagemaker_configs["endpoint"])["rollout"]) == 1500
+
+
+def test_canary_rollout_moves_the_rest_at_once():
+    config = deployment_config({"mode": "canary", "step_percent": 10, "wait_seconds": 120,
+                                "termination_wait_seconds": 0})
+    routing = config["BlueGreenUpdatePolicy"]["TrafficRoutingConfiguration"]
+    assert routing == {"Type": "CANARY", "WaitIntervalInSeconds": 120,
+                       "CanarySize": {"Type": "CAPACITY_PERCENT", "Value": 10}}
+    assert deployment_config({**config, "mode": "all_at_once"}) is None
+
+
+def test_hyperparameter_search_deploys_the_best_job(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["hyperparameter_search"] = {
+        "grid": {"num_layers": [18, 34], "learning_rate": ["0.001", "0.01", "0.1"]},
+        "max_parallel_jobs": 3,
+    }
+    template = synth_sagemaker_stack(sagemaker_configs)
+    definition = state_machine_definitions(template)[STATE_MACHINE_NAME]
+    states = definition["States"]
+
+    assert definition["StartAt"] == "CreateHyperParameterTuningJob"
+    tuning = states["CreateHyperParameterTuningJob"]
+    assert tuning["Resource"].endswith(":states:::sagemaker:createHyperParameterTuningJob.sync")
+    config = tuning["Parameters"]["HyperParameterTuningJobConfig"]
+    assert config["Strategy"] == "Grid"
+    assert config["HyperParameterTuningJobObjective"] == {"Type": "Maximize", "MetricName": "validation:accuracy"}
+    assert config["ResourceLimits"] == {"MaxParallelTrainingJobs": 3}
+    assert config["ParameterRanges"]["CategoricalParameterRanges"] == [
+        {"Name": "num_layers", "Values": ["18", "34"]},
+        {"Name": "learning_rate", "Values": ["0.001", "0.01", "0.1"]},
+    ]
+    job = tuning["Parameters"]["TrainingJobDefinition"]
+    assert "num_layers" not in job["StaticHyperParameters"]
+    assert job["StaticHyperParameters"]["epochs"] == "20"
+    assert [channel["ChannelName"] for channel in job["InputDataConfig"]] == \
+        ["train", "validation", "train_lst", "validation_lst"]
+    # 6 jobs, 3 at a time: 2 waves of up to the 2 h max runtime
+    assert tuning["TimeoutSeconds"] == 2 * 2 * 3600
+
+    assert tuning["Next"] == "DescribeBestTrainingJob"
+    best = states["DescribeBestTrainingJob"]
+    assert best["Parameters"] == {"TrainingJobName.$": "$.TuningJobResults.BestTrainingJobName"}
+    assert best["ResultPath"] == "$.TrainJobResults"
+    assert best["Next"] == "CreateModel"
+    assert "CreateTrainingJob" not in states
+
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {"Statement": assertions.Match.array_with([assertions.Match.object_like({
+            "Action": ["events:PutTargets", "events:PutRule", "events:DescribeRule"],
+        })])},
+    })
+
+
+def test_hyperparameter_grid_limits():
+    assert hyperparameter_search(None, {}) is None
+    with pytest.raises(ValueError):
+        hyperparameter_search({"grid": {"epochs": []}}, {})
+    with pytest.raises(ValueError):
+        hyperparameter_search({"grid": {"a": list(range(30)), "b": list(range(30))}}, {})
+
+
+def test_spot_training_checkpoints_and_reports_billable_time(sagemaker_configs, state_machine_definitions):
+    sagemaker_configs["spot_training"] = {"enabled": True, "max_wait_hours": 6}
+    template = synth_sagemaker_stack(sagemaker_configs)
+    states = state_machine_definitions(template)[STATE_MACHINE_NAME]["States"]
+
+    training = states["CreateTrainingJob"]
+    assert training["Resource"].endswith(":states:::sagemaker:createTrainingJob.sync")
+    parameters = training["Parameters"]
+    assert parameters["EnableManagedSpotTraining"] is True
+    assert parameters["StoppingCondition"] == {"MaxRuntimeInSeconds": 7200, "MaxWaitTimeInSeconds": 6 * 3600}
+    assert parameters["CheckpointConfig"] == {"S3Uri.$": "$.s3_checkpoint_location",
+                                              "LocalPath": "/opt/ml/checkpoints"}
+    # the rest of the task is unchanged
+    assert parameters["TrainingJobName.$"] == "$.smJobName"
+    assert parameters["ResourceConfig"]["InstanceType"] == "ml.p3.2xlarge"
+    assert training["TimeoutSeconds"] == 6 * 3600
+    assert training["ResultSelector"]["BillableTimeInSeconds.$"] == "$.BillableTimeInSeconds"
+
+    assert training["Next"] == "ReportTrainingTime"
+    metrics = states["ReportTrainingTime"]["Parameters"]["MetricData"]
+    assert [(metric["MetricName"], metric["Value.$"]) for metric in metrics] == [
+        ("TrainingSeconds", "$.TrainJobResults.TrainingTimeInSeconds"),
+        ("BillableTrainingSeconds", "$.TrainJobResults.BillableTimeInSeconds"),
+    ]
+    assert states["ReportTrainingTime"]["Next"] == "CreateModel"
+
+
+def test_on_demand_training_is_unchanged(sagemaker_configs, state_machine_definitions):
+    states = state_machine_definitions(synth_sagemaker_stack(sagemaker_configs))[STATE_MACHINE_NAME]["States"]
+
+    assert "EnableManagedSpotTraining" not in states["CreateTrainingJob"]["Parameters"]
+    assert states["CreateTrainingJob"]["Next"] == "CreateModel"
+    # the task waits as long as SageMaker lets the job run
+    assert states["CreateTrainingJob"]["TimeoutSeconds"] == 2 * 3600
+
+
+def test_spot_wait_must_cover_the_runtime():
+    assert spot_training({"enabled": False}, 2) is None
+    with pytest.raises(ValueError):
+        spot_training({"enabled": True, "max_wait_hours": 1}, 2)
+
+
+SYNTH_WITH_LAYERS = """
+import json, sys
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+from mammo_scan_ecs.sagemaker_stack import SageMakerStack
+
+app = core.App()
+stack = SageMakerStack(app, "SagemakerStack", sagemaker_configs=json.loads(sys.argv[1]))
+print(json.dumps(assertions.Template.from_stack(stack).to_json()))
+"""
+
+PANDAS_LAYER_ARN = "arn:aws:lambda:us-east-1:123456789012:layer:AWSSDKPandas-Python39:1"
+
+
+def test_batch_transform_workflow(sagemaker_configs, state_machine_definitions, synth_in_asset_dir):
+    sagemaker_configs["batch_transform"] = {"enabled": True, "instance_count": 3, "max_concurrent_transforms": 4,
+                                            "preprocess_concurrency": 20, "pandas_layer_arn": PANDAS_LAYER_ARN}
+    template = synth_in_asset_dir(SYNTH_WITH_LAYERS, sagemaker_configs)
+    definition = state_machine_definitions(template)["batch-classification-state-machine"]
+    states = definition["States"]
+
+    order = [definition["StartAt"]]
+    while "Next" in states[order[-1]]:
+        order.append(states[order[-1]]["Next"])
+    assert order == ["PrepareBatch", "PreprocessChunks", "DescribeServingEndpoint",
+                     "DescribeServingEndpointConfig", "CreateTransformJob", "AggregateResults"]
+
+    preprocess = states["PreprocessChunks"]
+    assert preprocess["ItemsPath"] == "$.Batch.chunks"
+    assert preprocess["MaxConcurrency"] == 20
+    assert preprocess["Parameters"]["manifest.$"] == "$$.Map.Item.Value"
+
+    transform = states["CreateTransformJob"]
+    assert transform["Resource"].endswith(":states:::sagemaker:createTransformJob.sync")
+    parameters = transform["Parameters"]
+    assert parameters["ModelName.$"] == "$.ServingModel.ModelName"
+    assert parameters["BatchStrategy"] == "SingleRecord"
+    assert parameters["MaxConcurrentTransforms"] == 4
+    assert parameters["TransformResources"] == {"InstanceCount": 3, "InstanceType": "ml.m5.large"}
+    assert parameters["TransformInput"]["ContentType"] == "application/x-image"
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "lambda_batch_results.lambda_handler",
+        "Layers": assertions.Match.array_with([PANDAS_LAYER_ARN]),
+    })
+
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+def test_batch_transform_settings():
+    assert batch_transform_settings(None) is None
+    assert batch_transform_settings({"instance_count": 2}) is None
+    with pytest.raises(ValueError):
+        batch_transform_settings({"enabled": True, "batch_strategy": "Whole", "pandas_layer_arn": PANDAS_LAYER_ARN})
+    with pytest.raises(ValueError, match="pandas_layer_arn"):
+        batch_transform_settings({"enabled": True, "instance_count": 2})
@@ -0,0 +1,69 @@
+import pytest
+
+from benchmarks.stubs import StubSSM
+from mammo_common.parameters import ParameterCache
+
+KNOWN_PARAMETERS = {"resize-img-endpoint": "https://api.example.com/prod/", "resize-lambda": "resize-function"}
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def ssm():
+    return StubSSM(KNOWN_PARAMETERS)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_ssm_calls_across_1000_requests(ssm, clock):
+    cache = ParameterCache(ssm, ttl=300, names=list(KNOWN_PARAMETERS), clock=clock)
+    cache.prefetch()
+
+    # one request every 0.5 s, i.e. 500 s of traffic
+    for _ in range(1000):
+        assert cache.get("resize-img-endpoint") == KNOWN_PARAMETERS["resize-img-endpoint"]
+        assert cache.get("resize-lambda") == KNOWN_PARAMETERS["resize-lambda"]
+        cache.wait_for_refresh()
+        clock.now += 0.5
+
+    assert ssm.calls["GetParameters"] == 1
+    # refreshed ahead of expiry at 240 s and 480 s, never fetched synchronously after a miss
+    assert ssm.calls["GetParameter"] == 4
+
+
+def test_prefetch_batches_by_ten(clock):
+    names = ["param-{}".format(i) for i in range(25)]
+    ssm = StubSSM({name: name.upper() for name in names})
+    cache = ParameterCache(ssm, names=names, clock=clock)
+
+    cache.prefetch()
+
+    assert ssm.calls["GetParameters"] == 3
+    assert cache.get("param-24") == "PARAM-24"
+    assert ssm.calls["GetParameter"] == 0
+
+
+def test_serves_last_known_value_when_throttled(ssm, clock):
+    cache = ParameterCache(ssm, ttl=300, clock=clock)
+    assert cache.get("resize-lambda") == "resize-function"
+
+    ssm.error_code = "ThrottlingException"
+    clock.now += 1000
+
+    assert cache.get("resize-lambda") == "resize-function"
+
+
+def test_unknown_parameter_without_cached_value_raises(ssm, clock):
+    cache = ParameterCache(ssm, clock=clock)
+    with pytest.raises(Exception):
+        cache.get("missing")
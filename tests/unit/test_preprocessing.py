@@ -0,0 +1,160 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks import images
+from mammo_common import preprocessing
+
+
+@pytest.fixture
+def mammogram():
+    return images.synthetic_mammogram(1300, 2500)
+
+
+@pytest.mark.parametrize("ext, expected", [(".jpg", ("jpeg", 1300, 2500, 1)), (".png", ("png", 1300, 2500, 1))])
+def test_read_image_header(mammogram, ext, expected):
+    assert preprocessing.read_image_header(images.encode(mammogram, ext)) == expected
+
+
+def test_read_image_header_color_jpeg(mammogram):
+    color = cv2.cvtColor(mammogram, cv2.COLOR_GRAY2BGR)
+    assert preprocessing.read_image_header(images.encode(color, ".jpg")) == ("jpeg", 1300, 2500, 3)
+
+
+def test_read_image_header_unknown_format():
+    assert preprocessing.read_image_header(b"GIF89a...") is None
+
+
+@pytest.mark.parametrize("width, height, factor", [(4000, 5300, 8), (1300, 2500, 8), (700, 1300, 4), (300, 600, 2), (200, 400, 1)])
+def test_reduced_decode_factor_keeps_target_resolution(width, height, factor):
+    assert preprocessing.reduced_decode_factor(width, height) == factor
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale(mammogram):
+    jpeg = images.encode(mammogram, ".jpg")
+
+    assert preprocessing.decode_flag(jpeg) == cv2.IMREAD_REDUCED_GRAYSCALE_8
+    assert preprocessing.decode_image(jpeg, preprocessing.TARGET_SIZE).shape == (313, 163)
+
+
+def test_png_keeps_full_decode_and_bit_depth(mammogram):
+    png16 = images.encode(mammogram.astype(np.uint16) * 16, ".png")
+
+    assert preprocessing.decode_flag(png16) == cv2.IMREAD_UNCHANGED
+    resized = preprocessing.decode_image(preprocessing.preprocess_image(png16))
+    assert resized.dtype == np.uint8 and resized.shape == (300, 150)
+    # 12-bit values are scaled to the 8-bit range, not clipped
+    assert resized.max() > 200
+
+
+def test_reduced_decode_matches_full_decode(mammogram):
+    jpeg = images.encode(mammogram, ".jpg")
+    full = preprocessing.resize_image(preprocessing.decode_image(jpeg))
+    reduced = preprocessing.decode_image(preprocessing.preprocess_image(jpeg))
+
+    assert np.abs(full.astype(int) - reduced.astype(int)).mean() < 4
+
+
+@pytest.mark.parametrize("options, signature", [
+    ({"output_format": "png"}, b"\x89PNG"),
+    ({"output_format": "jpeg", "jpeg_quality": 80}, b"\xff\xd8"),
+])
+def test_output_encoding_is_configurable(mammogram, options, signature):
+    assert preprocessing.preprocess_image(images.encode(mammogram), **options).startswith(signature)
+
+
+def test_encode_options_from_env(monkeypatch):
+    monkeypatch.setenv("OUTPUT_FORMAT", "png")
+    monkeypatch.setenv("PNG_COMPRESSION", "1")
+    assert preprocessing.encode_options_from_env() == {"output_format": "png", "jpeg_quality": 95, "png_compression": 1}
+
+
+def test_find_roi_crops_background(mammogram):
+    height, width = mammogram.shape
+    x0, y0, x1, y1 = preprocessing.find_roi(mammogram, padding=0)
+    assert (x1 - x0) * (y1 - y0) < width * height
+    cropped = preprocessing.crop_to_roi(mammogram, padding=0)
+    assert cropped.shape == (y1 - y0, x1 - x0)
+    # the crop is a view of the decoded image
+    assert np.shares_memory(cropped, mammogram)
+
+
+def test_find_roi_without_tissue_keeps_full_frame():
+    blank = np.zeros((400, 300), dtype=np.uint8)
+    assert preprocessing.find_roi(blank) == (0, 0, 300, 400)
+
+
+def test_roi_crop_keeps_output_size(mammogram):
+    encoded = images.encode(mammogram)
+    cropped = preprocessing.decode_image(preprocessing.preprocess_image(encoded, roi_padding=0.02))
+    assert cropped.shape == (preprocessing.TARGET_SIZE[1], preprocessing.TARGET_SIZE[0])
+
+
+def test_roi_padding_from_env(monkeypatch):
+    monkeypatch.delenv("ROI_CROP", raising=False)
+    assert preprocessing.roi_padding_from_env() is None
+    monkeypatch.setenv("ROI_CROP", "true")
+    monkeypatch.setenv("ROI_PADDING", "0.05")
+    assert preprocessing.roi_padding_from_env() == 0.05
+
+
+@pytest.fixture
+def mammogram_16bit(mammogram):
+    # 12-bit stored values, as written by digital mammography detectors
+    return mammogram.astype(np.uint16) * 16
+
+
+def test_read_image_header_dicom(mammogram_16bit):
+    assert preprocessing.read_image_header(images.encode_dicom(mammogram_16bit)) == ("dicom", 1300, 2500, 1)
+
+
+def test_dicom_reduced_decode_matches_full_decode(mammogram_16bit):
+    dicom_bytes = images.encode_dicom(mammogram_16bit)
+    reduced = preprocessing.decode_image(dicom_bytes, preprocessing.TARGET_SIZE)
+    full = preprocessing.decode_image(dicom_bytes)
+    assert reduced.dtype == np.uint8
+    assert full.shape == mammogram_16bit.shape
+    assert reduced.shape == (2500 // 8, 1300 // 8)
+
+    reduced = preprocessing.resize_image(reduced).astype(int)
+    full = preprocessing.resize_image(full).astype(int)
+    assert np.abs(reduced - full).mean() < 2
+
+
+def test_dicom_multi_frame_reads_the_central_frame(mammogram_16bit):
+    frames = [np.zeros_like(mammogram_16bit), mammogram_16bit, np.full_like(mammogram_16bit, 4095)]
+    dicom_bytes = images.encode_dicom(frames)
+
+    central = preprocessing.decode_dicom(dicom_bytes)
+    assert (central == preprocessing.decode_dicom(images.encode_dicom(mammogram_16bit))).all()
+    assert preprocessing.decode_dicom(dicom_bytes, frame=0).max() == 0
+    assert preprocessing.decode_dicom(dicom_bytes, frame=2).min() == 255
+    with pytest.raises(ValueError, match="out of range"):
+        preprocessing.decode_dicom(dicom_bytes, frame=3)
+
+
+def test_dicom_window_and_monochrome1():
+    ramp = np.tile(np.arange(0, 4096, 16, dtype=np.uint16), (10, 1))
+    windowed = preprocessing.decode_dicom(images.encode_dicom(ramp, window=(2048, 1024)))
+    assert windowed[0, ramp[0] < 1536].max() == 0
+    assert windowed[0, ramp[0] >= 2560].min() == 255
+
+    inverted = preprocessing.decode_dicom(images.encode_dicom(ramp, window=(2048, 1024), photometric="MONOCHROME1"))
+    assert (inverted == 255 - windowed).all()
+
+
+def test_dicom_jpeg_frames_use_the_reduced_jpeg_decode(mammogram):
+    dicom_bytes = images.encode_dicom([mammogram, mammogram], jpeg=True)
+    # libjpeg rounds the reduced size up
+    assert preprocessing.decode_image(dicom_bytes, preprocessing.TARGET_SIZE).shape == (-(-2500 // 8), -(-1300 // 8))
+    assert len(preprocessing.preprocess_image(dicom_bytes)) > 0
+
+
+def test_only_8_bit_pngs_at_the_model_size_are_model_ready():
+    image = np.full((300, 150), 100, dtype=np.uint8)
+
+    assert preprocessing.is_model_ready(images.encode(image, ".png"))
+    assert preprocessing.is_model_ready(images.encode(np.dstack([image] * 3), ".png"))
+    # 16-bit and RGBA PNGs still need the preprocessing
+    assert not preprocessing.is_model_ready(images.encode(image.astype(np.uint16) * 16, ".png"))
+    assert not preprocessing.is_model_ready(images.encode(np.dstack([image] * 4), ".png"))
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+import lambda_invoke_classifier
+import lambda_resize_image
+from benchmarks import images
+from benchmarks.stubs import StubLambda, StubS3, StubSageMaker, StubSageMakerRuntime, StubSSM
+from mammo_common import parameters, prediction_cache, preprocessing, tracing
+from scripts import latency_breakdown
+
+BUCKET = lambda_invoke_classifier.bucket
+FILENAME = "scan.jpg"
+
+
+@pytest.fixture
+def lambda_mode(monkeypatch):
+    s3 = StubS3({(BUCKET, "{}/{}".format(preprocessing.ORIGINAL_PREFIX, FILENAME)):
+                 images.encode(images.synthetic_mammogram(600, 800))})
+    ssm = StubSSM({"resize-lambda": "resize-function"})
+    monkeypatch.setattr(lambda_resize_image, "s3", s3)
+    monkeypatch.setattr(lambda_invoke_classifier, "s3", s3)
+    monkeypatch.setattr(lambda_invoke_classifier, "ssm_parameters", parameters.ParameterCache(ssm))
+    monkeypatch.setattr(lambda_invoke_classifier, "lambda_client",
+                        StubLambda({"resize-function": lambda_resize_image.lambda_handler}))
+    monkeypatch.setattr(lambda_invoke_classifier, "sagemaker", StubSageMakerRuntime())
+    monkeypatch.setattr(lambda_invoke_classifier, "sagemaker_control", StubSageMaker())
+    monkeypatch.setattr(lambda_invoke_classifier, "model_version", {"value": None, "expires_at": 0})
+    monkeypatch.setattr(lambda_invoke_classifier, "predictions", prediction_cache.PredictionCache())
+    monkeypatch.setattr(lambda_invoke_classifier, "PREPROCESS_MODE", "lambda")
+
+
+def emf_documents(output):
+    return [document for document in map(latency_breakdown.parse_line, output.splitlines()) if document]
+
+
+def test_span_records_every_call():
+    trace = tracing.Trace("test", "trace-1")
+    for _ in range(2):
+        with trace.span("decode"):
+            pass
+
+    document = trace.emf()
+    assert len(document["decode"]) == 2
+    assert document["trace_id"] == "trace-1"
+    assert {"Name": "decode", "Unit": "Milliseconds"} in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+    assert document["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Function", "ColdStart", "PayloadSize"]]
+
+
+def test_span_without_trace_is_a_plain_block():
+    assert tracing.current() is None
+    with tracing.span("decode"):
+        value = 1
+    assert value == 1
+
+
+def test_trace_id_is_propagated_to_the_resize_lambda(lambda_mode, capsys):
+    event = {"body": json.dumps({"filename": FILENAME}), "headers": {"X-Correlation-Id": "request-42"}}
+    response = lambda_invoke_classifier.lambda_handler(event, None)
+
+    assert response["headers"]["X-Correlation-Id"] == "request-42"
+    documents = {document["Function"]: document for document in emf_documents(capsys.readouterr().out)}
+    assert documents["classify"]["trace_id"] == documents["resize"]["trace_id"] == "request-42"
+    assert {"s3_get_original", "decode", "resize", "encode", "s3_put_resized"} <= set(documents["resize"])
+    assert {"ssm", "resize_lambda", "s3_get_resized", "invoke_endpoint"} <= set(documents["classify"])
+    assert tracing.current() is None
+
+
+def test_errors_are_logged_with_the_trace_id(lambda_mode, capsys):
+    event = {"body": json.dumps({"filename": "missing.jpg"}), "headers": {"X-Correlation-Id": "request-43"}}
+    with pytest.raises(ValueError):
+        lambda_invoke_classifier.lambda_handler(event, None)
+
+    errors = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"error"' in line]
+    assert errors[0]["trace_id"] == "request-43" and errors[0]["error"] == "ValueError"
+
+
+def test_latency_breakdown_aggregates_stages(lambda_mode, capsys):
+    for _ in range(3):
+        lambda_invoke_classifier.lambda_handler({"body": json.dumps({"filename": FILENAME})}, None)
+    documents = emf_documents(capsys.readouterr().out)
+
+    result = latency_breakdown.breakdown(documents)
+    stages = {stage for (function, _), summary in result.items() if function == "resize" for stage in summary}
+    assert {"decode", "total"} <= stages
+    counts = sum(summary["invoke_endpoint"]["count"] for (function, _), summary in result.items()
+                 if function == "classify")
+    # the last two calls are cache hits
+    assert counts == 1
+
+
+def test_parse_line_accepts_cloudwatch_prefixes():
+    line = '2024-01-01T00:00:00Z\trequest-id\t{"_aws": {"CloudWatchMetrics": []}, "Function": "resize"}'
+    assert latency_breakdown.parse_line(line)["Function"] == "resize"
+    assert latency_breakdown.parse_line('{"prediction_cache": {}}') is None
+
+
+def test_measurements_are_emitted_as_metrics(capsys):
+    tracing.start("test", "trace-1")
+    tracing.measure("RoiBytesSaved", 1024, "Bytes")
+    tracing.finish()
+
+    document, = emf_documents(capsys.readouterr().out)
+    assert document["RoiBytesSaved"] == 1024
+    assert {"Name": "RoiBytesSaved", "Unit": "Bytes"} in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]
@@ -0,0 +1,77 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from mammo_scan_ecs.vpc_config import vpc_settings
+from mammo_scan_ecs.vpc_stack import MammoScanVpcStack
+
+
+def synth_vpc_stack(vpc_configs=None):
+    app = core.App()
+    stack = MammoScanVpcStack(app, "VpcStack", vpc_configs=vpc_configs)
+    return assertions.Template.from_stack(stack)
+
+
+def endpoints(template, endpoint_type):
+    """:return: {service suffix: properties} of the VPC endpoints of a type"""
+    found = template.find_resources("AWS::EC2::VPCEndpoint", {"Properties": {"VpcEndpointType": endpoint_type}})
+    return {resource["Properties"]["ServiceName"]["Fn::Join"][1][-1]: resource["Properties"]
+            for resource in found.values()}
+
+
+def private_route_tables(template):
+    tables = template.find_resources("AWS::EC2::RouteTable")
+    return sorted(name for name in tables if "private" in name)
+
+
+def test_default_vpc_has_one_nat_and_no_endpoints():
+    template = synth_vpc_stack()
+
+    template.resource_count_is("AWS::EC2::NatGateway", 1)
+    template.resource_count_is("AWS::EC2::VPCEndpoint", 0)
+
+
+def test_endpoints_and_nat_per_az():
+    template = synth_vpc_stack({"nat_gateways": 2, "vpc_endpoints": True})
+
+    template.resource_count_is("AWS::EC2::NatGateway", 2)
+
+    gateways = endpoints(template, "Gateway")
+    assert sorted(gateways) == [".dynamodb", ".s3"]
+    private_tables = private_route_tables(template)
+    assert len(private_tables) == 2
+    for properties in gateways.values():
+        # the routes go into the route tables of the private subnets only
+        assert sorted(table["Ref"] for table in properties["RouteTableIds"]) == private_tables
+
+    interfaces = endpoints(template, "Interface")
+    assert sorted(interfaces) == [".lambda", ".sagemaker.runtime", ".ssm"]
+    for properties in interfaces.values():
+        assert properties["PrivateDnsEnabled"] is True
+        assert all("private" in subnet["Ref"] for subnet in properties["SubnetIds"])
+        assert len(properties["SubnetIds"]) == 2
+
+    # each private subnet still reaches the internet through the NAT of its AZ
+    routes = template.find_resources("AWS::EC2::Route", {"Properties": {"DestinationCidrBlock": "0.0.0.0/0"}})
+    nat_routes = {route["Properties"]["RouteTableId"]["Ref"]: route["Properties"]["NatGatewayId"]["Ref"]
+                  for route in routes.values() if "NatGatewayId" in route["Properties"]}
+    assert sorted(nat_routes) == private_tables
+    assert len(set(nat_routes.values())) == 2
+
+
+def test_interface_endpoints_are_configurable():
+    template = synth_vpc_stack({"vpc_endpoints": True, "gateway_endpoints": ["s3"],
+                                "interface_endpoints": ["sagemaker.runtime", "sqs"]})
+
+    assert sorted(endpoints(template, "Gateway")) == [".s3"]
+    assert sorted(endpoints(template, "Interface")) == [".sagemaker.runtime", ".sqs"]
+
+
+@pytest.mark.parametrize("vpc_configs, message", [
+    ({"nat_gateways": 0}, "nat_gateways"),
+    ({"nat_gateways": 3, "max_azs": 2}, "nat_gateways"),
+    ({"vpc_endpoints": True, "gateway_endpoints": ["sqs"]}, "Gateway endpoints"),
+])
+def test_vpc_settings_are_validated(vpc_configs, message):
+    with pytest.raises(ValueError, match=message):
+        vpc_settings(vpc_configs)
@@ -1,14 +1,22 @@
 import boto3
+from mammo_common.parameters import ParameterCache
 
 region_name = boto3.Session().region_name
 
+# Parameters read by the pages, loaded in one GetParameters call at startup
+KNOWN_PARAMETERS = ['resize-img-endpoint']
+
+# Streamlit re-runs the page scripts on every interaction, but this module is
+# imported once per process, so the cache is shared by all reruns and sessions.
+parameters = ParameterCache(boto3.client("ssm", region_name=region_name), names=KNOWN_PARAMETERS)
+try:
+    parameters.prefetch()
+except Exception as e:
+    print("SSM prefetch failed: {}".format(e))
+
 
 def get_parameter(name):
     """
     This function retrieves a specific value from Systems Manager"s ParameterStore.
     """     
-    ssm_client = boto3.client("ssm",region_name=region_name)
-    response = ssm_client.get_parameter(Name=name)
-    value = response["Parameter"]["Value"]
-    
-    return value
\ No newline at end of file
+    return parameters.get(name)
@@ -1,63 +1,249 @@
-
 import streamlit as st
 import requests
+import os
 from configs import *
 from PIL import Image
 import boto3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from mammo_common import preprocessing
 
 
-image = Image.open("./img/sagemaker.png")
-st.image(image, width=80)
-st.header("Mammography Image Processing")
-st.caption("Using custom model from Mammography Images")
-
+BUCKET = "mammo-v2-ecs-model-files"
 
+# Polling of asynchronous jobs: first delay, growth factor, cap and overall budget
+POLL_INITIAL_DELAY = 0.5
+POLL_BACKOFF = 1.5
+POLL_MAX_DELAY = 5
+JOB_TIMEOUT = 180
 
-api_endpoint_url = get_parameter('resize-img-endpoint')
-region_name = boto3.Session().region_name
+# Uploads and classifications in flight at once, across all files of a study
+MAX_WORKERS = 4
+# How long the endpoint URL read from SSM is kept by the page
+ENDPOINT_URL_TTL = 300
+# Images up to this size are sent in the request body instead of being staged
+# in S3 first; larger ones go through an upload and an asynchronous job
+INLINE_MAX_BYTES = int(os.environ.get("INLINE_MAX_BYTES", str(4 * 1024 * 1024)))
+# Keep a copy of inline images in S3, uploaded in the background
+PERSIST_ORIGINALS = os.environ.get("PERSIST_ORIGINALS", "true") == "true"
+# Not under downloaded/original/, so the copy does not trigger the upload preprocessing
+ARCHIVE_PREFIX = "downloaded/archive"
+# Resize in this process, with the preprocessing code of the Lambda functions,
+# and send only the model-ready image; the original is then uploaded only
+# when PERSIST_ORIGINALS keeps a copy
+WEB_PREPROCESS = os.environ.get("WEB_PREPROCESS", "false") == "true"
+# Same output encoding and crop as the Lambda functions, set by the stack
+ENCODE_OPTIONS = preprocessing.encode_options_from_env()
+ROI_PADDING = preprocessing.roi_padding_from_env()
+OUTPUT_CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+# Accepted uploads and the Content-Type they are sent with (API Gateway binary media types)
+CONTENT_TYPES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "dcm": "application/dicom"}
 
-s3 = boto3.client('s3',
-                  aws_access_key_id=st.secrets.s3_credentials.access_key,
-                  aws_secret_access_key=st.secrets.s3_credentials.secret_key,
-                  region_name=region_name)
 
+# Streamlit re-runs this script on every interaction; the resources below are
+# created once per process and shared by all reruns and sessions.
+@st.cache_resource
+def load_logo():
+    return Image.open("./img/sagemaker.png")
 
-uploaded_file = st.file_uploader("Upload an image", type=["jpg"], accept_multiple_files=False)
 
+@st.cache_resource
+def get_s3_client():
+    return boto3.client('s3',
+                        aws_access_key_id=st.secrets.s3_credentials.access_key,
+                        aws_secret_access_key=st.secrets.s3_credentials.secret_key,
+                        region_name=boto3.Session().region_name)
 
-if uploaded_file:
 
-    file = uploaded_file.name.split('.')[0]
-    ext = uploaded_file.name.split('.')[-1]
+@st.cache_resource
+def get_http_session():
+    # keeps the connections to API Gateway open between requests
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS))
+    return session
 
-    filename = f"{file}-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.{ext}"
-    st.image(uploaded_file.getvalue())
 
-    if st.button("Process"):       
-        with st.spinner("Wait for it..."):
-            try:
-                
-                s3.upload_fileobj(uploaded_file, "mammo-v2-ecs-model-files", f'downloaded/original/{filename}')
-                r = requests.post(api_endpoint_url, json={"filename": filename}, timeout=180)
-                data = r.json()
-                prediction = data["prediction"]
-                st.write(prediction)
+@st.cache_resource(ttl=ENDPOINT_URL_TTL)
+def get_api_url():
+    return get_parameter('resize-img-endpoint').rstrip('/')
 
-            except requests.exceptions.ConnectionError as errc:
-                st.error("Error Connecting:", errc)
 
-            except requests.exceptions.HTTPError as errh:
-                st.error("Http Error:", errh)
+def get_jobs_url():
+    return get_api_url() + '/jobs'
 
-            except requests.exceptions.Timeout as errt:
-                st.error("Timeout Error:", errt)
 
-            except requests.exceptions.RequestException as err:
-                st.error("OOps: Something Else", err)
-
-            st.success("Done!")
+@st.cache_resource
+def get_upload_executor():
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
 
+st.image(load_logo(), width=80)
+st.header("Mammography Image Processing")
+st.caption("Using custom model from Mammography Images")
 
 
+def classify(filename):
+    """Submit an asynchronous job and poll its result.
+
+    API Gateway stops REST integrations after ~29 s, so the request only
+    queues the work and the page polls GET /jobs/{id} until it is done.
+    """
+    session = get_http_session()
+    jobs_url = get_jobs_url()
+    r = session.post(jobs_url, json={"filename": filename}, timeout=30)
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+
+    delay = POLL_INITIAL_DELAY
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        r = session.get(f"{jobs_url}/{job_id}", timeout=30)
+        r.raise_for_status()
+        job = r.json()
+        if job["status"] != "QUEUED":
+            result = job["result"]["results"][0]
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            return result["prediction"]
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+    raise requests.exceptions.Timeout(f"Job {job_id} did not finish in {JOB_TIMEOUT} s")
+
+
+def classify_inline(image_bytes, content_type):
+    """Send the image itself; one request, no S3 staging."""
+    r = get_http_session().post(get_api_url() + '/', data=image_bytes, timeout=30,
+                                headers={"Content-Type": content_type, "Accept": "application/json"})
+    r.raise_for_status()
+    return r.json()["prediction"]
+
+
+def file_extension(uploaded_file):
+    return uploaded_file.name.split('.')[-1].lower()
+
+
+def preview(uploaded_file):
+    """Image shown for an uploaded file.
+
+    Browsers cannot show DICOM: the frame the API classifies (the central
+    one) is decoded to 8 bits by the same code as the Lambda functions.
+    """
+    if file_extension(uploaded_file) != "dcm":
+        return uploaded_file.getvalue()
+    return preprocessing.decode_dicom(uploaded_file.getvalue())
+
+
+def preprocess(image_bytes):
+    """:return: the model-ready image, as the classify Lambda would make it"""
+    return preprocessing.preprocess_image(image_bytes, roi_padding=ROI_PADDING, **ENCODE_OPTIONS)
+
+
+def upload_key(uploaded_file):
+    return (uploaded_file.name, uploaded_file.size)
+
+
+def start_uploads(uploaded_files):
+    """Start the S3 side of every file as soon as it is selected.
+
+    Large files are staged under downloaded/original/, which triggers the
+    resize (and prediction) through the S3 notification while the user is
+    still looking at the images. Small files are sent inline on Process, and
+    their S3 copy, if any, is only an archive nobody waits for.
+    With WEB_PREPROCESS every file is resized on a worker thread instead and
+    only the model-ready image is sent, inline.
+    Each file is handled once, not on every rerun.
+
+    :return: {upload key: {"filename", "inline", "model_ready", "content_type", "upload"}}
+    """
+    uploads = st.session_state.setdefault("uploads", {})
+    for uploaded_file in uploaded_files:
+        if upload_key(uploaded_file) in uploads:
+            continue
+        file = uploaded_file.name.split('.')[0]
+        ext = uploaded_file.name.split('.')[-1]
+        filename = f"{file}-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}.{ext}"
+        body = uploaded_file.getvalue()
+        inline = len(body) <= INLINE_MAX_BYTES and not WEB_PREPROCESS
+
+        upload = None
+        model_ready = None
+        content_type = CONTENT_TYPES[file_extension(uploaded_file)]
+        if WEB_PREPROCESS:
+            model_ready = get_upload_executor().submit(preprocess, body)
+            content_type = OUTPUT_CONTENT_TYPES[ENCODE_OPTIONS["output_format"]]
+            if PERSIST_ORIGINALS:
+                get_upload_executor().submit(get_s3_client().put_object, Bucket=BUCKET,
+                                             Key=f'{ARCHIVE_PREFIX}/{filename}', Body=body)
+        elif not inline:
+            upload = get_upload_executor().submit(get_s3_client().put_object, Bucket=BUCKET,
+                                                  Key=f'downloaded/original/{filename}', Body=body)
+        elif PERSIST_ORIGINALS:
+            get_upload_executor().submit(get_s3_client().put_object, Bucket=BUCKET,
+                                         Key=f'{ARCHIVE_PREFIX}/{filename}', Body=body)
+        uploads[upload_key(uploaded_file)] = {"filename": filename, "inline": body if inline else None,
+                                             "model_ready": model_ready, "content_type": content_type,
+                                             "upload": upload}
+    return uploads
+
+
+def process(submission):
+    if submission["model_ready"] is not None:
+        return classify_inline(submission["model_ready"].result(), submission["content_type"])
+    if submission["inline"] is not None:
+        return classify_inline(submission["inline"], submission["content_type"])
+    submission["upload"].result()
+    return classify(submission["filename"])
+
+
+def describe_error(err):
+    if isinstance(err, requests.exceptions.ConnectionError):
+        return f"Error Connecting: {err}"
+    if isinstance(err, requests.exceptions.HTTPError):
+        return f"Http Error: {err}"
+    if isinstance(err, requests.exceptions.Timeout):
+        return f"Timeout Error: {err}"
+    if isinstance(err, requests.exceptions.RequestException):
+        return f"OOps: Something Else: {err}"
+    return f"Classification failed: {err}"
+
+
+uploaded_files = st.file_uploader("Upload the images of a study", type=list(CONTENT_TYPES),
+                                  accept_multiple_files=True)
+
+
+if uploaded_files:
+
+    uploads = start_uploads(uploaded_files)
+    columns = st.columns(min(len(uploaded_files), 4))
+    for index, uploaded_file in enumerate(uploaded_files):
+        columns[index % len(columns)].image(preview(uploaded_file), caption=uploaded_file.name)
+
+    if st.button("Process"):
+        rows = [{"file": uploaded_file.name, "status": "Processing", "prediction": ""}
+                for uploaded_file in uploaded_files]
+        table = st.empty()
+        table.dataframe(rows, use_container_width=True)
+        progress = st.progress(0.0)
+
+        start = time.monotonic()
+        # the pool only runs the requests; the page is updated from this thread
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(process, uploads[upload_key(uploaded_file)]): index
+                       for index, uploaded_file in enumerate(uploaded_files)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                row = rows[futures[future]]
+                try:
+                    row["prediction"] = future.result()
+                    row["status"] = "Done"
+                except Exception as err:
+                    row["status"] = "Failed"
+                    row["prediction"] = describe_error(err)
+                table.dataframe(rows, use_container_width=True)
+                progress.progress(done / len(rows))
+
+        failed = sum(row["status"] == "Failed" for row in rows)
+        if failed:
+            st.error(f"{failed} of {len(rows)} images failed")
+        st.success(f"Done in {time.monotonic() - start:.1f} s")